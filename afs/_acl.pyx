@@ -1,5 +1,9 @@
 from afs._util cimport *
 from afs._util import pyafs_error
+from errno import E2BIG
+
+cdef extern from "stdlib.h":
+    long strtol(char *nptr, char **endptr, int base)
 
 cdef extern from "afs/prs_fs.h":
     enum:
@@ -32,17 +36,174 @@ USR5 = PRSFS_USR5
 USR6 = PRSFS_USR6
 USR7 = PRSFS_USR7
 
+# The initial size of the buffer for getAcl, and the size it can grow
+# to; ViceIoctl's out_size is an unsigned short
 DEF MAXSIZE = 2048
+DEF MAXACLSIZE = 65535
+
+def getAcl(dir, int follow=1):
+    """Retrieve the ACL of a directory, in the cache manager's format.
+
+    The buffer starts at 2KB, and is grown for as long as the cache
+    manager says it's too small, so large ACLs aren't truncated.
+    """
+    cdef bytes c_dir = c_string(dir)
+    cdef char *space = NULL
+    cdef int size = MAXSIZE
 
-def getAcl(char* dir, int follow=1):
-    cdef char space[MAXSIZE]
-    pioctl_read(dir, VIOCGETAL, space, MAXSIZE, follow)
-    return space
+    try:
+        while True:
+            space = <char *>malloc(size)
+            if space == NULL:
+                raise MemoryError
+            try:
+                pioctl_read(c_dir, VIOCGETAL, space, size, follow)
+            except OSError as e:
+                if e.errno != E2BIG or size >= MAXACLSIZE:
+                    raise
+                free(space)
+                space = NULL
+                size = min(2 * size, MAXACLSIZE)
+                continue
+            return space
+    finally:
+        free(space)
 
-def getCallerAccess(char *dir, int follow=1):
+def getCallerAccess(dir, int follow=1):
+    cdef bytes c_dir = c_string(dir)
     cdef vcxstat2 stat
-    pioctl_read(dir, VIOC_GETVCXSTATUS2, <void*>&stat, sizeof(vcxstat2), follow)
+    pioctl_read(c_dir, VIOC_GETVCXSTATUS2, <void*>&stat, sizeof(vcxstat2), follow)
     return stat.callerAccess
 
-def setAcl(char* dir, char* acl, int follow=1):
-    pioctl_write(dir, VIOCSETAL, acl, follow)
+def setAcl(dir, acl, int follow=1):
+    pioctl_write(c_string(dir), VIOCSETAL, c_string(acl), follow)
+
+# The character fs(1) uses for each right, in the order it lists them
+_charBitAssoc = [
+    ('r', READ),
+    ('l', LOOKUP),
+    ('i', INSERT),
+    ('d', DELETE),
+    ('w', WRITE),
+    ('k', LOCK),
+    ('a', ADMINISTER),
+    ('A', USR0),
+    ('B', USR1),
+    ('C', USR2),
+    ('D', USR3),
+    ('E', USR4),
+    ('F', USR5),
+    ('G', USR6),
+    ('H', USR7),
+]
+
+_char2bit = dict(_charBitAssoc)
+
+def _rightsTable(shift, nbits):
+    """Return the rights string for every value of a bit field.
+
+    The standard rights are the low 7 bits of a bitmask, and the
+    USR0-USR7 rights are the high 8, so showRights looks each half
+    up separately.
+    """
+    table = []
+    for r in range(1 << nbits):
+        table.append(''.join([c for (c, mask) in _charBitAssoc
+                              if (r << shift) & mask]))
+    return tuple(table)
+
+cdef tuple _lowRights = _rightsTable(0, 7)
+cdef tuple _highRights = _rightsTable(24, 8)
+
+def showRights(r):
+    """Takes a bitmask and returns a rwlidka string"""
+    return _lowRights[r & 0x7f] + _highRights[(r >> 24) & 0xff]
+
+# Rights strings that have been parsed before; there are only so many
+# that show up in practice, so this doesn't grow past _MAXPARSED
+cdef dict _parsedRights = {}
+DEF _MAXPARSED = 4096
+
+def parseRights(s):
+    """Parses a rwlid... rights string to bitmask"""
+    try:
+        return _parsedRights[s]
+    except KeyError:
+        pass
+    r = 0
+    try:
+        for c in s:
+            r = r | _char2bit[c]
+    except KeyError:
+        raise ValueError("Invalid rights: %r" % (s,))
+    if len(_parsedRights) < _MAXPARSED:
+        _parsedRights[s] = r
+    return r
+
+cdef char * _skipSpace(char *p):
+    while p[0] in (' ', '\t', '\n'):
+        p += 1
+    return p
+
+def parseAcl(acl):
+    """Parse an ACL in the cache manager's format.
+
+    The format is the number of positive entries, then the number of
+    negative entries, each on its own line, followed by one line per
+    entry with a name and a decimal bitmask.
+
+    Returns:
+      A (pos, neg) tuple of dictionaries mapping names to bitmasks
+    """
+    cdef bytes data = c_string(acl)
+    cdef char *p = data
+    cdef char *end
+    cdef char *name
+    cdef long npos, nneg, i
+
+    npos = strtol(p, &end, 10)
+    if end == p:
+        raise ValueError("Invalid ACL: %r" % data)
+    # The first line can have more than just the count on it
+    p = end
+    while p[0] != '\n' and p[0] != 0:
+        p += 1
+    nneg = strtol(p, &end, 10)
+    if end == p:
+        raise ValueError("Invalid ACL: %r" % data)
+    p = end
+
+    pos = {}
+    neg = {}
+    for i in range(npos + nneg):
+        p = _skipSpace(p)
+        name = p
+        while p[0] not in (' ', '\t', '\n', 0):
+            p += 1
+        if p == name:
+            raise ValueError("Invalid ACL: %r" % data)
+        key = py_string(name[:p - name])
+        rights = strtol(p, &end, 10)
+        if end == p:
+            raise ValueError("Invalid ACL: %r" % data)
+        p = end
+        if i < npos:
+            pos[key] = rights
+        else:
+            neg[key] = rights
+    return (pos, neg)
+
+def unparseAcl(pos, neg):
+    """Format an ACL in the cache manager's format; see parseAcl.
+
+    Returns:
+      The ACL as a byte string, ready for setAcl
+    """
+    lines = ['%d\n%d\n' % (len(pos), len(neg))]
+    for entries in (pos, neg):
+        for name, rights in entries.items():
+            lines.append('%s\t%d\n' % (name, rights))
+    acl = ''.join(lines)
+    if str is bytes:
+        return acl
+    return acl.encode('utf-8')
@@ -1,9 +1,35 @@
 from afs._util cimport *
 from afs._util import pyafs_error
 
-def whichcell(char* path):
+def whichcell(path):
     """Determine which AFS cell a particular path is in."""
+    cdef bytes c_path = c_string(path)
     cdef char cell[MAXCELLCHARS]
 
-    pioctl_read(path, VIOC_FILE_CELL_NAME, cell, sizeof(cell), 1)
-    return cell
+    pioctl_read(c_path, VIOC_FILE_CELL_NAME, cell, sizeof(cell), 1)
+    return py_string(cell)
+
+# This is defined in afs/afs.h, which we can't include; see the
+# comment about vcxstat2 in _acl.pyx
+cdef struct AFSFid:
+    afs_uint32 Volume
+    afs_uint32 Vnode
+    afs_uint32 Unique
+
+cdef struct VenusFid:
+    afs_int32 Cell
+    AFSFid Fid
+
+def getfid(path, int follow=1):
+    """Determine the AFS file ID of a particular path.
+
+    Returns a (cell, volume, vnode, unique) tuple. cell is the cache
+    manager's internal index for the path's cell, so it's only
+    meaningful for comparing against other file IDs from the same
+    machine.
+    """
+    cdef bytes c_path = c_string(path)
+    cdef VenusFid fid
+
+    pioctl_read(c_path, VIOCGETFID, <void*>&fid, sizeof(fid), follow)
+    return (fid.Cell, fid.Fid.Volume, fid.Fid.Vnode, fid.Fid.Unique)
@@ -1,10 +1,16 @@
 from afs._util cimport *
 from afs._util import pyafs_error
+from errno import EPROTO
 import re
+import socket
+import struct
+import threading
+import warnings
 
 cdef extern from "afs/ptuser.h":
     enum:
         PR_MAXNAMELEN
+        PR_MAXLIST
         PRGRP
         PRUSERS
         PRGROUPS
@@ -51,26 +57,51 @@ cdef extern from "afs/ptuser.h":
         unsigned int prentries_len
         prlistentries *prentries_val
 
-    int ubik_PR_NameToID(ubik_client *, afs_int32, namelist *, idlist *)
-    int ubik_PR_IDToName(ubik_client *, afs_int32, idlist *, namelist *)
-    int ubik_PR_INewEntry(ubik_client *, afs_int32, char *, afs_int32, afs_int32)
-    int ubik_PR_NewEntry(ubik_client *, afs_int32, char *, afs_int32, afs_int32, afs_int32 *)
-    int ubik_PR_Delete(ubik_client *, afs_int32, afs_int32)
-    int ubik_PR_AddToGroup(ubik_client *, afs_int32, afs_int32, afs_int32)
-    int ubik_PR_RemoveFromGroup(ubik_client *, afs_int32, afs_int32, afs_int32)
-    int ubik_PR_ListElements(ubik_client *, afs_int32, afs_int32, prlist *, afs_int32 *)
-    int ubik_PR_ListOwned(ubik_client *, afs_int32, afs_int32, prlist *, afs_int32 *)
-    int ubik_PR_ListEntry(ubik_client *, afs_int32, afs_int32, prcheckentry *)
-    int ubik_PR_ChangeEntry(ubik_client *, afs_int32, afs_int32, char *, afs_int32, afs_int32)
-    int ubik_PR_IsAMemberOf(ubik_client *, afs_int32, afs_int32, afs_int32, afs_int32 *)
-    int ubik_PR_ListMax(ubik_client *, afs_int32, afs_int32 *, afs_int32 *)
-    int ubik_PR_SetMax(ubik_client *, afs_int32, afs_int32, afs_int32)
-    int ubik_PR_ListEntries(ubik_client *, afs_int32, afs_int32, afs_int32, prentries *, afs_int32 *)
-    int ubik_PR_SetFieldsEntry(ubik_client *, afs_int32, afs_int32, afs_int32, afs_int32, afs_int32, afs_int32, afs_int32, afs_int32)
+    int ubik_PR_NameToID(ubik_client *, afs_int32, namelist *, idlist *) nogil
+    int ubik_PR_IDToName(ubik_client *, afs_int32, idlist *, namelist *) nogil
+    int ubik_PR_INewEntry(ubik_client *, afs_int32, char *, afs_int32, afs_int32) nogil
+    int ubik_PR_NewEntry(ubik_client *, afs_int32, char *, afs_int32, afs_int32, afs_int32 *) nogil
+    int ubik_PR_Delete(ubik_client *, afs_int32, afs_int32) nogil
+    int ubik_PR_AddToGroup(ubik_client *, afs_int32, afs_int32, afs_int32) nogil
+    int ubik_PR_RemoveFromGroup(ubik_client *, afs_int32, afs_int32, afs_int32) nogil
+    int ubik_PR_ListElements(ubik_client *, afs_int32, afs_int32, prlist *, afs_int32 *) nogil
+    int ubik_PR_ListOwned(ubik_client *, afs_int32, afs_int32, prlist *, afs_int32 *) nogil
+    int ubik_PR_ListEntry(ubik_client *, afs_int32, afs_int32, prcheckentry *) nogil
+    int ubik_PR_ChangeEntry(ubik_client *, afs_int32, afs_int32, char *, afs_int32, afs_int32) nogil
+    int ubik_PR_IsAMemberOf(ubik_client *, afs_int32, afs_int32, afs_int32, afs_int32 *) nogil
+    int ubik_PR_ListMax(ubik_client *, afs_int32, afs_int32 *, afs_int32 *) nogil
+    int ubik_PR_SetMax(ubik_client *, afs_int32, afs_int32, afs_int32) nogil
+    int ubik_PR_ListEntries(ubik_client *, afs_int32, afs_int32, afs_int32, prentries *, afs_int32 *) nogil
+    int ubik_PR_SetFieldsEntry(ubik_client *, afs_int32, afs_int32, afs_int32, afs_int32, afs_int32, afs_int32, afs_int32, afs_int32) nogil
+    int ubik_PR_GetCPS(ubik_client *, afs_int32, afs_int32, prlist *, afs_int32 *) nogil
+    int ubik_PR_GetCPS2(ubik_client *, afs_int32, afs_int32, afs_int32, prlist *, afs_int32 *) nogil
+    int ubik_PR_ListSuperGroups(ubik_client *, afs_int32, afs_int32, prlist *, afs_int32 *) nogil
+
+# The RPCs that take a single PTS ID and return a prlist
+ctypedef int (*prlist_rpc)(ubik_client *, afs_int32, afs_int32, prlist *, afs_int32 *) nogil
 
 cdef extern from "afs/pterror.h":
     enum:
-        PRNOENT
+        c_PREXIST "PREXIST"
+        c_PRIDEXIST "PRIDEXIST"
+        c_PRNOENT "PRNOENT"
+
+# Error codes worth checking AFSException.errno against
+PREXIST = c_PREXIST
+PRIDEXIST = c_PRIDEXIST
+PRNOENT = c_PRNOENT
+
+class TruncatedListWarning(UserWarning):
+    """The protection server returned only part of a list."""
+
+cdef _checkOver(afs_int32 over, what, afs_int32 id):
+    if over:
+        warnings.warn("The %s of PTS ID %d was truncated by the server." %
+                      (what, id), TruncatedListWarning, stacklevel=3)
+
+cdef extern from "time.h":
+    ctypedef long time_t
+    time_t c_time "time" (time_t *)
 
 cdef extern from "krb5/krb5.h":
     struct _krb5_context:
@@ -121,7 +152,7 @@ cdef int _ptentry_from_c(PTEntry p_entry, prcheckentry * c_entry) except -1:
     p_entry.ngroups = c_entry.ngroups
     p_entry.nusers = c_entry.nusers
     p_entry.count = c_entry.count
-    p_entry.name = c_entry.name
+    p_entry.name = py_string(c_entry.name)
     return 0
 
 cdef int _ptentry_to_c(prcheckentry * c_entry, PTEntry p_entry) except -1:
@@ -136,9 +167,14 @@ cdef int _ptentry_to_c(prcheckentry * c_entry, PTEntry p_entry) except -1:
     c_entry.ngroups = p_entry.ngroups
     c_entry.nusers = p_entry.nusers
     c_entry.count = p_entry.count
-    strncpy(c_entry.name, p_entry.name, sizeof(c_entry.name))
+    strncpy(c_entry.name, c_string(p_entry.name), sizeof(c_entry.name))
+    c_entry.name[sizeof(c_entry.name) - 1] = 0
     return 0
 
+cdef _shortReply(got, unsigned int ngot, asked, Py_ssize_t nasked):
+    raise OSError(EPROTO, "The protection server returned %d %s for %d %s." %
+                  (ngot, got, nasked, asked))
+
 cdef object kname_re = re.compile(r'^([^.].*?)(?<!\\)(?:\.(.*?))?(?<!\\)@([^@]*)$')
 
 cdef object kname_parse(fullname):
@@ -161,6 +197,232 @@ cdef object kname_unparse(name, inst, realm):
     else:
         return '%s@%s' % (name, realm)
 
+# Rx is started once, by the first PTS object, and never shut down:
+# rx_Finalize would pull the connections out from under every other
+# PTS object, and every pooled connection, in the process.
+cdef int _rx_started = 0
+
+cdef int _startRx() except -1:
+    global _rx_started
+    cdef int code
+
+    if not _rx_started:
+        code = rx_Init(0)
+        if code != 0:
+            raise Exception(code, "Error initializing Rx")
+        _rx_started = 1
+    return 0
+
+# The client configuration directory, opened once
+cdef afsconf_dir *_cdir = NULL
+
+# The krb5 context shared by every PTS object, for realm lookups and
+# principal conversions. It's only ever used with the GIL held.
+cdef krb5_context _kctx = NULL
+
+cdef krb5_context _krb5Context() except NULL:
+    global _kctx
+    cdef krb5_error_code code
+
+    if _kctx is NULL:
+        code = krb5_init_context(&_kctx)
+        pyafs_error(code)
+    return _kctx
+
+cdef class _Cell:
+    """The servers and Kerberos realm of a cell."""
+    cdef afsconf_cell info
+    cdef readonly object name
+    cdef readonly object realm
+
+# Cell name (or None, for the home cell) to _Cell
+cdef dict _cells = {}
+
+cdef _Cell _getCell(cell):
+    global _cdir
+    cdef _Cell c = _cells.get(cell)
+    cdef char * c_cell = NULL
+    cdef char ** hrealms = NULL
+    cdef afs_int32 code
+    cdef bytes b_cell
+
+    if c is not None:
+        return c
+
+    if _cdir is NULL:
+        _cdir = afsconf_Open(AFSDIR_CLIENT_ETC_DIRPATH)
+        if _cdir is NULL:
+            raise OSError(errno,
+                          "Error opening configuration directory (%s): %s" % \
+                              (AFSDIR_CLIENT_ETC_DIRPATH, strerror(errno)))
+
+    if cell is not None:
+        b_cell = c_string(cell)
+        c_cell = b_cell
+    c = _Cell()
+    code = afsconf_GetCellInfo(_cdir, c_cell, "afsprot", &c.info)
+    pyafs_error(code)
+
+    code = krb5_get_host_realm(_krb5Context(), c.info.hostName[0], &hrealms)
+    pyafs_error(code)
+    c.realm = py_string(hrealms[0])
+    krb5_free_host_realm(_kctx, hrealms)
+    c.name = py_string(c.info.name)
+
+    _cells[cell] = c
+    _cells.setdefault(c.name, c)
+    return c
+
+# Connections are replaced this many seconds before their token
+# expires, so that RPCs don't start with a token that's about to
+# run out.
+cdef time_t _EXPIRY_SLACK = 60
+
+# How often a connection that wanted a token, but had to fall back
+# to unauthenticated, checks whether one has turned up
+cdef time_t _TOKEN_RECHECK = 300
+
+# How often a connection whose token is about to expire checks
+# whether a new one has turned up, once it's found there isn't one
+cdef time_t _TOKEN_POLL = 10
+
+# The number of idle connections kept for each cell and security level
+cdef int _MAXIDLE = 8
+
+cdef class _Connection:
+    """A ubik client for one cell, at one security level.
+
+    Making one fetches a token and opens an Rx connection to each of
+    the cell's servers, which is most of what a PTS object used to
+    cost to create. They're pooled by (cell, sec) and lent to one
+    thread of one PTS object at a time.
+    """
+    cdef ubik_client * client
+    # When the token runs out, or 0 if it doesn't
+    cdef time_t expires
+    # The end time of the token the connection was made with, or 0
+    cdef time_t tokenEnd
+    # Don't look for a new token before this
+    cdef time_t recheck
+    cdef object key
+
+    def __dealloc__(self):
+        if self.client is not NULL:
+            ubik_ClientDestroy(self.client)
+
+cdef inline int _live(_Connection conn, time_t now):
+    return conn.expires == 0 or conn.expires > now + _EXPIRY_SLACK
+
+cdef afs_int32 _getToken(_Cell c, ktc_token *token):
+    cdef ktc_principal prin
+
+    strncpy(prin.cell, c.info.name, sizeof(prin.cell))
+    prin.instance[0] = 0
+    strncpy(prin.name, "afs", sizeof(prin.name))
+    return ktc_GetToken(&prin, token, sizeof(token[0]), NULL)
+
+cdef int _newToken(_Cell c, _Connection conn):
+    """Return whether there's a token for c other than the one conn
+    was made with."""
+    cdef ktc_token token
+
+    if _getToken(c, &token) != 0:
+        return 0
+    return token.endTime != conn.tokenEnd
+
+cdef _Connection _connect(_Cell c, int sec):
+    cdef afs_int32 code
+    cdef ktc_token token
+    cdef rx_securityClass *sc
+    cdef rx_connection *serverconns[MAXSERVERS]
+    cdef int i
+    cdef _Connection conn = _Connection()
+
+    conn.key = (c.name, sec)
+
+    if sec > 0:
+        code = _getToken(c, &token)
+        if code != 0:
+            if sec >= 2:
+                # No really - we wanted authentication
+                pyafs_error(code)
+            sec = 0
+            conn.expires = c_time(NULL) + _TOKEN_RECHECK
+        else:
+            if sec == 3:
+                level = rxkad_crypt
+            else:
+                level = rxkad_clear
+            sc = rxkad_NewClientSecurityObject(level, &token.sessionKey,
+                                               token.kvno, token.ticketLen,
+                                               token.ticket)
+            conn.expires = token.endTime
+            conn.tokenEnd = token.endTime
+
+    if sec == 0:
+        sc = rxnull_NewClientSecurityObject()
+    else:
+        sec = 2
+
+    memset(serverconns, 0, sizeof(serverconns))
+    for 0 <= i < c.info.numServers:
+        serverconns[i] = rx_NewConnection(c.info.hostAddr[i].sin_addr.s_addr,
+                                          c.info.hostAddr[i].sin_port,
+                                          PRSRV,
+                                          sc,
+                                          sec)
+
+    code = ubik_ClientInit(serverconns, &conn.client)
+    rxs_Release(sc)
+    pyafs_error(code)
+
+    return conn
+
+# (cell name, sec) to a list of idle _Connections
+cdef dict _idle = {}
+
+cdef _Connection _acquire(_Cell c, int sec):
+    cdef _Connection conn
+    cdef time_t now = c_time(NULL)
+
+    idle = _idle.get((c.name, sec))
+    while idle:
+        conn = idle.pop()
+        if _live(conn, now):
+            return conn
+    return _connect(c, sec)
+
+cdef _release(_Connection conn):
+    if not _live(conn, c_time(NULL)):
+        return
+    idle = _idle.setdefault(conn.key, [])
+    if len(idle) < _MAXIDLE:
+        idle.append(conn)
+
+cdef class _Lease:
+    """The connection one thread of a PTS object makes its RPCs on.
+
+    It goes back to the pool when the thread exits or the PTS object
+    is garbage collected. Since nothing else uses the connection in
+    the meantime, it can be swapped for a new one between any two
+    RPCs without waiting for anything.
+    """
+    cdef _Connection conn
+
+    def __dealloc__(self):
+        if self.conn is not None and _idle is not None:
+            _release(self.conn)
+
+def flushConnections():
+    """
+    Forget cached cell information and idle connections.
+
+    Call this after the cell's servers or CellServDB change. PTS
+    objects that already exist keep the connections they have.
+    """
+    _cells.clear()
+    _idle.clear()
+
 cdef class PTS:
     """
     A PTS object is essentially a handle to talk to the server in a
@@ -178,96 +440,79 @@ cdef class PTS:
 
     The realm attribute is the Kerberos realm against which this cell
     authenticates.
+
+    PTS objects are cheap to create. Each cell's server list and realm
+    are looked up once per process, and connections to the servers
+    are pooled by cell and security level: each thread using a PTS
+    object borrows one, and gives it back when the thread exits or
+    the PTS object is garbage collected.
+    A connection whose token is about to expire is replaced, with a
+    fresh token, before the next RPC. Call flushConnections() to pick
+    up changes to the cell's servers.
+
+    A PTS object may be shared between threads. Each thread that
+    makes RPCs through it borrows a connection of its own from the
+    pool, and the GIL is released for the duration of every RPC, so
+    RPCs made by different threads proceed in parallel, whether or
+    not they share a PTS object.
     """
-    cdef ubik_client * client
+    cdef krb5_context kctx
+    cdef _Cell _cell
+    cdef int _sec
+    # Each thread's _Lease
+    cdef object _leases
     cdef readonly object cell
     cdef readonly object realm
+    # So afs.stats can keep per-connection statistics
+    cdef object __weakref__
 
-    def __cinit__(self, cell=None, sec=1):
-        cdef afs_int32 code
-        cdef afsconf_dir *cdir
-        cdef afsconf_cell info
-        cdef krb5_context context
-        cdef char ** hrealms = NULL
-        cdef char * c_cell
-        cdef ktc_principal prin
-        cdef ktc_token token
-        cdef rx_securityClass *sc
-        cdef rx_connection *serverconns[MAXSERVERS]
-        cdef int i
-
+    def __cinit__(self, cell=None, sec=1, *args, **kwargs):
         initialize_PT_error_table()
 
-        if cell is None:
-            c_cell = NULL
-        else:
-            c_cell = cell
-
-        self.client = NULL
-
-        code = rx_Init(0)
-        if code != 0:
-            raise Exception(code, "Error initializing Rx")
-
-        cdir = afsconf_Open(AFSDIR_CLIENT_ETC_DIRPATH)
-        if cdir is NULL:
-            raise OSError(errno,
-                          "Error opening configuration directory (%s): %s" % \
-                              (AFSDIR_CLIENT_ETC_DIRPATH, strerror(errno)))
-        code = afsconf_GetCellInfo(cdir, c_cell, "afsprot", &info)
-        pyafs_error(code)
-
-        code = krb5_init_context(&context)
-        pyafs_error(code)
-        code = krb5_get_host_realm(context, info.hostName[0], &hrealms)
-        pyafs_error(code)
-        self.realm = hrealms[0]
-        krb5_free_host_realm(context, hrealms)
-        krb5_free_context(context)
-
-        self.cell = info.name
-
-        if sec > 0:
-            strncpy(prin.cell, info.name, sizeof(prin.cell))
-            prin.instance[0] = 0
-            strncpy(prin.name, "afs", sizeof(prin.name))
-
-            code = ktc_GetToken(&prin, &token, sizeof(token), NULL);
-            if code != 0:
-                if sec >= 2:
-                    # No really - we wanted authentication
-                    pyafs_error(code)
-                sec = 0
+        _startRx()
+        self.kctx = _krb5Context()
+
+        self._cell = _getCell(cell)
+        self.cell = self._cell.name
+        self.realm = self._cell.realm
+
+        self._sec = sec
+        self._leases = threading.local()
+        # Connect now, so that a bad cell or missing token is
+        # reported here rather than by the first RPC
+        self._lease()
+
+    cdef _Lease _lease(self):
+        """Return the calling thread's _Lease, borrowing a connection
+        for it if it doesn't have one yet."""
+        cdef _Lease lease = getattr(self._leases, 'lease', None)
+
+        if lease is None:
+            lease = _Lease()
+            lease.conn = _acquire(self._cell, self._sec)
+            self._leases.lease = lease
+        return lease
+
+    cdef double _begin(self, op, ubik_client **client) except? -1:
+        """Set client to the calling thread's ubik client, swapping in
+        a new connection if its token is about to expire, then start
+        timing an RPC."""
+        cdef _Lease lease = self._lease()
+        cdef _Connection conn = lease.conn
+        cdef time_t now = c_time(NULL)
+
+        if not _live(conn, now) and now >= conn.recheck:
+            # A new connection would get the same token, so only make
+            # one once there's a new token
+            if _newToken(self._cell, conn):
+                lease.conn = _acquire(self._cell, self._sec)
+                _release(conn)
+            elif conn.tokenEnd == 0:
+                conn.recheck = now + _TOKEN_RECHECK
             else:
-                if sec == 3:
-                    level = rxkad_crypt
-                else:
-                    level = rxkad_clear
-                sc = rxkad_NewClientSecurityObject(level, &token.sessionKey,
-                                                   token.kvno, token.ticketLen,
-                                                   token.ticket)
-
-        if sec == 0:
-            sc = rxnull_NewClientSecurityObject()
-        else:
-            sec = 2
-
-        memset(serverconns, 0, sizeof(serverconns))
-        for 0 <= i < info.numServers:
-            serverconns[i] = rx_NewConnection(info.hostAddr[i].sin_addr.s_addr,
-                                              info.hostAddr[i].sin_port,
-                                              PRSRV,
-                                              sc,
-                                              sec)
-
-        code = ubik_ClientInit(serverconns, &self.client)
-        pyafs_error(code)
-
-        code = rxs_Release(sc)
-
-    def __dealloc__(self):
-        ubik_ClientDestroy(self.client)
-        rx_Finalize()
+                conn.recheck = now + _TOKEN_POLL
+        client[0] = lease.conn.client
+        return rpc_start(self, op)
 
     def _NameOrId(self, ident):
         """
@@ -287,19 +532,25 @@ cdef class PTS:
         cdef namelist lnames
         cdef idlist lids
         cdef afs_int32 code, id = ANONYMOUSID
-        name = name.lower()
+        cdef double t0
+        cdef ubik_client *client
+        name = c_string(name.lower())
 
         lids.idlist_len = 0
         lids.idlist_val = NULL
         lnames.namelist_len = 1
         lnames.namelist_val = <prname *>malloc(PR_MAXNAMELEN)
         strncpy(lnames.namelist_val[0], name, PR_MAXNAMELEN)
-        code = ubik_PR_NameToID(self.client, 0, &lnames, &lids)
+        lnames.namelist_val[0][PR_MAXNAMELEN - 1] = 0
+        t0 = self._begin('PR_NameToID', &client)
+        with nogil:
+            code = ubik_PR_NameToID(client, 0, &lnames, &lids)
+        rpc_end(self, 'PR_NameToID', t0, code)
         if lids.idlist_val is not NULL:
             id = lids.idlist_val[0]
             free(lids.idlist_val)
         if id == ANONYMOUSID:
-            code = PRNOENT
+            code = c_PRNOENT
         pyafs_error(code)
         return id
 
@@ -310,23 +561,136 @@ cdef class PTS:
         cdef namelist lnames
         cdef idlist lids
         cdef afs_int32 code
+        cdef double t0
+        cdef ubik_client *client
         cdef char name[PR_MAXNAMELEN]
 
+        name[0] = 0
         lids.idlist_len = 1
         lids.idlist_val = <afs_int32 *>malloc(sizeof(afs_int32))
         lids.idlist_val[0] = id
         lnames.namelist_len = 0
         lnames.namelist_val = NULL
-        code = ubik_PR_IDToName(self.client, 0, &lids, &lnames)
+        t0 = self._begin('PR_IDToName', &client)
+        with nogil:
+            code = ubik_PR_IDToName(client, 0, &lids, &lnames)
+        rpc_end(self, 'PR_IDToName', t0, code)
         if lnames.namelist_val is not NULL:
             strncpy(name, lnames.namelist_val[0], sizeof(name))
+            name[sizeof(name) - 1] = 0
             free(lnames.namelist_val)
         if lids.idlist_val is not NULL:
             free(lids.idlist_val)
-        if name == str(id):
-            code = PRNOENT
+        if py_string(name) == str(id):
+            code = c_PRNOENT
         pyafs_error(code)
-        return name
+        return py_string(name)
+
+    def _NamesToIds(self, names, chunk=PR_MAXLIST):
+        """
+        Converts a sequence of users or groups to AFS IDs.
+
+        Names are looked up in batches of at most chunk names per
+        RPC. This returns a list of IDs in the same order as names,
+        with None in place of any name that doesn't exist.
+        """
+        cdef namelist lnames
+        cdef idlist lids
+        cdef afs_int32 code
+        cdef double t0
+        cdef ubik_client *client
+        cdef Py_ssize_t start
+        cdef unsigned int i
+        cdef object ids = []
+
+        names = [c_string(n.lower()) for n in names]
+
+        for start in range(0, len(names), chunk):
+            batch = names[start:start + chunk]
+
+            lids.idlist_len = 0
+            lids.idlist_val = NULL
+            lnames.namelist_len = len(batch)
+            lnames.namelist_val = <prname *>malloc(PR_MAXNAMELEN * len(batch))
+            if lnames.namelist_val is NULL:
+                raise MemoryError
+            for i in range(lnames.namelist_len):
+                strncpy(lnames.namelist_val[i], batch[i], PR_MAXNAMELEN)
+                lnames.namelist_val[i][PR_MAXNAMELEN - 1] = 0
+
+            t0 = self._begin('PR_NameToID', &client)
+            with nogil:
+                code = ubik_PR_NameToID(client, 0, &lnames, &lids)
+            rpc_end(self, 'PR_NameToID', t0, code)
+            free(lnames.namelist_val)
+            if code == 0 and lids.idlist_len != len(batch):
+                free(lids.idlist_val)
+                _shortReply('IDs', lids.idlist_len, 'names', len(batch))
+            if lids.idlist_val is not NULL:
+                if code == 0:
+                    for i in range(lids.idlist_len):
+                        if lids.idlist_val[i] == ANONYMOUSID:
+                            ids.append(None)
+                        else:
+                            ids.append(lids.idlist_val[i])
+                free(lids.idlist_val)
+            pyafs_error(code)
+
+        return ids
+
+    def _IdsToNames(self, ids, chunk=PR_MAXLIST):
+        """
+        Convert a sequence of AFS IDs to the names of users or groups.
+
+        IDs are looked up in batches of at most chunk IDs per
+        RPC. This returns a list of names in the same order as ids,
+        with None in place of any ID that doesn't exist.
+        """
+        cdef namelist lnames
+        cdef idlist lids
+        cdef afs_int32 code
+        cdef double t0
+        cdef ubik_client *client
+        cdef Py_ssize_t start
+        cdef unsigned int i
+        cdef object names = []
+
+        ids = list(ids)
+
+        for start in range(0, len(ids), chunk):
+            batch = ids[start:start + chunk]
+
+            lids.idlist_len = len(batch)
+            lids.idlist_val = <afs_int32 *>malloc(sizeof(afs_int32) * len(batch))
+            if lids.idlist_val is NULL:
+                raise MemoryError
+            for i in range(lids.idlist_len):
+                lids.idlist_val[i] = batch[i]
+            lnames.namelist_len = 0
+            lnames.namelist_val = NULL
+
+            t0 = self._begin('PR_IDToName', &client)
+            with nogil:
+                code = ubik_PR_IDToName(client, 0, &lids, &lnames)
+            rpc_end(self, 'PR_IDToName', t0, code)
+            free(lids.idlist_val)
+            if code == 0 and lnames.namelist_len != len(batch):
+                free(lnames.namelist_val)
+                _shortReply('names', lnames.namelist_len, 'IDs', len(batch))
+            if lnames.namelist_val is not NULL:
+                if code == 0:
+                    for i in range(lnames.namelist_len):
+                        name = py_string(lnames.namelist_val[i])
+                        # The server hands back the stringified ID for
+                        # IDs it doesn't know about
+                        if name == str(batch[i]):
+                            names.append(None)
+                        else:
+                            names.append(name)
+                free(lnames.namelist_val)
+            pyafs_error(code)
+
+        return names
 
     def _CreateUser(self, name, id=None):
         """
@@ -334,16 +698,26 @@ cdef class PTS:
         provided, that one will be used.
         """
         cdef afs_int32 code
+        cdef double start
+        cdef ubik_client *client
         cdef afs_int32 cid
-        name = name[:PR_MAXNAMELEN].lower()
+        cdef char * c_name
+        name = c_string(name[:PR_MAXNAMELEN - 1].lower())
+        c_name = name
 
         if id is not None:
             cid = id
 
         if id is not None:
-            code = ubik_PR_INewEntry(self.client, 0, name, cid, 0)
+            start = self._begin('PR_INewEntry', &client)
+            with nogil:
+                code = ubik_PR_INewEntry(client, 0, c_name, cid, 0)
+            rpc_end(self, 'PR_INewEntry', start, code)
         else:
-            code = ubik_PR_NewEntry(self.client, 0, name, 0, 0, &cid)
+            start = self._begin('PR_NewEntry', &client)
+            with nogil:
+                code = ubik_PR_NewEntry(client, 0, c_name, 0, 0, &cid)
+            rpc_end(self, 'PR_NewEntry', start, code)
 
         pyafs_error(code)
         return cid
@@ -353,16 +727,26 @@ cdef class PTS:
         Create a new group in the protection database. If an ID is
         provided, that one will be used.
         """
-        cdef afs_int32 code, cid
+        cdef afs_int32 code, cid, oid
+        cdef double start
+        cdef ubik_client *client
+        cdef char * c_name
 
-        name = name[:PR_MAXNAMELEN].lower()
+        name = c_string(name[:PR_MAXNAMELEN - 1].lower())
+        c_name = name
         oid = self._NameOrId(owner)
 
         if id is not None:
             cid = id
-            code = ubik_PR_INewEntry(self.client, 0, name, cid, oid)
+            start = self._begin('PR_INewEntry', &client)
+            with nogil:
+                code = ubik_PR_INewEntry(client, 0, c_name, cid, oid)
+            rpc_end(self, 'PR_INewEntry', start, code)
         else:
-            code = ubik_PR_NewEntry(self.client, 0, name, PRGRP, oid, &cid)
+            start = self._begin('PR_NewEntry', &client)
+            with nogil:
+                code = ubik_PR_NewEntry(client, 0, c_name, PRGRP, oid, &cid)
+            rpc_end(self, 'PR_NewEntry', start, code)
 
         pyafs_error(code)
         return cid
@@ -373,9 +757,14 @@ cdef class PTS:
         identifier.
         """
         cdef afs_int32 code
+        cdef double start
+        cdef ubik_client *client
         cdef afs_int32 id = self._NameOrId(ident)
 
-        code = ubik_PR_Delete(self.client, 0, id)
+        start = self._begin('PR_Delete', &client)
+        with nogil:
+            code = ubik_PR_Delete(client, 0, id)
+        rpc_end(self, 'PR_Delete', start, code)
         pyafs_error(code)
 
     def _AddToGroup(self, user, group):
@@ -383,9 +772,14 @@ cdef class PTS:
         Add the given user to the given group.
         """
         cdef afs_int32 code
+        cdef double start
+        cdef ubik_client *client
         cdef afs_int32 uid = self._NameOrId(user), gid = self._NameOrId(group)
 
-        code = ubik_PR_AddToGroup(self.client, 0, uid, gid)
+        start = self._begin('PR_AddToGroup', &client)
+        with nogil:
+            code = ubik_PR_AddToGroup(client, 0, uid, gid)
+        rpc_end(self, 'PR_AddToGroup', start, code)
         pyafs_error(code)
 
     def _RemoveFromGroup(self, user, group):
@@ -393,11 +787,50 @@ cdef class PTS:
         Remove the given user from the given group.
         """
         cdef afs_int32 code
+        cdef double start
+        cdef ubik_client *client
         cdef afs_int32 uid = self._NameOrId(user), gid = self._NameOrId(group)
 
-        code = ubik_PR_RemoveFromGroup(self.client, 0, uid, gid)
+        start = self._begin('PR_RemoveFromGroup', &client)
+        with nogil:
+            code = ubik_PR_RemoveFromGroup(client, 0, uid, gid)
+        rpc_end(self, 'PR_RemoveFromGroup', start, code)
         pyafs_error(code)
 
+    cdef object _prlist(self, prlist_rpc rpc, op, afs_int32 id, what):
+        """
+        Call an RPC that returns a prlist, and return it as a list.
+
+        op is the RPC's name, for instrumentation.
+
+        If the server says it left anything out, a
+        TruncatedListWarning is issued.
+        """
+        cdef afs_int32 code, over = 0
+        cdef double start
+        cdef ubik_client *client
+        cdef prlist alist
+        cdef int i
+        cdef object result = []
+
+        alist.prlist_len = 0
+        alist.prlist_val = NULL
+
+        start = self._begin(op, &client)
+        with nogil:
+            code = rpc(client, 0, id, &alist, &over)
+        rpc_end(self, op, start, code)
+
+        if alist.prlist_val is not NULL:
+            for i in range(alist.prlist_len):
+                result.append(alist.prlist_val[i])
+            free(alist.prlist_val)
+
+        pyafs_error(code)
+        _checkOver(over, what, id)
+
+        return result
+
     def _ListMembers(self, ident):
         """
         Get the membership of an entity.
@@ -410,49 +843,109 @@ cdef class PTS:
 
         This returns a list of PTS IDs.
         """
-        cdef afs_int32 code, over
+        return self._prlist(ubik_PR_ListElements, 'PR_ListElements',
+                            self._NameOrId(ident),
+                            'membership')
+
+    def _GetCPS(self, ident):
+        """
+        Get the current protection subset (CPS) of an entity.
+
+        For a user, this is the user itself, every group it's a
+        member of, directly or through supergroups, and
+        system:anyuser and system:authuser; it's the set of IDs a
+        fileserver checks ACLs against.
+
+        This returns a list of PTS IDs.
+        """
+        return self._prlist(ubik_PR_GetCPS, 'PR_GetCPS', self._NameOrId(ident), 'CPS')
+
+    def _GetCPS2(self, ident, host=None):
+        """
+        Get the CPS of an entity, as seen from a particular host.
+
+        This is the same as _GetCPS, plus the groups the host (given
+        as a dotted-quad IP address) is a member of through IP
+        address ACLs.
+
+        This returns a list of PTS IDs.
+        """
+        cdef afs_int32 code, over = 0
+        cdef double start
+        cdef ubik_client *client
         cdef prlist alist
         cdef int i
-        cdef object members = []
+        cdef object cps = []
 
         cdef afs_int32 id = self._NameOrId(ident)
+        cdef afs_int32 ahost = 0
+        if host is not None:
+            ahost = struct.unpack('!i', socket.inet_aton(host))[0]
 
         alist.prlist_len = 0
         alist.prlist_val = NULL
 
-        code = ubik_PR_ListElements(self.client, 0, id, &alist, &over)
+        start = self._begin('PR_GetCPS2', &client)
+        with nogil:
+            code = ubik_PR_GetCPS2(client, 0, id, ahost, &alist, &over)
+        rpc_end(self, 'PR_GetCPS2', start, code)
 
         if alist.prlist_val is not NULL:
             for i in range(alist.prlist_len):
-                members.append(alist.prlist_val[i])
+                cps.append(alist.prlist_val[i])
             free(alist.prlist_val)
 
         pyafs_error(code)
+        _checkOver(over, 'CPS', id)
 
-        return members
+        return cps
+
+    def _ListSuperGroups(self, ident):
+        """
+        Get the groups a group is a member of.
+
+        This returns a list of PTS IDs.
+        """
+        return self._prlist(ubik_PR_ListSuperGroups, 'PR_ListSuperGroups',
+                            self._NameOrId(ident),
+                            'supergroups')
 
     def _ListOwned(self, owner):
         """
         Get all groups owned by an entity.
+
+        The server returns long lists in several pieces; this keeps
+        asking until it has all of them.
         """
-        cdef afs_int32 code, over
+        cdef afs_int32 code, over = 0
+        cdef double start
+        cdef ubik_client *client
         cdef prlist alist
         cdef int i
         cdef object owned = []
 
         cdef afs_int32 oid = self._NameOrId(owner)
 
-        alist.prlist_len = 0
-        alist.prlist_val = NULL
+        while True:
+            alist.prlist_len = 0
+            alist.prlist_val = NULL
 
-        code = ubik_PR_ListOwned(self.client, 0, oid, &alist, &over)
+            # over is both the place to resume from and, on return,
+            # the place the next call should resume from
+            start = self._begin('PR_ListOwned', &client)
+            with nogil:
+                code = ubik_PR_ListOwned(client, 0, oid, &alist, &over)
+            rpc_end(self, 'PR_ListOwned', start, code)
 
-        if alist.prlist_val is not NULL:
-            for i in range(alist.prlist_len):
-                owned.append(alist.prlist_val[i])
-            free(alist.prlist_val)
+            if alist.prlist_val is not NULL:
+                for i in range(alist.prlist_len):
+                    owned.append(alist.prlist_val[i])
+                free(alist.prlist_val)
 
-        pyafs_error(code)
+            pyafs_error(code)
+
+            if over == 0:
+                break
 
         return owned
 
@@ -462,12 +955,17 @@ cdef class PTS:
         entity.
         """
         cdef afs_int32 code
+        cdef double start
+        cdef ubik_client *client
         cdef prcheckentry centry
         cdef object entry = PTEntry()
 
         cdef afs_int32 id = self._NameOrId(ident)
 
-        code = ubik_PR_ListEntry(self.client, 0, id, &centry)
+        start = self._begin('PR_ListEntry', &client)
+        with nogil:
+            code = ubik_PR_ListEntry(client, 0, id, &centry)
+        rpc_end(self, 'PR_ListEntry', start, code)
         pyafs_error(code)
 
         _ptentry_from_c(entry, &centry)
@@ -481,6 +979,8 @@ cdef class PTS:
         or ar None, the value isn't changed.
         """
         cdef afs_int32 code
+        cdef double start
+        cdef ubik_client *client
         cdef afs_int32 c_newid = 0, c_newoid = 0
         cdef char * c_newname
 
@@ -488,13 +988,17 @@ cdef class PTS:
 
         if newname is None:
             newname = self._IdToName(id)
+        newname = c_string(newname)
         c_newname = newname
         if newid is not None:
             c_newid = newid
         if newoid is not None:
             c_newoid = newoid
 
-        code = ubik_PR_ChangeEntry(self.client, 0, id, c_newname, c_newoid, c_newid)
+        start = self._begin('PR_ChangeEntry', &client)
+        with nogil:
+            code = ubik_PR_ChangeEntry(client, 0, id, c_newname, c_newoid, c_newid)
+        rpc_end(self, 'PR_ChangeEntry', start, code)
         pyafs_error(code)
 
     def _IsAMemberOf(self, user, group):
@@ -502,11 +1006,16 @@ cdef class PTS:
         Return True if the given user is a member of the given group.
         """
         cdef afs_int32 code
+        cdef double start
+        cdef ubik_client *client
         cdef afs_int32 flag
 
         cdef afs_int32 uid = self._NameOrId(user), gid = self._NameOrId(group)
 
-        code = ubik_PR_IsAMemberOf(self.client, 0, uid, gid, &flag)
+        start = self._begin('PR_IsAMemberOf', &client)
+        with nogil:
+            code = ubik_PR_IsAMemberOf(client, 0, uid, gid, &flag)
+        rpc_end(self, 'PR_IsAMemberOf', start, code)
         pyafs_error(code)
 
         return bool(flag)
@@ -517,8 +1026,13 @@ cdef class PTS:
         ID currently assigned.
         """
         cdef afs_int32 code, uid, gid
+        cdef double start
+        cdef ubik_client *client
 
-        code = ubik_PR_ListMax(self.client, 0, &uid, &gid)
+        start = self._begin('PR_ListMax', &client)
+        with nogil:
+            code = ubik_PR_ListMax(client, 0, &uid, &gid)
+        rpc_end(self, 'PR_ListMax', start, code)
         pyafs_error(code)
 
         return (uid, gid)
@@ -529,8 +1043,14 @@ cdef class PTS:
         automatically assigned UID will be id + 1)
         """
         cdef afs_int32 code
-
-        code = ubik_PR_SetMax(self.client, 0, id, 0)
+        cdef double start
+        cdef ubik_client *client
+        cdef afs_int32 c_id = id
+
+        start = self._begin('PR_SetMax', &client)
+        with nogil:
+            code = ubik_PR_SetMax(client, 0, c_id, 0)
+        rpc_end(self, 'PR_SetMax', start, code)
         pyafs_error(code)
 
     def _SetMaxGroupId(self, id):
@@ -539,20 +1059,33 @@ cdef class PTS:
         automatically assigned UID will be id + 1)
         """
         cdef afs_int32 code
-
-        code = ubik_PR_SetMax(self.client, 0, id, PRGRP)
+        cdef double start
+        cdef ubik_client *client
+        cdef afs_int32 c_id = id
+
+        start = self._begin('PR_SetMax', &client)
+        with nogil:
+            code = ubik_PR_SetMax(client, 0, c_id, PRGRP)
+        rpc_end(self, 'PR_SetMax', start, code)
         pyafs_error(code)
 
-    def _ListEntries(self, users=None, groups=None):
+    def _ListEntriesPage(self, users=None, groups=None, startindex=0):
         """
-        Return a list of PTEntry instances representing all entries in
-        the PRDB.
+        Return one page of entries in the PRDB, starting at
+        startindex.
+
+        This returns a tuple of a list of PTEntry instances and the
+        index to pass as startindex to fetch the next page, which is
+        -1 once there are no more pages.
 
         Returns just users by default, but can return just users, just
         groups, or both.
         """
         cdef afs_int32 code
-        cdef afs_int32 flag = 0, startindex = 0, nentries, nextstartindex
+        cdef double start
+        cdef ubik_client *client
+        cdef afs_int32 flag = 0, nextstartindex = -1
+        cdef afs_int32 c_startindex = startindex
         cdef prentries centries
         cdef unsigned int i
 
@@ -563,23 +1096,38 @@ cdef class PTS:
         if groups:
             flag |= PRGROUPS
 
-        while startindex != -1:
-            centries.prentries_val = NULL
-            centries.prentries_len = 0
-            nextstartindex = -1
-
-            code = ubik_PR_ListEntries(self.client, 0, flag, startindex, &centries, &nextstartindex)
-            if centries.prentries_val is not NULL:
-                for i in range(centries.prentries_len):
-                    e = PTEntry()
-                    _ptentry_from_c(e, <prcheckentry *>&centries.prentries_val[i])
-                    entries.append(e)
-                free(centries.prentries_val)
-            pyafs_error(code)
+        centries.prentries_val = NULL
+        centries.prentries_len = 0
+
+        start = self._begin('PR_ListEntries', &client)
+        with nogil:
+            code = ubik_PR_ListEntries(client, 0, flag, c_startindex, &centries, &nextstartindex)
+        rpc_end(self, 'PR_ListEntries', start, code)
+        if centries.prentries_val is not NULL:
+            for i in range(centries.prentries_len):
+                e = PTEntry()
+                _ptentry_from_c(e, <prcheckentry *>&centries.prentries_val[i])
+                entries.append(e)
+            free(centries.prentries_val)
+        pyafs_error(code)
 
-            startindex = nextstartindex
+        return (entries, nextstartindex)
+
+    def _ListEntries(self, users=None, groups=None, startindex=0):
+        """
+        Iterate over PTEntry instances representing all entries in
+        the PRDB, starting at startindex.
 
-        return entries
+        Entries are fetched one page at a time, so the first entries
+        are available as soon as the first page arrives.
+
+        Returns just users by default, but can return just users, just
+        groups, or both.
+        """
+        while startindex != -1:
+            entries, startindex = self._ListEntriesPage(users, groups, startindex)
+            for e in entries:
+                yield e
 
     def _SetFields(self, ident, access=None, groups=None, users=None):
         """
@@ -591,6 +1139,8 @@ cdef class PTS:
         completeness.
         """
         cdef afs_int32 code
+        cdef double start
+        cdef ubik_client *client
         cdef afs_int32 mask = 0, flags = 0, nusers = 0, ngroups = 0
 
         cdef afs_int32 id = self._NameOrId(ident)
@@ -603,18 +1153,22 @@ cdef class PTS:
             mask |= PR_SF_NGROUPS
         if users is not None:
             nusers = users
-            mask |= PR_SF_NGROUPS
+            mask |= PR_SF_NUSERS
 
-        code = ubik_PR_SetFieldsEntry(self.client, 0, id, mask, flags, ngroups, nusers, 0, 0)
+        start = self._begin('PR_SetFieldsEntry', &client)
+        with nogil:
+            code = ubik_PR_SetFieldsEntry(client, 0, id, mask, flags, ngroups, nusers, 0, 0)
+        rpc_end(self, 'PR_SetFieldsEntry', start, code)
         pyafs_error(code)
 
     def _AfsToKrb5(self, afs_name):
         """Convert an AFS principal to a Kerberos v5 one."""
-        cdef krb5_context ctx = NULL
         cdef krb5_principal princ = NULL
         cdef krb5_error_code code = 0
         cdef char * krb5_princ = NULL
-        cdef char *name = NULL, *inst = NULL, *realm = NULL
+        cdef char *name = NULL
+        cdef char *inst = NULL
+        cdef char *realm = NULL
         cdef object pname, pinst, prealm
 
         if '@' in afs_name:
@@ -626,71 +1180,75 @@ cdef class PTS:
 
         pname, pinst, prealm = kname_parse(krb4_name)
         if pname:
+            pname = c_string(pname)
             name = pname
         if pinst:
+            pinst = c_string(pinst)
             inst = pinst
         if prealm:
+            prealm = c_string(prealm)
             realm = prealm
 
-        code = krb5_init_context(&ctx)
+        code = krb5_425_conv_principal(self.kctx, name, inst, realm, &princ)
         try:
             pyafs_error(code)
 
-            code = krb5_425_conv_principal(ctx, name, inst, realm, &princ)
+            code = krb5_unparse_name(self.kctx, princ, &krb5_princ)
             try:
                 pyafs_error(code)
 
-                code = krb5_unparse_name(ctx, princ, &krb5_princ)
-                try:
-                    pyafs_error(code)
-
-                    return krb5_princ
-                finally:
-                    if krb5_princ is not NULL:
-                        free(krb5_princ)
+                return py_string(krb5_princ)
             finally:
-                if princ is not NULL:
-                    krb5_free_principal(ctx, princ)
+                if krb5_princ is not NULL:
+                    free(krb5_princ)
         finally:
-            if ctx is not NULL:
-                krb5_free_context(ctx)
+            if princ is not NULL:
+                krb5_free_principal(self.kctx, princ)
 
     def _Krb5ToAfs(self, krb5_name):
         """Convert a Kerberos v5 principal to an AFS one."""
-        cdef krb5_context ctx = NULL
         cdef krb5_principal k5_princ = NULL
-        cdef char *k4_name, *k4_inst, *k4_realm
+        cdef krb5_error_code code = 0
+        cdef char k4_name[40]
+        cdef char k4_inst[40]
+        cdef char k4_realm[40]
         cdef object afs_princ
         cdef object afs_name, afs_realm
 
-        k4_name = <char *>malloc(40)
         k4_name[0] = '\0'
-        k4_inst = <char *>malloc(40)
         k4_inst[0] = '\0'
-        k4_realm = <char *>malloc(40)
         k4_realm[0] = '\0'
 
-        code = krb5_init_context(&ctx)
+        krb5_name = c_string(krb5_name)
+        code = krb5_parse_name(self.kctx, krb5_name, &k5_princ)
         try:
             pyafs_error(code)
 
-            code = krb5_parse_name(ctx, krb5_name, &k5_princ)
-            try:
-                pyafs_error(code)
-
-                code = krb5_524_conv_principal(ctx, k5_princ, k4_name, k4_inst, k4_realm)
-                pyafs_error(code)
+            code = krb5_524_conv_principal(self.kctx, k5_princ, k4_name, k4_inst, k4_realm)
+            pyafs_error(code)
 
-                afs_princ = kname_unparse(k4_name, k4_inst, k4_realm)
-                afs_name, afs_realm = afs_princ.rsplit('@', 1)
+            afs_princ = kname_unparse(py_string(k4_name), py_string(k4_inst),
+                                      py_string(k4_realm))
+            afs_name, afs_realm = afs_princ.rsplit('@', 1)
 
-                if k4_realm == self.realm:
-                    return afs_name
-                else:
-                    return '%s@%s' % (afs_name, afs_realm.lower())
-            finally:
-                if k5_princ is not NULL:
-                    krb5_free_principal(ctx, k5_princ)
+            if py_string(k4_realm) == self.realm:
+                return afs_name
+            else:
+                return '%s@%s' % (afs_name, afs_realm.lower())
         finally:
-            if ctx is not NULL:
-                krb5_free_context(ctx)
+            if k5_princ is not NULL:
+                krb5_free_principal(self.kctx, k5_princ)
+
+    def _AfsToKrb5Many(self, afs_names):
+        """
+        Convert a sequence of AFS principals to Kerberos v5 ones,
+        returning a list in the same order.
+        """
+        return [self._AfsToKrb5(n) for n in afs_names]
+
+    def _Krb5ToAfsMany(self, krb5_names):
+        """
+        Convert a sequence of Kerberos v5 principals to AFS ones,
+        returning a list in the same order.
+        """
+        return [self._Krb5ToAfs(n) for n in krb5_names]
@@ -109,6 +109,8 @@ cdef extern from "afs/auth.h":
     struct ktc_token:
         ktc_encryptionKey sessionKey
         short kvno
+        afs_int32 startTime
+        afs_int32 endTime
         int ticketLen
         char ticket[MAXKTCTICKETLEN]
 
@@ -158,10 +160,24 @@ cdef extern from "afs/vice.h":
 cdef extern from "afs/venus.h":
     enum:
         # PIOCTLS to Venus that we use
-        VIOCGETAL, VIOC_GETVCXSTATUS2, VIOCSETAL, VIOC_FILE_CELL_NAME
+        VIOCGETAL, VIOC_GETVCXSTATUS2, VIOCSETAL, VIOC_FILE_CELL_NAME,
+        VIOCGETFID
 
 # pioctl doesn't actually have a header, so we have to define it here
-cdef extern int pioctl(char *, afs_int32, ViceIoctl *, afs_int32)
+cdef extern int pioctl(char *, afs_int32, ViceIoctl *, afs_int32) nogil
 cdef int pioctl_read(char *, afs_int32, void *, unsigned short, afs_int32) except -1
 cdef int pioctl_write(char *, afs_int32, char *, afs_int32) except -1
 
+# Instrumentation; see afs.stats. Bracket each RPC with these:
+#   start = rpc_start(self, 'PR_Foo')
+#   with nogil: code = ubik_PR_Foo(...)
+#   rpc_end(self, 'PR_Foo', start, code)
+cdef double rpc_start(object owner, object op) except? -1
+cdef int rpc_end(object owner, object op, double start, afs_int32 code) except -1
+
+# Strings cross into C as bytes: c_string encodes a name or path for
+# a char * argument, and py_string turns a char * result back into
+# the native str type.
+cdef bytes c_string(object s)
+cdef object py_string(bytes s)
+
@@ -10,33 +10,96 @@ cdef extern from "afs/vice.h": pass
 
 cdef int _init = 0
 
+# Instrumentation
+
+# The afs.stats.Registry that RPCs and pioctls are reported to, or
+# None if instrumentation is turned off
+cdef object _stats = None
+
+_pioctlNames = {
+    VIOCGETAL: 'VIOCGETAL',
+    VIOCSETAL: 'VIOCSETAL',
+    VIOC_GETVCXSTATUS2: 'VIOC_GETVCXSTATUS2',
+    VIOC_FILE_CELL_NAME: 'VIOC_FILE_CELL_NAME',
+    VIOCGETFID: 'VIOCGETFID',
+}
+
+def _setStats(stats):
+    global _stats
+    _stats = stats
+
+cdef double rpc_start(object owner, object op) except? -1:
+    """Report the start of an RPC, and return a start time to pass to rpc_end.
+
+    This returns 0 straight away when instrumentation is off.
+    """
+    if _stats is None:
+        return 0
+    return _stats._start(owner, op)
+
+cdef int rpc_end(object owner, object op, double start, afs_int32 code) except -1:
+    if _stats is None or start == 0:
+        return 0
+    _stats._end(owner, op, start, code)
+    return 0
+
+# Strings
+
+cdef bytes c_string(object s):
+    if isinstance(s, bytes):
+        return s
+    return s.encode('utf-8')
+
+cdef object py_string(bytes s):
+    if str is bytes:
+        return s
+    return s.decode('utf-8')
+
 # pioctl convenience wrappers
 
 cdef extern int pioctl_read(char *dir, afs_int32 op, void *buffer, unsigned short size, afs_int32 follow) except -1:
     cdef ViceIoctl blob
     cdef afs_int32 code
+    cdef int err
+    cdef double start = 0
+    cdef object name = None
     blob.in_size  = 0
     blob.out_size = size
     blob.out = buffer
-    code = pioctl(dir, op, &blob, follow)
+    if _stats is not None:
+        name = _pioctlNames.get(op, op)
+        start = rpc_start(None, name)
+    with nogil:
+        code = pioctl(dir, op, &blob, follow)
+    err = errno
+    rpc_end(None, name, start, err if code == -1 else code)
     # This might work with the rest of OpenAFS, but I'm not convinced
     # the rest of it is consistent
     if code == -1:
-        raise OSError(errno, strerror(errno))
+        raise OSError(err, strerror(err))
     pyafs_error(code)
     return code
 
 cdef extern int pioctl_write(char *dir, afs_int32 op, char *buffer, afs_int32 follow) except -1:
     cdef ViceIoctl blob
     cdef afs_int32 code
+    cdef int err
+    cdef double start = 0
+    cdef object name = None
     blob.cin = buffer
     blob.in_size = 1 + strlen(buffer)
     blob.out_size = 0
-    code = pioctl(dir, op, &blob, follow)
+    if _stats is not None:
+        name = _pioctlNames.get(op, op)
+        start = rpc_start(None, name)
+    with nogil:
+        code = pioctl(dir, op, &blob, follow)
+    err = errno
+    rpc_end(None, name, start, err if code == -1 else code)
     # This might work with the rest of OpenAFS, but I'm not convinced
     # the rest of it is consistent
     if code == -1:
-        raise OSError(errno, strerror(errno))
+        raise OSError(err, strerror(err))
     pyafs_error(code)
     return code
 
@@ -1,7 +1,14 @@
+import fnmatch
+import os
+import stat
 from afs import _acl
 from afs._acl import READ, WRITE, INSERT, LOOKUP, DELETE, LOCK, ADMINISTER, \
     USR0, USR1, USR2, USR3, USR4, USR5, USR6, USR7
-from afs._acl import getCallerAccess
+from afs._acl import getCallerAccess, showRights
+from afs._acl import parseRights as _parseRights, parseAcl as _parseAcl, \
+    unparseAcl as _unparseAcl, _charBitAssoc, _char2bit
+from afs import cache, util
+from afs._fs import getfid
 
 _canonical = {
     "read": "rl",
@@ -11,28 +18,7 @@ _canonical = {
     "none": "",
 }
 
-_reverseCanonical = dict((y, x) for (x, y) in _canonical.iteritems())
-
-_charBitAssoc = [
-    ('r', READ),
-    ('l', LOOKUP),
-    ('i', INSERT),
-    ('d', DELETE),
-    ('w', WRITE),
-    ('k', LOCK),
-    ('a', ADMINISTER),
-    ('A', USR0),
-    ('B', USR1),
-    ('C', USR2),
-    ('D', USR3),
-    ('E', USR4),
-    ('F', USR5),
-    ('G', USR6),
-    ('H', USR7),
-]
-
-_char2bit = dict(_charBitAssoc)
-
+_reverseCanonical = dict((y, x) for (x, y) in _canonical.items())
 
 def rightsToEnglish(s):
     """Turns a rlwidwka string into a canonical name if possible"""
@@ -46,50 +32,9 @@ def readRights(s):
     if s in _canonical: s = _canonical[s]
     return _parseRights(s)
 
-def showRights(r):
-    """Takes a bitmask and returns a rwlidka string"""
-    s = ""
-    for char,mask in _charBitAssoc:
-        if r & mask == mask: s += char
-    return s
-
-def _parseRights(s):
-    """Parses a rwlid... rights tring to bitmask"""
-    r = 0
-    try:
-        for c in s:
-            r = r | _char2bit[c]
-    except KeyError:
-        raise ValueError
-    return r
-
-def _parseAcl(inp):
-    lines = inp.split("\n")
-    npos = int(lines[0].split(" ")[0])
-    pos = {}
-    neg = {}
-    for l in lines[2:]:
-        if l == "": continue
-        name, acl = l.split()
-        if npos:
-            npos -= 1
-            pos[name] = int(acl)
-        else:
-            # negative acl
-            neg[name] = int(acl)
-    return (pos, neg)
-
-def _unparseAcl(pos, neg):
-    npos = len(pos)
-    nneg = len(neg)
-    acl = "%d\n%d\n" % (npos, nneg)
-    for p in pos.items():
-        acl += "%s\t%d\n" % p
-    for n in neg.items():
-        acl += "%s\t%d\n" % n
-    return acl
-
 class ACL(object):
+    __slots__ = ('pos', 'neg', '_orig')
+
     def __init__(self, pos, neg):
         """
         ``pos``
@@ -99,27 +44,86 @@ class ACL(object):
         """
         self.pos = pos
         self.neg = neg
+        # The directory this ACL was retrieved from or applied to, and
+        # its entries at the time, so apply can tell if it's changed
+        self._orig = None
     @staticmethod
     def retrieve(dir, follow=True):
-        """Retrieve the ACL for an AFS directory"""
+        """Retrieve the ACL for an AFS directory
+
+        This is safe to call from several threads at once; the GIL is
+        released while the pioctl is in progress, so retrievals in
+        different threads overlap.
+        """
         pos, neg = _parseAcl(_acl.getAcl(dir, follow))
-        return ACL(pos, neg)
+        acl = ACL(pos, neg)
+        acl._remember(dir)
+        return acl
     def apply(self, dir, follow=True):
-        """Apply the ACL to a directory"""
+        """Apply the ACL to a directory
+
+        If this ACL was retrieved from (or last applied to) dir and
+        hasn't been changed since, the pioctl is skipped.
+
+        Returns:
+          True if the directory's ACL was set, and False if it was
+          skipped
+        """
         self._clean()
+        if self._orig is not None and self._orig == (dir, self.pos, self.neg):
+            return False
         _acl.setAcl(dir, _unparseAcl(self.pos, self.neg), follow)
+        self._remember(dir)
+        return True
+    def _remember(self, dir):
+        self._orig = (dir, dict(self.pos), dict(self.neg))
     def _clean(self):
         """Clean an ACL by removing any entries whose bitmask is 0"""
-        for n,a in self.pos.items():
+        for n,a in list(self.pos.items()):
             if a == 0:
                 del self.pos[n]
-        for n,a in self.neg.items():
+        for n,a in list(self.neg.items()):
             if a == 0:
                 del self.neg[n]
+    def copy(self):
+        """Return a copy of the ACL that can be changed independently"""
+        acl = ACL(dict(self.pos), dict(self.neg))
+        acl._orig = self._orig
+        return acl
+    def _entries(self):
+        """Return the nonzero entries as a set of (name, negative, bitmask)"""
+        return set([(n, False, a) for (n, a) in self.pos.items() if a] +
+                   [(n, True, a) for (n, a) in self.neg.items() if a])
+    def __eq__(self, other):
+        if not isinstance(other, ACL):
+            return NotImplemented
+        return self._entries() == other._entries()
+    def __ne__(self, other):
+        if not isinstance(other, ACL):
+            return NotImplemented
+        return not self == other
+    __hash__ = None
+    def diff(self, other):
+        """Compare this ACL to another one
+
+        Returns:
+          A list of (name, negative, old, new) tuples, sorted by
+          negative and then name, one for each entry whose bitmask
+          differs; old is this ACL's bitmask for the entry, new is
+          other's, and a bitmask of 0 means the entry is absent
+        """
+        changes = []
+        for negative, old, new in ((False, self.pos, other.pos),
+                                   (True, self.neg, other.neg)):
+            for name in sorted(set(old) | set(new)):
+                a, b = old.get(name, 0), new.get(name, 0)
+                if a != b:
+                    changes.append((name, negative, a, b))
+        return changes
     def set(self, user, bitmask, negative=False):
         """Set the bitmask for a given user"""
         if bitmask < 0 or bitmask > max(_char2bit.values()):
-            raise ValueError, "Invalid bitmask"
+            raise ValueError("Invalid bitmask")
         if negative:
             self.neg[user] = bitmask
         else:
@@ -127,4 +131,402 @@ class ACL(object):
     def remove(self, user, negative=False):
         """Convenience function to removeSet the bitmask for a given user"""
         self.set(user, 0, negative)
-        
+
+def showDiff(diff):
+    """Format the output of ACL.diff as a list of lines
+
+    Each line looks like "+ user rl", "- user rl" or
+    "~ user rl -> rlidwk", with "(negative)" after the name for
+    negative entries.
+    """
+    lines = []
+    for name, negative, old, new in diff:
+        if negative:
+            name += ' (negative)'
+        if not old:
+            lines.append('+ %s %s' % (name, showRights(new)))
+        elif not new:
+            lines.append('- %s %s' % (name, showRights(old)))
+        else:
+            lines.append('~ %s %s -> %s' % (name, showRights(old),
+                                             showRights(new)))
+    return lines
+
+
+def _subdirs(path, dev=None):
+    """Return the paths of the directories directly inside path.
+
+    Symbolic links are skipped; AFS mount points look like ordinary
+    directories here, and are caught by walk's boundary check. If dev
+    is not None, directories on any other device (which can't be in
+    AFS) are skipped too.
+    """
+    subdirs = []
+    for name in os.listdir(path):
+        sub = os.path.join(path, name)
+        try:
+            st = os.lstat(sub)
+        except OSError:
+            # It was removed out from under us
+            continue
+        if stat.S_ISDIR(st.st_mode) and dev in (None, st.st_dev):
+            subdirs.append(sub)
+    return subdirs
+
+def _matches(path, patterns):
+    for p in patterns:
+        if fnmatch.fnmatch(path, p):
+            return True
+    return False
+
+def walk(top, boundary='volume', depth=None, include=None, exclude=None,
+         onerror=None, workers=util.WORKERS):
+    """Retrieve the ACL of every directory in an AFS tree.
+
+    Directories are listed and their ACLs retrieved on a pool of
+    worker threads, and results are yielded as they arrive, so the
+    order is breadth-first by level but otherwise unspecified.
+
+    The tree is walked one level at a time, and the paths of every
+    directory on the next level down are collected before any of them
+    is visited, so memory use grows with the widest level of the tree
+    (one path per directory on it), not with its total size. ACLs
+    aren't kept once they've been yielded.
+
+    Every AFS directory is on the same device, so stat can't tell a
+    mount point from any other directory. With a boundary, each
+    directory below top costs a VIOCGETFID pioctl, on top of the
+    VIOCGETAL for its ACL, to check which volume it's in; pass
+    boundary=None to save it when the tree is known not to cross
+    into other volumes.
+
+    Args:
+      top: The directory to start at
+      boundary: 'volume' to stay within the volume top is in (that
+        is, not to descend into mount points), 'cell' to stay within
+        top's cell, or None to go anywhere
+      depth: The number of levels below top to descend, or None for
+        no limit. With a depth of 0, only top itself is retrieved.
+      include: If not None, a list of glob patterns; only directories
+        whose path relative to top matches one of them are yielded.
+        Directories that don't match are still descended into.
+      exclude: A list of glob patterns; directories whose path
+        relative to top matches one of them are neither yielded nor
+        descended into
+      onerror: A function called with (path, exception) when a
+        directory can't be listed or its ACL can't be retrieved. Its
+        subdirectories are skipped. If None, the exception is raised.
+      workers: The number of pioctls to have in flight at once
+
+    Returns:
+      An iterator of (path, ACL) tuples
+    """
+    if boundary not in ('volume', 'cell', None):
+        raise ValueError("Invalid boundary: %r" % (boundary,))
+    if include is not None:
+        include = list(include)
+    exclude = list(exclude or ())
+
+    dev = None
+    if boundary is not None:
+        topfid = getfid(top)
+        dev = os.stat(top).st_dev
+
+    def scan(item):
+        path, d = item
+        if boundary is not None and d > 0:
+            fid = getfid(path)
+            if fid[0] != topfid[0] or \
+                    (boundary == 'volume' and fid[1] != topfid[1]):
+                return None
+        acl = ACL.retrieve(path)
+        if depth is not None and d >= depth:
+            return acl, []
+        return acl, _subdirs(path, dev)
+
+    level = [(top, 0)]
+    while level:
+        below = []
+        for (path, d), result, exc in util.imap(scan, level, workers):
+            if exc is not None:
+                if onerror is None:
+                    raise exc
+                onerror(path, exc)
+                continue
+            if result is None:
+                continue
+            acl, subdirs = result
+            if include is None or _matches(os.path.relpath(path, top), include):
+                yield path, acl
+            for sub in subdirs:
+                if not _matches(os.path.relpath(sub, top), exclude):
+                    below.append((sub, d + 1))
+        level = below
+
+# Transforms for ACLRewrite. Each returns a function that changes an
+# ACL in place.
+
+def _bitmask(rights):
+    if isinstance(rights, int):
+        return rights
+    return readRights(rights)
+
+def grant(user, rights, negative=False):
+    """Add rights (a bitmask or rights string) to user's entry"""
+    rights = _bitmask(rights)
+    def transform(acl):
+        entries = acl.neg if negative else acl.pos
+        entries[user] = entries.get(user, 0) | rights
+    return transform
+
+def revoke(user, rights=None, negative=False):
+    """Take rights away from user's entry, or remove it if rights is None"""
+    if rights is not None:
+        rights = _bitmask(rights)
+    def transform(acl):
+        entries = acl.neg if negative else acl.pos
+        if user not in entries:
+            return
+        if rights is None:
+            del entries[user]
+        else:
+            entries[user] &= ~rights
+    return transform
+
+def setRights(user, rights, negative=False):
+    """Set user's entry to exactly rights"""
+    rights = _bitmask(rights)
+    def transform(acl):
+        (acl.neg if negative else acl.pos)[user] = rights
+    return transform
+
+def replace(old, new):
+    """Move old's positive and negative entries to new
+
+    If new already has an entry, the rights are combined.
+    """
+    def transform(acl):
+        for entries in (acl.pos, acl.neg):
+            if old in entries:
+                entries[new] = entries.get(new, 0) | entries.pop(old)
+    return transform
+
+class ACLRewrite(object):
+    """Change the ACL of every directory in an AFS tree
+
+    The tree is walked with walk(), which retrieves ACLs in parallel.
+    Each ACL is run through the transforms, and setAcl is only called
+    for directories whose ACL actually changed, again in parallel.
+
+    Iterating over an ACLRewrite does the work, and yields a
+    (path, diff) tuple for each directory that was (or, in dry-run
+    mode, would have been) changed, where diff is as returned by
+    ACL.diff. run() does the whole thing without yielding anything.
+
+    For example:
+
+        rw = ACLRewrite('/afs/cell/proj', [revoke('olduser'),
+                                           grant('newgroup', 'write')],
+                        dryrun=True)
+        for path, diff in rw:
+            print(path)
+            for line in showDiff(diff):
+                print('  ' + line)
+        print(rw)
+
+    Args:
+      top: The directory to start at
+      transforms: A list of functions, such as those returned by
+        grant, revoke, setRights and replace, that change an ACL in
+        place
+      dryrun: If true, compute the changes but don't make them
+      workers: The number of pioctls to have in flight at once
+      boundary, depth, include, exclude: See walk
+
+    Attributes:
+      changed: A list of the paths whose ACL was (or would be) changed
+      unchanged: The number of directories whose ACL was left alone
+      failed: A list of (path, exception) pairs for directories whose
+        ACL couldn't be retrieved or set
+    """
+    def __init__(self, top, transforms, dryrun=False, workers=util.WORKERS,
+                 boundary='volume', depth=None, include=None, exclude=None):
+        self.top = top
+        self.transforms = list(transforms)
+        self.dryrun = dryrun
+        self.workers = workers
+        self._walkArgs = dict(boundary=boundary, depth=depth,
+                              include=include, exclude=exclude)
+        self.changed = []
+        self.unchanged = 0
+        self.failed = []
+
+    def _changes(self):
+        """Yield (path, old ACL, new ACL) for each ACL that changes"""
+        for path, acl in walk(self.top, onerror=self._failed,
+                              workers=self.workers, **self._walkArgs):
+            new = acl.copy()
+            for transform in self.transforms:
+                transform(new)
+            new._clean()
+            if new == acl:
+                self.unchanged += 1
+            else:
+                yield path, acl, new
+
+    def _failed(self, path, exc):
+        self.failed.append((path, exc))
+
+    def __iter__(self):
+        if self.dryrun:
+            for path, acl, new in self._changes():
+                self.changed.append(path)
+                yield path, acl.diff(new)
+            return
+
+        def apply(change):
+            path, acl, new = change
+            new.apply(path)
+        for (path, acl, new), _, exc in util.imap(apply, self._changes(),
+                                                  self.workers):
+            if exc is not None:
+                self._failed(path, exc)
+            else:
+                self.changed.append(path)
+                yield path, acl.diff(new)
+
+    def run(self):
+        """Make all of the changes, and return self"""
+        for change in self:
+            pass
+        return self
+
+    def __repr__(self):
+        return '<ACLRewrite of %s: %d changed, %d unchanged, %d failed%s>' % (
+            self.top, len(self.changed), self.unchanged, len(self.failed),
+            ' (dry run)' if self.dryrun else '')
+
+# Entries every authenticated principal matches, and the group whose
+# members get implicit rights everywhere
+_ANYUSER = 'system:anyuser'
+_AUTHUSER = 'system:authuser'
+_ADMINISTRATORS = 'system:administrators'
+
+class RightsEvaluator(object):
+    """Compute a principal's effective rights on ACLs, offline
+
+    This works out what a fileserver would grant a principal, without
+    having to hold that principal's tokens:
+
+    - the principal's CPS is itself, every group it's a member of
+      (including through supergroups), system:anyuser and
+      system:authuser, as PTEntry.cps reports it
+    - its rights are the union of the positive entries for anything
+      in the CPS, minus the union of the negative entries for
+      anything in the CPS
+    - members of system:administrators also get l and a on every
+      directory, whatever the ACL says
+    - the owner of a volume (that is, of its root directory) gets a
+      on every directory in the volume, and l on its root; since the
+      owner isn't part of the ACL, this is only taken into account
+      when it's passed to rights or evaluate
+
+    ACL entries are matched against both the names and the PTS IDs in
+    the CPS, so entries for deleted users or groups, which show up as
+    bare IDs, still count. Each principal's CPS is fetched with one
+    RPC and its names resolved in one batch, then cached.
+
+    Args:
+      pts: The afs.pts.PTS (or afs.snapshot.SnapshotPTS) to look
+        principals up in
+      cachesize: The maximum number of CPSes to cache, or None for no
+        limit
+    """
+    def __init__(self, pts, cachesize=1024):
+        self.pts = pts
+        self._cps = cache.LRUCache(cachesize)
+
+    def cps(self, principal):
+        """Return the CPS of a principal
+
+        Args:
+          principal: A name, PTS ID, or PTEntry, or None for an
+            unauthenticated user
+
+        Returns:
+          A frozenset of the names and PTS IDs (as strings) that
+          match the principal in an ACL
+        """
+        if principal is None:
+            return frozenset([_ANYUSER])
+        ent = self.pts.getEntry(principal)
+        cps = self._cps.get(ent.id)
+        if cps is not None:
+            return cps
+
+        names = set([_ANYUSER, _AUTHUSER])
+        for e in self.pts.getEntries(set(ent.cps) | set([ent.id])):
+            if e is not None:
+                names.add(e.name)
+                names.add(str(e.id))
+        return self._cps.setdefault(ent.id, frozenset(names))
+
+    def _isOwner(self, principal, owner):
+        return owner is not None and principal is not None and \
+            self.pts.getEntry(owner).id == self.pts.getEntry(principal).id
+
+    def _rights(self, acl, cps, owner=False, root=False):
+        rights = 0
+        for name, bits in acl.pos.items():
+            if name in cps:
+                rights |= bits
+        for name, bits in acl.neg.items():
+            if name in cps:
+                rights &= ~bits
+        if _ADMINISTRATORS in cps:
+            rights |= LOOKUP | ADMINISTER
+        if owner:
+            rights |= ADMINISTER
+            if root:
+                rights |= LOOKUP
+        return rights
+
+    def rights(self, acl, principal, owner=None, root=False):
+        """Return principal's effective rights on an ACL, as a bitmask
+
+        Args:
+          acl: The ACL
+          principal: See cps
+          owner: The name or PTS ID of the owner of the volume the ACL
+            is in, or None to ignore the owner's implicit rights
+          root: Whether the ACL is that of the volume's root directory
+        """
+        return self._rights(acl, self.cps(principal),
+                            self._isOwner(principal, owner), root)
+
+    def evaluate(self, acls, principal, owner=None, root=None):
+        """Compute principal's effective rights on many ACLs at once
+
+        Args:
+          acls: An iterable of (path, ACL) pairs, such as the output
+            of walk
+          principal: See cps
+          owner: The name or PTS ID of the owner of the volume the
+            ACLs are in, or None to ignore the owner's implicit rights
+          root: The path of the volume's root directory, if it's
+            among acls
+
+        Returns:
+          A dictionary mapping each path to a bitmask
+        """
+        cps = self.cps(principal)
+        isOwner = self._isOwner(principal, owner)
+        return dict((path, self._rights(acl, cps, isOwner, path == root))
+                    for (path, acl) in acls)
+
+    def forget(self, principal=None):
+        """Drop the cached CPS of a principal, or of everyone"""
+        if principal is None:
+            self._cps.clear()
+        else:
+            self._cps.pop(self.pts.getEntry(principal).id)
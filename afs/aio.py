@@ -0,0 +1,313 @@
+"""
+asyncio front ends for PTS and ACL operations
+
+Every RPC and pioctl is run on a bounded thread pool, so none of them
+block the event loop. Identical lookups that are already in flight
+are coalesced: if many coroutines ask for the same thing at once, one
+call is made and they all get its result.
+
+This module requires Python 3.7 or later.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import weakref
+
+from afs import util
+from afs.acl import ACL, getCallerAccess
+from afs.pts import PTS, PTEntry, PTS_AUTH
+
+
+class _Limit(object):
+    """Count the calls in flight, and hold new ones back past a limit.
+
+    Each caller passes its own limit to acquire, and waits until fewer
+    than that many calls are in flight. A _Limit belongs to a single
+    event loop.
+    """
+    def __init__(self):
+        self.active = 0
+        self._waiters = []
+
+    async def acquire(self, limit):
+        while self.active >= limit:
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            await fut
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        waiters, self._waiters = self._waiters, []
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(None)
+
+
+# The calls in flight to each cell, by event loop, shared by every
+# AsyncPTS talking to that cell from the loop
+_cellLimits = weakref.WeakKeyDictionary()
+
+
+def _cellLimit(cell):
+    limits = _cellLimits.setdefault(asyncio.get_running_loop(), {})
+    if cell not in limits:
+        limits[cell] = _Limit()
+    return limits[cell]
+
+
+class _AsyncRunner(object):
+    """Shared machinery for running blocking calls off the event loop.
+
+    Args:
+      executor: A concurrent.futures.Executor to run calls on. If
+        None, a thread pool of workers threads is created, and shut
+        down by close().
+      workers: The size of the thread pool to create if executor is
+        None.
+    """
+    def __init__(self, executor=None, workers=util.WORKERS):
+        if executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+            self._ownExecutor = True
+        else:
+            self._executor = executor
+            self._ownExecutor = False
+        self._limit = workers
+        # Futures and _Limits belong to a single event loop, so each
+        # loop this object is used from gets its own
+        self._limits = weakref.WeakKeyDictionary()
+        self._inflights = weakref.WeakKeyDictionary()
+
+    def _limiter(self):
+        """Return the _Limit for calls made from the running loop."""
+        loop = asyncio.get_running_loop()
+        if loop not in self._limits:
+            self._limits[loop] = _Limit()
+        return self._limits[loop]
+
+    async def _run(self, func, *args):
+        limiter = self._limiter()
+        await limiter.acquire(self._limit)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(func, *args))
+        finally:
+            limiter.release()
+
+    async def _call(self, key, func, *args):
+        """Run func(*args) on the executor, coalescing by key.
+
+        If a call with the same key is already in flight, wait for
+        its result instead of making another. Cancelling one waiter
+        doesn't cancel the call for the others.
+        """
+        inflight = self._inflights.setdefault(asyncio.get_running_loop(), {})
+        fut = inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._run(func, *args))
+            inflight[key] = fut
+
+            def done(f):
+                if inflight.get(key) is f:
+                    del inflight[key]
+            fut.add_done_callback(done)
+        return await asyncio.shield(fut)
+
+    def close(self):
+        """Shut down the thread pool, if this object created it."""
+        if self._ownExecutor:
+            self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+
+class AsyncPTS(_AsyncRunner):
+    """An asyncio front end for a connection to a protection database.
+
+    AsyncPTS wraps an afs.pts.PTS object, and offers coroutine
+    versions of its lookups. The PTEntry objects it returns are the
+    wrapped PTS object's, so its cache is shared; touching an
+    attribute of one that hasn't been loaded yet still blocks, so use
+    load(), members() and groups() to load them first.
+
+    Args:
+      pts: The afs.pts.PTS object to wrap. If None, one is created
+        for cell and sec, on the executor, the first time it's
+        needed; until then, the pts attribute is None.
+      cell: The cell to connect to, if pts is None
+      sec: The security level to connect with, if pts is None
+      limit: The maximum number of calls to have in flight to this
+        cell at once, across every AsyncPTS for the cell on the same
+        event loop. A call made through this AsyncPTS waits while
+        limit or more calls to the cell are in flight.
+      executor: A concurrent.futures.Executor to run calls on. If
+        None, a thread pool of limit threads is created.
+    """
+    def __init__(self, pts=None, cell=None, sec=PTS_AUTH,
+                 limit=util.WORKERS, executor=None):
+        super(AsyncPTS, self).__init__(executor, limit)
+        self.pts = pts
+        self._cell = cell
+        self._sec = sec
+
+    def _limiter(self):
+        if self.pts is None:
+            # Still connecting, and the cell's name isn't known yet
+            return super(AsyncPTS, self)._limiter()
+        return _cellLimit(self.pts.cell)
+
+    def _connect(self):
+        pts = PTS(self._cell, self._sec)
+        if self.pts is None:
+            self.pts = pts
+        return self.pts
+
+    async def _connected(self):
+        """Return the wrapped PTS object, connecting first if need be.
+
+        Connecting blocks, so it's done on the executor, once for
+        however many coroutines are waiting on it.
+        """
+        if self.pts is None:
+            return await self._call(('connect',), self._connect)
+        return self.pts
+
+    @staticmethod
+    def _key(ident):
+        if isinstance(ident, PTEntry):
+            return ident.id
+        elif isinstance(ident, str):
+            return ident.lower()
+        else:
+            return int(ident)
+
+    async def getEntry(self, ident):
+        """Retrieve a PTEntry; see afs.pts.PTS.getEntry."""
+        pts = await self._connected()
+        return await self._call(('getEntry', self._key(ident)),
+                                pts.getEntry, ident)
+
+    async def getEntries(self, idents):
+        """Retrieve several PTEntries; see afs.pts.PTS.getEntries."""
+        idents = list(idents)
+        pts = await self._connected()
+        return await self._call(('getEntries', tuple(map(self._key, idents))),
+                                pts.getEntries, idents)
+
+    def _load(self, ident):
+        ent = self.pts.getEntry(ident)
+        ent.owner
+        ent.creator
+        return ent
+
+    async def load(self, ident):
+        """Retrieve a PTEntry with its attributes loaded.
+
+        The entry's owner and creator are looked up too, so reading
+        any attribute of the result other than groups or members
+        doesn't block.
+        """
+        await self._connected()
+        return await self._call(('load', self._key(ident)), self._load, ident)
+
+    def _relation(self, ident, ids):
+        ent = self.pts.getEntry(ident)
+        if ent.id < 0:
+            rel = ent.members
+        else:
+            rel = ent.groups
+        if ids:
+            return rel.ids()
+        return frozenset(rel)
+
+    async def members(self, ident):
+        """Return the members of a group as a frozenset of PTEntries."""
+        await self._connected()
+        return await self._call(('members', self._key(ident)),
+                                self._relation, ident, False)
+
+    async def groups(self, ident):
+        """Return the groups a user is in as a frozenset of PTEntries."""
+        await self._connected()
+        return await self._call(('groups', self._key(ident)),
+                                self._relation, ident, False)
+
+    async def ids(self, ident):
+        """Return the PTS IDs of a group's members or a user's groups.
+
+        No names are looked up; see afs.pts.PTRelationSet.ids.
+        """
+        await self._connected()
+        return await self._call(('ids', self._key(ident)),
+                                self._relation, ident, True)
+
+    async def isMember(self, user, group):
+        """Return True if user is a member of group."""
+        pts = await self._connected()
+        return await self._call(('isMember', self._key(user), self._key(group)),
+                                pts._IsAMemberOf,
+                                self._key(user), self._key(group))
+
+    async def umax(self):
+        """Return the maximum user ID currently assigned."""
+        pts = await self._connected()
+        return (await self._call(('listMax',), pts._ListMax))[0]
+
+    async def gmax(self):
+        """Return the maximum group ID currently assigned."""
+        pts = await self._connected()
+        return (await self._call(('listMax',), pts._ListMax))[1]
+
+    async def iterPages(self, users=None, groups=None, startindex=0):
+        """Asynchronously iterate over the PRDB one page at a time.
+
+        This yields the same (entries, cursor) tuples as
+        afs.pts.PTS.iterPages, fetching each page off the event loop.
+        """
+        pts = await self._connected()
+        pages = pts.iterPages(users, groups, startindex)
+        done = object()
+        while True:
+            page = await self._run(next, pages, done)
+            if page is done:
+                return
+            yield page
+
+    async def iterEntries(self, users=None, groups=None, startindex=0):
+        """Asynchronously iterate over entries in the PRDB."""
+        async for entries, _ in self.iterPages(users, groups, startindex):
+            for ent in entries:
+                yield ent
+
+
+class AsyncACL(_AsyncRunner):
+    """An asyncio front end for AFS ACL operations.
+
+    Args:
+      limit: The maximum number of pioctls to have in flight at once
+      executor: A concurrent.futures.Executor to run calls on. If
+        None, a thread pool of limit threads is created.
+    """
+    def __init__(self, limit=util.WORKERS, executor=None):
+        super(AsyncACL, self).__init__(executor, limit)
+
+    async def retrieve(self, dir, follow=True):
+        """Retrieve the ACL for an AFS directory; see afs.acl.ACL.retrieve."""
+        return await self._call(('retrieve', dir, follow),
+                                ACL.retrieve, dir, follow)
+
+    async def getCallerAccess(self, dir, follow=True):
+        """Return the caller's access to an AFS directory as a bitmask."""
+        return await self._call(('getCallerAccess', dir, follow),
+                                getCallerAccess, dir, follow)
+
+    async def apply(self, acl, dir, follow=True):
+        """Apply an ACL to a directory; see afs.acl.ACL.apply."""
+        return await self._run(acl.apply, dir, follow)
@@ -0,0 +1,129 @@
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """A dictionary-like cache with LRU eviction and expiry.
+
+    Once the cache holds maxsize items, adding another evicts the
+    least recently used one. Items older than ttl seconds are treated
+    as absent and dropped when next looked at.
+
+    LRUCache is safe to use from multiple threads.
+
+    Args:
+      maxsize: The maximum number of items to hold, or None for no
+        limit
+      ttl: The number of seconds an item stays valid, or None if items
+        never expire
+
+    Attributes:
+      hits: The number of lookups that found a valid item
+      misses: The number of lookups that didn't
+      evictions: The number of items dropped to make room for others
+      expirations: The number of items dropped because they expired
+    """
+    def __init__(self, maxsize=None, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def _lookup(self, key):
+        """Return the (value, stamp) pair for key, or None.
+
+        Expired items are dropped. The caller must hold self._lock.
+        """
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if self.ttl is not None and time.time() - item[1] > self.ttl:
+            del self._data[key]
+            self.expirations += 1
+            return None
+        return item
+
+    def get(self, key, default=None):
+        """Return the value for key, marking it as recently used."""
+        with self._lock:
+            item = self._lookup(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            # Move the item to the most recently used end
+            del self._data[key]
+            self._data[key] = item
+            return item[0]
+
+    def __getitem__(self, key):
+        with self._lock:
+            item = self._lookup(key)
+            if item is None:
+                raise KeyError(key)
+            return item[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time())
+            while self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def setdefault(self, key, value):
+        """Return the value for key, storing value there if it's absent.
+
+        The check and the store happen atomically.
+        """
+        with self._lock:
+            item = self._lookup(key)
+            if item is not None:
+                return item[0]
+            self[key] = value
+            return value
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return default
+            return item[0]
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def values(self):
+        with self._lock:
+            return [v for (v, _) in self._data.values()]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return a dictionary of this cache's counters and size."""
+        with self._lock:
+            return {'size': len(self._data),
+                    'maxsize': self.maxsize,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations}
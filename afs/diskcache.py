@@ -0,0 +1,274 @@
+"""
+A persistent cache of PRDB entries, shared between processes
+
+A DiskCache keeps name <-> PTS ID mappings, and the rest of each
+entry's ListEntry fields, in an SQLite database on local disk. Any
+number of processes on a host can open the same file at once; each
+one that's handed it as the diskcache of a PTS object answers lookups
+from it before going to the network, and adds what it looks up, so a
+short-lived process starts warm.
+
+Each record expires ttl seconds after it was stored. Mappings and
+fields expire separately, since entry fields (owners, counts) change
+far more often than names and IDs do. Changes made through a PTS
+object using the cache drop the records they affect, but changes made
+elsewhere are only noticed once the records expire.
+
+The database is opened in write-ahead-logging mode, so readers don't
+block writers or each other, and concurrent writers wait for one
+another. It's a cache, so failing to read from or write to it is never
+an error: the lookup just goes to the network.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from afs import _pts
+
+# SQLite limits the number of parameters in a single statement
+_CHUNK = 500
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS entries (
+    cell TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    expires REAL NOT NULL,
+    flags INTEGER,
+    owner INTEGER,
+    creator INTEGER,
+    ngroups INTEGER,
+    nusers INTEGER,
+    count INTEGER,
+    fieldsexpire REAL,
+    PRIMARY KEY (cell, id)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS entries_name ON entries (cell, name);
+'''
+
+_fields = ('flags', 'owner', 'creator', 'ngroups', 'nusers', 'count')
+
+
+def _text(s):
+    """Return s as text, for passing to SQLite."""
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
+
+
+def _str(s):
+    """Return text from SQLite as a native string."""
+    if str is bytes and not isinstance(s, bytes):
+        return s.encode('utf-8')
+    return s
+
+
+def _chunks(items):
+    items = list(items)
+    for i in range(0, len(items), _CHUNK):
+        yield items[i:i + _CHUNK]
+
+
+class DiskCache(object):
+    """An on-disk cache of PRDB entries, shared between processes.
+
+    Pass a DiskCache (or just the path to one) as the diskcache
+    argument of afs.pts.PTS. One DiskCache can be shared by PTS
+    objects for several cells, and by any number of threads.
+
+    Args:
+      path: The database file. It's created if it doesn't exist.
+      ttl: The number of seconds a name <-> ID mapping stays valid
+      fieldsttl: The number of seconds the other fields of an entry
+        stay valid
+      timeout: The number of seconds to wait for another process that
+        is writing to the database
+
+    Attributes:
+      hits, misses: The number of lookups answered from the database,
+        and not
+    """
+    def __init__(self, path, ttl=86400, fieldsttl=300, timeout=5):
+        self.path = path
+        self.ttl = ttl
+        self.fieldsttl = fieldsttl
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Create the database now if possible, but a database that
+        # can't be opened just makes every lookup a miss
+        try:
+            self._db()
+        except sqlite3.Error:
+            pass
+
+    def _db(self):
+        """Return this thread's connection to the database.
+
+        Raises:
+          sqlite3.Error: The database couldn't be opened, or set up
+        """
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout)
+            try:
+                db.execute('PRAGMA journal_mode=WAL')
+                db.execute('PRAGMA synchronous=NORMAL')
+                db.executescript(_schema)
+                db.commit()
+            except sqlite3.Error:
+                db.close()
+                raise
+            self._local.db = db
+        return db
+
+    def _query(self, sql, args):
+        try:
+            return self._db().execute(sql, args).fetchall()
+        except sqlite3.Error:
+            return []
+
+    def _write(self, statements):
+        """Run (sql, args) statements in one transaction, or not at all."""
+        try:
+            db = self._db()
+            with db:
+                for sql, args in statements:
+                    db.execute(sql, args)
+        except sqlite3.Error:
+            pass
+
+    def _count(self, hits, total):
+        with self._lock:
+            self.hits += hits
+            self.misses += total - hits
+
+    def ids(self, cell, names):
+        """Look up the PTS IDs of names.
+
+        Returns:
+          A dictionary mapping each name that's cached to its ID
+        """
+        names = [_text(n.lower()) for n in names]
+        found = {}
+        now = time.time()
+        for chunk in _chunks(names):
+            rows = self._query(
+                'SELECT name, id FROM entries WHERE cell = ? AND expires > ? '
+                'AND name IN (%s)' % ','.join('?' * len(chunk)),
+                [_text(cell), now] + chunk)
+            for name, id in rows:
+                found[_str(name)] = id
+        self._count(len(found), len(names))
+        return found
+
+    def names(self, cell, ids):
+        """Look up the names of PTS IDs.
+
+        Returns:
+          A dictionary mapping each ID that's cached to its name
+        """
+        ids = [int(i) for i in ids]
+        found = {}
+        now = time.time()
+        for chunk in _chunks(ids):
+            rows = self._query(
+                'SELECT id, name FROM entries WHERE cell = ? AND expires > ? '
+                'AND id IN (%s)' % ','.join('?' * len(chunk)),
+                [_text(cell), now] + chunk)
+            for id, name in rows:
+                found[id] = _str(name)
+        self._count(len(found), len(ids))
+        return found
+
+    def entry(self, cell, id):
+        """Return the cached fields of an entry as a _pts.PTEntry, or None."""
+        rows = self._query(
+            'SELECT name, %s FROM entries WHERE cell = ? AND id = ? '
+            'AND expires > ? AND fieldsexpire > ?' % ', '.join(_fields),
+            (_text(cell), int(id), time.time(), time.time()))
+        self._count(len(rows), 1)
+        if not rows:
+            return None
+        rec = _pts.PTEntry()
+        rec.id = int(id)
+        rec.name = _str(rows[0][0])
+        for field, value in zip(_fields, rows[0][1:]):
+            setattr(rec, field, value)
+        return rec
+
+    def _clashes(self, cell, id, name):
+        """Statements dropping the records that say otherwise about id
+        or name."""
+        return [('DELETE FROM entries WHERE cell = ? AND name = ? AND id != ?',
+                 (cell, name, id)),
+                ('DELETE FROM entries WHERE cell = ? AND id = ? AND name != ?',
+                 (cell, id, name))]
+
+    def storeNames(self, cell, pairs):
+        """Remember (name, PTS ID) pairs.
+
+        Any fields already cached for the IDs are kept.
+        """
+        cell = _text(cell)
+        expires = time.time() + self.ttl
+        statements = []
+        for name, id in pairs:
+            name = _text(name.lower())
+            statements.extend(self._clashes(cell, id, name))
+            statements.append((
+                'UPDATE entries SET expires = ? WHERE cell = ? AND id = ?',
+                (expires, cell, id)))
+            statements.append((
+                'INSERT OR IGNORE INTO entries (cell, id, name, expires) '
+                'VALUES (?, ?, ?, ?)', (cell, id, name, expires)))
+        self._write(statements)
+
+    def store(self, cell, records):
+        """Remember the name and fields of _pts.PTEntry records."""
+        cell = _text(cell)
+        now = time.time()
+        statements = []
+        for rec in records:
+            name = _text(rec.name.lower())
+            statements.extend(self._clashes(cell, rec.id, name))
+            statements.append((
+                'INSERT OR REPLACE INTO entries (cell, id, name, expires, '
+                '%s, fieldsexpire) VALUES (?, ?, ?, ?, %s)' %
+                (', '.join(_fields), ', '.join('?' * (len(_fields) + 1))),
+                [cell, rec.id, name, now + self.ttl] +
+                [getattr(rec, f) for f in _fields] + [now + self.fieldsttl]))
+        self._write(statements)
+
+    def forget(self, cell, ids=(), names=()):
+        """Drop the records for some PTS IDs and names."""
+        cell = _text(cell)
+        statements = []
+        for id in ids:
+            statements.append(('DELETE FROM entries WHERE cell = ? AND id = ?',
+                               (cell, int(id))))
+        for name in names:
+            statements.append(('DELETE FROM entries WHERE cell = ? AND name = ?',
+                               (cell, _text(name.lower()))))
+        self._write(statements)
+
+    def purge(self):
+        """Delete the records that have expired, to keep the file small."""
+        self._write([('DELETE FROM entries WHERE expires <= ?',
+                      (time.time(),))])
+
+    def clear(self, cell=None):
+        """Drop everything, or everything for one cell."""
+        if cell is None:
+            self._write([('DELETE FROM entries', ())])
+        else:
+            self._write([('DELETE FROM entries WHERE cell = ?',
+                          (_text(cell),))])
+
+    def __repr__(self):
+        return '<DiskCache %s: %d hits, %d misses>' % (
+            os.path.basename(self.path), self.hits, self.misses)
@@ -1,13 +1,144 @@
 import errno
+import os
+import stat
 from afs import _fs
-from afs._fs import whichcell
+from afs import cache
+from afs import util
+from afs._fs import getfid
+
+# What _DirCache stores for a directory that isn't in AFS
+_NOTAFS = object()
+
+
+class _DirCache(object):
+    """Caches a per-directory pioctl result for every path under it.
+
+    Every file is in the same cell and volume as the directory that
+    contains it; only directories can be mount points. So a file's
+    result is looked up (and cached) under its parent directory, and
+    a directory's under itself, and files in a directory that's
+    already been looked up cost only a stat.
+
+    Symlinks are resolved first, since the pioctls follow them.
+
+    Args:
+      lookup: A function that does the pioctl for a directory
+      maxsize: The number of directories to remember
+    """
+    def __init__(self, lookup, maxsize=65536):
+        self._lookup = lookup
+        self._cache = cache.LRUCache(maxsize)
+
+    @staticmethod
+    def _dir(path):
+        """Return the directory whose result applies to path."""
+        path = os.path.abspath(path)
+        if os.path.islink(path):
+            path = os.path.realpath(path)
+        if stat.S_ISDIR(os.stat(path).st_mode):
+            return path
+        return os.path.dirname(path)
+
+    def _get(self, dir):
+        result = self._cache.get(dir)
+        if result is None:
+            try:
+                result = self._lookup(dir)
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+                result = _NOTAFS
+            self._cache[dir] = result
+        if result is _NOTAFS:
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+        return result
+
+    def get(self, path):
+        return self._get(self._dir(path))
+
+    def getMany(self, paths, workers):
+        """Look up many paths, doing each distinct directory once.
+
+        Returns:
+          A list with the result for each path, or None for paths
+          that aren't in AFS or can't be looked up
+        """
+        dirs = []
+        for path in paths:
+            try:
+                dirs.append(self._dir(path))
+            except OSError:
+                dirs.append(None)
+        results = {None: None}
+        todo = set(dirs)
+        todo.discard(None)
+        for dir, result, exc in util.imap(self._get, todo, workers):
+            results[dir] = result if exc is None else None
+        return [results[d] for d in dirs]
+
+    def invalidate(self, path=None):
+        """Forget the results for path and everything under it.
+
+        If path is None, forget everything.
+        """
+        if path is None:
+            self._cache.clear()
+            return
+        path = os.path.abspath(path)
+        prefix = os.path.join(path, '')
+        for dir in self._cache.keys():
+            if dir == path or dir.startswith(prefix):
+                self._cache.pop(dir)
+
+_cells = _DirCache(lambda path: _fs.whichcell(path))
+_volumes = _DirCache(lambda path: getfid(path)[1])
+
+def whichcell(path):
+    """Determine which AFS cell a particular path is in.
+
+    Results are cached by directory (see invalidate), so only the
+    first lookup in each directory makes a pioctl.
+
+    Raises:
+      OSError: With errno EINVAL if path isn't in AFS
+    """
+    return _cells.get(path)
+
+def whichcell_many(paths, workers=util.WORKERS):
+    """Determine which AFS cell each of several paths is in.
+
+    The paths are grouped by directory, and each directory that
+    isn't already cached is looked up once, with up to workers
+    pioctls in flight at a time.
+
+    Returns:
+      A list of cell names, one for each path, with None for paths
+      that aren't in AFS or couldn't be looked up
+    """
+    return _cells.getMany(list(paths), workers)
+
+def invalidate(path=None):
+    """Forget cached cells and volumes for path and everything under it.
+
+    Call this after mounting or removing volumes, or with no
+    arguments to empty the cache entirely.
+    """
+    _cells.invalidate(path)
+    _volumes.invalidate(path)
 
 def inafs(path):
     """Return True if a path is in AFS."""
     try:
         whichcell(path)
-    except OSError, e:
+    except OSError as e:
         if e.errno in (errno.EINVAL, errno.ENOENT):
             return False
 
     return True
+
+def volumeid(path):
+    """Return the numeric ID of the volume a path is in.
+
+    This is cached by directory, like whichcell.
+    """
+    return _volumes.get(path)
@@ -0,0 +1,276 @@
+from array import array
+
+from afs import _pts
+from afs._util import AFSException
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+class PTGraph(object):
+    """An in-memory index of the membership and ownership in a PRDB.
+
+    PTGraph loads every entry in a protection database, along with
+    who is in each group and who owns and created each entry, and
+    answers questions about them locally. Questions like "which groups
+    does X own, transitively?" take one dictionary lookup per step,
+    instead of a chain of ListOwned, ListElements and ListEntry RPCs.
+
+    Entries are identified by PTS ID throughout; the query methods
+    accept either IDs or names, and return PTS IDs. Adjacency is kept
+    as compact arrays of 32-bit PTS IDs, one per entry.
+
+    The graph is loaded in bulk when it's created: one ListEntries
+    sweep for all users and groups, plus one ListElements per group.
+    After that, refresh() reloads individual entries, and reload()
+    rebuilds the whole thing.
+
+    Args:
+      pts: The afs.pts.PTS (or afs.snapshot.SnapshotPTS) to index
+    """
+    def __init__(self, pts):
+        self._pts = pts
+        self.reload()
+
+    def reload(self):
+        """Rebuild the whole index from the PRDB."""
+        self._index = {}
+        self._byName = {}
+        self._ids = array('i')
+        self._names = []
+        self._owner = array('i')
+        self._creator = array('i')
+        self._members = []
+        self._groups = []
+        # Owner ID to the IDs of the groups it owns
+        self._ownedBy = {}
+        # Slots left behind by removed entries, for reuse
+        self._free = []
+
+        for rec in self._pts._ListEntries(users=True, groups=True):
+            self._update(rec)
+        for id in self._ids:
+            if id < 0:
+                self._setMembers(id, self._pts._ListMembers(id))
+
+    def refresh(self, idents):
+        """Reload a handful of entries from the PRDB.
+
+        Each entry's name, owner, creator, and membership (for groups)
+        or groups (for users) is fetched again, and the index is
+        updated to match. Entries that no longer exist are dropped,
+        and entries that weren't indexed before are added.
+
+        Args:
+          idents: An iterable of names or PTS IDs
+        """
+        for ident in idents:
+            try:
+                rec = self._pts._ListEntry(ident)
+            except AFSException as e:
+                if e.errno != _pts.PRNOENT:
+                    raise
+                if isinstance(ident, basestring):
+                    ident = self._byName.get(ident.lower())
+                if ident is not None:
+                    self._remove(int(ident))
+                continue
+
+            self._update(rec)
+            listed = self._pts._ListMembers(rec.id)
+            if rec.id < 0:
+                self._setMembers(rec.id, listed)
+            else:
+                # Groups the user was added to that the graph hasn't
+                # seen yet; indexing them links the user to them too
+                for gid in listed:
+                    if gid not in self._index:
+                        self._update(self._pts._ListEntry(gid))
+                        self._setMembers(gid, self._pts._ListMembers(gid))
+                i = self._index[rec.id]
+                old = set(self._groups[i])
+                for gid in old - set(listed):
+                    self._unlink(rec.id, gid)
+                for gid in set(listed) - old:
+                    self._link(rec.id, gid)
+
+    def _update(self, rec):
+        """Add an entry to the index, or update it, from a _pts.PTEntry."""
+        i = self._index.get(rec.id)
+        if i is None:
+            if self._free:
+                i = self._free.pop()
+                self._ids[i] = rec.id
+                self._owner[i] = rec.owner
+            else:
+                i = len(self._ids)
+                self._ids.append(rec.id)
+                self._names.append(None)
+                self._owner.append(rec.owner)
+                self._creator.append(rec.creator)
+                self._members.append(array('i'))
+                self._groups.append(array('i'))
+            self._index[rec.id] = i
+            if rec.id < 0:
+                self._ownedBy.setdefault(rec.owner, array('i')).append(rec.id)
+        elif self._owner[i] != rec.owner:
+            if rec.id < 0:
+                self._ownedBy[self._owner[i]].remove(rec.id)
+                self._ownedBy.setdefault(rec.owner, array('i')).append(rec.id)
+            self._owner[i] = rec.owner
+
+        if self._names[i] is not None:
+            del self._byName[self._names[i]]
+        self._names[i] = rec.name
+        self._byName[rec.name] = rec.id
+        self._creator[i] = rec.creator
+
+    def _remove(self, id):
+        """Drop an entry and all of its edges from the index."""
+        i = self._index.pop(id, None)
+        if i is None:
+            return
+        for m in list(self._members[i]):
+            self._unlink(m, id)
+        for g in list(self._groups[i]):
+            self._unlink(id, g)
+        if id < 0:
+            self._ownedBy[self._owner[i]].remove(id)
+        del self._byName[self._names[i]]
+        self._names[i] = None
+        self._members[i] = array('i')
+        self._groups[i] = array('i')
+        self._free.append(i)
+
+    def _link(self, uid, gid):
+        if gid in self._index:
+            self._members[self._index[gid]].append(uid)
+        if uid in self._index:
+            self._groups[self._index[uid]].append(gid)
+
+    def _unlink(self, uid, gid):
+        if gid in self._index:
+            members = self._members[self._index[gid]]
+            if uid in members:
+                members.remove(uid)
+        if uid in self._index:
+            groups = self._groups[self._index[uid]]
+            if gid in groups:
+                groups.remove(gid)
+
+    def _setMembers(self, gid, members):
+        old = set(self._members[self._index[gid]])
+        for uid in old - set(members):
+            self._unlink(uid, gid)
+        for uid in set(members) - old:
+            self._link(uid, gid)
+
+    def _id(self, ident):
+        """Return the PTS ID for a name or ID, or raise KeyError."""
+        if isinstance(ident, basestring):
+            return self._byName[ident.lower()]
+        id = int(ident)
+        if id not in self._index:
+            raise KeyError(ident)
+        return id
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, ident):
+        try:
+            self._id(ident)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def name(self, ident):
+        """Return the name of an entry."""
+        return self._names[self._index[self._id(ident)]]
+
+    def owner(self, ident):
+        """Return the PTS ID of an entry's owner."""
+        return self._owner[self._index[self._id(ident)]]
+
+    def creator(self, ident):
+        """Return the PTS ID of an entry's creator."""
+        return self._creator[self._index[self._id(ident)]]
+
+    def members(self, ident):
+        """Return the PTS IDs of the members of a group."""
+        return frozenset(self._members[self._index[self._id(ident)]])
+
+    def groups(self, ident):
+        """Return the PTS IDs of the groups a user is a member of."""
+        return frozenset(self._groups[self._index[self._id(ident)]])
+
+    def owned(self, ident, transitive=False):
+        """Return the PTS IDs of the groups an entry owns.
+
+        Args:
+          ident: The owner's name or PTS ID
+          transitive: If true, also include the groups owned by those
+            groups, and so on.
+        """
+        id = self._id(ident)
+        owned = set()
+        todo = [id]
+        while todo:
+            for gid in self._ownedBy.get(todo.pop(), ()):
+                if gid not in owned and gid != id:
+                    owned.add(gid)
+                    if transitive:
+                        todo.append(gid)
+        return frozenset(owned)
+
+    def ownedViaMembership(self, ident, transitive=False):
+        """Return the PTS IDs of the groups a user controls as a member.
+
+        These are the groups whose owner is a group the user is a
+        member of; see owned for the meaning of transitive.
+        """
+        owned = set()
+        for gid in self.groups(ident):
+            owned.update(self._ownedBy.get(gid, ()))
+            if transitive:
+                owned.update(self.owned(gid, transitive=True))
+        return frozenset(owned)
+
+    def ownerChain(self, ident):
+        """Return the chain of owners above an entry.
+
+        Returns:
+          A list of PTS IDs: the entry's owner, that entry's owner,
+          and so on, stopping at an entry that owns itself, an owner
+          that isn't in the PRDB, or a cycle.
+        """
+        id = self._id(ident)
+        chain = []
+        seen = set([id])
+        while id in self._index:
+            id = self._owner[self._index[id]]
+            if id in seen:
+                break
+            chain.append(id)
+            seen.add(id)
+        return chain
+
+    def orphans(self):
+        """Return the PTS IDs of the groups whose owner doesn't exist."""
+        return frozenset(id for id in self._index
+                         if id < 0 and
+                         self._owner[self._index[id]] not in self._index)
+
+    def intersection(self, *idents):
+        """Return the PTS IDs of the entries that are in every group."""
+        if not idents:
+            return frozenset()
+        common = set(self.members(idents[0]))
+        for ident in idents[1:]:
+            common.intersection_update(self._members[self._index[self._id(ident)]])
+        return frozenset(common)
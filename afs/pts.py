@@ -1,10 +1,27 @@
 import collections
+import threading
+import time
 from afs import _pts
+from afs import cache
+from afs import stats
+from afs import util
+from afs._util import AFSException
+from afs.diskcache import DiskCache
+from afs._pts import TruncatedListWarning, flushConnections
 
 try:
     SetMixin = collections.MutableSet
 except AttributeError:
-    SetMixin = object
+    try:
+        import collections.abc
+        SetMixin = collections.abc.MutableSet
+    except ImportError:
+        SetMixin = object
+
+try:
+    basestring
+except NameError:
+    basestring = str
 
 class PTRelationSet(SetMixin):
     """Collection class for the groups/members of a PTEntry.
@@ -16,8 +33,12 @@ class PTRelationSet(SetMixin):
     Attributes:
         _ent: The PTEntry whose groups/members this instance
             represents
-        _set: If defined, the set of either groups or members for this
-            instance's PTEntry
+        _ids: If defined, the set of PTS IDs of either groups or
+            members for this instance's PTEntry
+        _set: If defined, a dictionary mapping the PTS ID of each of
+            the groups or members for this instance's PTEntry to its
+            PTEntry. It's keyed by ID, since an entry that's been
+            evicted from the cache comes back as a different object.
     """
     def __init__(self, ent):
         """Initialize a PTRelationSet class.
@@ -29,16 +50,43 @@ class PTRelationSet(SetMixin):
 
         self._ent = ent
 
+    def _loadIds(self):
+        """Load the PTS IDs of the membership/groups for this PTEntry.
+
+        If they have not previously been loaded, this method updates
+        self._ids with the set of PTS IDs that are either members of
+        this group, or the groups that this entry is a member of. No
+        names are looked up.
+        """
+        if hasattr(self, '_ids') and self._ent._pts._stale(self._loaded):
+            self._forget()
+        if not hasattr(self, '_ids'):
+            self._ids = set(self._ent._pts._ListMembers(self._ent.id))
+            self._loaded = time.time()
+
+    def _forget(self):
+        """Drop the loaded membership/groups, if any."""
+        for attr in ('_ids', '_set'):
+            if hasattr(self, attr):
+                delattr(self, attr)
+
     def _loadSet(self):
         """Load the membership/groups for this instance's PTEntry.
 
         If they have not previously been loaded, this method updates
-        self._set with the set of PTEntries that are either members of
-        this group, or the groups that this entry is a member of.
+        self._set with the PTEntries that are either members of this
+        group, or the groups that this entry is a member of.
+
+        Any IDs that aren't already cached are resolved in bulk, so
+        this costs a few RPCs no matter how large the set is.
         """
+        self._loadIds()
         if not hasattr(self, '_set'):
-            self._set = set(self._ent._pts.getEntry(m) for m in
-                            self._ent._pts._ListMembers(self._ent.id))
+            # An ID that no longer resolves was deleted out from under
+            # us after the membership was listed
+            self._set = dict((e.id, e)
+                             for e in self._ent._pts.getEntries(self._ids)
+                             if e is not None)
 
     def _add(self, elt):
         """Add a new PTEntry to this instance's internal representation.
@@ -50,8 +98,11 @@ class PTRelationSet(SetMixin):
         Args:
             elt: The element to add.
         """
+        if hasattr(self, '_ids'):
+            self._ids.add(self._ent._pts.getEntry(elt).id)
         if hasattr(self, '_set'):
-            self._set.add(self._ent._pts.getEntry(elt))
+            elt = self._ent._pts.getEntry(elt)
+            self._set[elt.id] = elt
 
     def _discard(self, elt):
         """Remove a PTEntry to this instance's internal representation.
@@ -63,8 +114,23 @@ class PTRelationSet(SetMixin):
         Args:
             elt: The element to discard.
         """
+        if hasattr(self, '_ids'):
+            self._ids.discard(self._ent._pts.getEntry(elt).id)
         if hasattr(self, '_set'):
-            self._set.discard(self._ent._pts.getEntry(elt))
+            self._set.pop(self._ent._pts.getEntry(elt).id, None)
+
+    def ids(self):
+        """Return the PTS IDs of the members/groups in this set.
+
+        Unlike iterating over the set, this never looks up any names,
+        so it's the cheap way to count members or do set arithmetic
+        on IDs.
+
+        Returns:
+            A frozenset of PTS IDs.
+        """
+        self._loadIds()
+        return frozenset(self._ids)
 
     def __len__(self):
         """Count the members/groups in this set.
@@ -72,8 +138,8 @@ class PTRelationSet(SetMixin):
         Returns:
             The number of entities in this instance.
         """
-        self._loadSet()
-        return len(self._set)
+        self._loadIds()
+        return len(self._ids)
 
     def __iter__(self):
         """Iterate over members/groups in this set
@@ -83,7 +149,7 @@ class PTRelationSet(SetMixin):
                 set.
         """
         self._loadSet()
-        return iter(self._set)
+        return iter(list(self._set.values()))
 
     def __contains__(self, name):
         """Test if a PTEntry is connected to this instance.
@@ -104,8 +170,12 @@ class PTRelationSet(SetMixin):
                 of name); otherwise, False
         """
         name = self._ent._pts.getEntry(name)
-        if hasattr(self, '_set'):
-            return name in self._set
+        if hasattr(self, '_ids'):
+            return name.id in self._ids
+        elif self._ent.id < 0 and name._hasCPS():
+            return self._ent.id in name._cps
+        elif self._ent.id > 0 and self._ent._hasCPS():
+            return name.id in self._ent._cps
         else:
             if self._ent.id < 0:
                 return self._ent._pts._IsAMemberOf(name.id, self._ent.id)
@@ -114,44 +184,82 @@ class PTRelationSet(SetMixin):
 
     def __repr__(self):
         self._loadSet()
-        return repr(self._set)
+        return repr(set(self._set.values()))
 
-    def add(self, elt):
-        """Add one new entity to a group.
+    def _pair(self, elt):
+        """Return the (user, group) PTS IDs relating elt to this entry.
 
-        This method will add a new user to a group, regardless of
-        whether this instance represents a group or a user. The change
-        is also immediately reflected to the PRDB.
+        elt is a PTEntry, or the bare PTS ID of a member/group that no
+        longer resolves to an entry.
 
         Raises:
-            TypeError: If you try to add a grop group to a group, or a
-                user to a user
+            TypeError: If elt and this instance's PTEntry are both
+                groups or both users
         """
-        elt = self._ent._pts.getEntry(elt)
-        if elt in self:
-            return
-
+        id = elt.id if isinstance(elt, PTEntry) else elt
         if self._ent.id < 0:
-            if elt.id < 0:
+            if id < 0:
                 raise TypeError(
                     "Adding group '%s' to group '%s' is not supported." %
                     (elt, self._ent))
-
-            self._ent._pts._AddToGroup(elt.id, self._ent.id)
-
-            elt.groups._add(self._ent)
+            return (id, self._ent.id)
         else:
-            if elt.id > 0:
+            if id > 0:
                 raise TypeError(
                     "Can't add user '%s' to user '%s'." %
                     (elt, self._ent))
+            return (self._ent.id, id)
 
-            self._ent._pts._AddToGroup(self._ent.id, elt.id)
-
+    def _linked(self, elt):
+        """Record locally that elt was added to this set in the PRDB."""
+        if self._ent.id < 0:
+            elt.groups._add(self._ent)
+            elt._forgetCPS()
+        else:
             elt.members._add(self._ent)
-
+            self._ent._forgetCPS()
         self._add(elt)
 
+    def _unlinked(self, elt):
+        """Record locally that elt was removed from this set in the PRDB.
+
+        elt is a PTEntry, or the bare PTS ID of a member/group that no
+        longer resolves to an entry.
+        """
+        if not isinstance(elt, PTEntry):
+            if self._ent.id > 0:
+                self._ent._forgetCPS()
+            if hasattr(self, '_ids'):
+                self._ids.discard(elt)
+            if hasattr(self, '_set'):
+                self._set.pop(elt, None)
+            return
+        if self._ent.id < 0:
+            elt.groups._discard(self._ent)
+            elt._forgetCPS()
+        else:
+            elt.members._discard(self._ent)
+            self._ent._forgetCPS()
+        self._discard(elt)
+
+    def add(self, elt):
+        """Add one new entity to a group.
+
+        This method will add a new user to a group, regardless of
+        whether this instance represents a group or a user. The change
+        is also immediately reflected to the PRDB.
+
+        Raises:
+            TypeError: If you try to add a grop group to a group, or a
+                user to a user
+        """
+        elt = self._ent._pts.getEntry(elt)
+        if elt in self:
+            return
+
+        self._ent._pts._AddToGroup(*self._pair(elt))
+        self._linked(elt)
+
     def discard(self, elt):
         """Remove one entity from a group.
 
@@ -163,14 +271,136 @@ class PTRelationSet(SetMixin):
         if elt not in self:
             return
 
-        if self._ent.id < 0:
-            self._ent._pts._RemoveFromGroup(elt.id, self._ent.id)
-            elt.groups._discard(self._ent)
-        else:
-            self._ent._pts._RemoveFromGroup(self._ent.id, elt.id)
-            elt.members._discard(self._ent)
+        self._ent._pts._RemoveFromGroup(*self._pair(elt))
+        self._unlinked(elt)
 
-        self._discard(elt)
+    def _resolve(self, elts, result):
+        """Look up PTEntries for elts in bulk.
+
+        Any element that doesn't exist is recorded as a failure in
+        result.
+
+        Returns:
+            A list of the PTEntries that were found, one per PTS ID.
+        """
+        elts = list(elts)
+        found = {}
+        for elt, ent in zip(elts, self._ent._pts.getEntries(elts)):
+            if ent is None:
+                result.failed.append((elt, KeyError(elt)))
+            else:
+                found.setdefault(ent.id, ent)
+        return list(found.values())
+
+    def _mutate(self, adds, removes, result, workers):
+        """Add and remove elements in the PRDB without probing first.
+
+        The AddToGroup and RemoveFromGroup RPCs are issued with at most
+        workers of them in flight at once.
+
+        Returns:
+            result, updated with the outcome for each element.
+        """
+        ops = [(elt, True) for elt in adds] + [(elt, False) for elt in removes]
+
+        def call(op):
+            elt, adding = op
+            if adding:
+                self._ent._pts._AddToGroup(*self._pair(elt))
+            else:
+                self._ent._pts._RemoveFromGroup(*self._pair(elt))
+
+        for (elt, adding), _, exc in util.imap(call, ops, workers):
+            if exc is not None:
+                result.failed.append((elt, exc))
+                continue
+            if adding:
+                self._linked(elt)
+            else:
+                self._unlinked(elt)
+            result.succeeded.append(elt)
+
+        return result
+
+    def update(self, elts, workers=util.WORKERS):
+        """Add many entities to a group at once.
+
+        The current membership is loaded once, and only the entities
+        that aren't already in this set are added.
+
+        Args:
+            elts: An iterable of names, PTS IDs, or PTEntries to add
+            workers: The maximum number of RPCs to have in flight
+
+        Returns:
+            A BulkResult listing the PTEntries that were added, and
+            the elements that couldn't be.
+        """
+        result = util.BulkResult()
+        wanted = self._resolve(elts, result)
+        self._loadIds()
+        return self._mutate([e for e in wanted if e.id not in self._ids],
+                            [], result, workers)
+
+    def difference_update(self, elts, workers=util.WORKERS):
+        """Remove many entities from a group at once.
+
+        The current membership is loaded once, and only the entities
+        that are actually in this set are removed.
+
+        Args:
+            elts: An iterable of names, PTS IDs, or PTEntries to remove
+            workers: The maximum number of RPCs to have in flight
+
+        Returns:
+            A BulkResult listing the PTEntries that were removed, and
+            the elements that couldn't be.
+        """
+        result = util.BulkResult()
+        unwanted = self._resolve(elts, result)
+        self._loadIds()
+        return self._mutate([], [e for e in unwanted if e.id in self._ids],
+                            result, workers)
+
+    def replace(self, elts, workers=util.WORKERS):
+        """Make this set contain exactly elts.
+
+        The current membership is loaded once, and only the entities
+        whose membership actually changes are added or removed.
+
+        Args:
+            elts: An iterable of names, PTS IDs, or PTEntries that
+                should make up the set
+            workers: The maximum number of RPCs to have in flight
+
+        Returns:
+            A BulkResult listing the PTEntries that were added or
+            removed, and the elements that couldn't be. A current
+            member/group whose ID no longer resolves to an entry is
+            still removed, and listed by its bare PTS ID.
+        """
+        result = util.BulkResult()
+        wanted = self._resolve(elts, result)
+        self._loadIds()
+        wantedIds = set(e.id for e in wanted)
+        unwanted = sorted(self._ids - wantedIds)
+        removes = self._ent._pts.getEntries(unwanted)
+        return self._mutate([e for e in wanted if e.id not in self._ids],
+                            [e if e is not None else id
+                             for id, e in zip(unwanted, removes)],
+                            result, workers)
+
+    def __ior__(self, other):
+        result = self.update(other)
+        if result.failed:
+            raise result.failed[0][1]
+        return self
+
+    def __isub__(self, other):
+        result = self.difference_update(other)
+        if result.failed:
+            raise result.failed[0][1]
+        return self
 
     def remove(self, elt):
         """Remove an entity from a group; it must already be a member.
@@ -195,7 +425,8 @@ class PTEntry(object):
 
     If a PTS connection is authenticated, it should be possible to
     change most attributes on a PTEntry. These changes are immediately
-    propogated to the protection database.
+    propogated to the protection database, unless they're made inside
+    a PTS.batch() block.
 
     Attributes:
       id: The PTS ID of the entry
@@ -212,6 +443,18 @@ class PTEntry(object):
       owner: A PTEntry object representing the owner of a given entry.
       creator: A PTEntry object representing the creator of a given
         entry. This field is read-only.
+      owned: A frozenset of the PTEntries of the groups this entry
+        owns. It's looked up from the PRDB each time, and is
+        read-only.
+      cps: A frozenset of the PTS IDs in this entry's current
+        protection subset: the entry itself, every group it's a member
+        of (including through supergroups), system:anyuser and
+        system:authuser. It's fetched with a single RPC the first
+        time it's used and then cached, so checking whether a user is
+        in a group is a local set lookup. Read-only.
+      supergroups: For groups, a frozenset of the PTS IDs of the
+        groups this group is a member of. Cached like cps, and
+        read-only.
 
       groups: For users, this contains a collection class representing
         the set of groups the user is a member of.
@@ -228,7 +471,8 @@ class PTEntry(object):
             else:
                 id = pts._NameToId(name)
 
-        if id not in pts._cache:
+        inst = pts._cache.get(id)
+        if inst is None:
             if name is None:
                 name = pts._IdToName(id)
 
@@ -240,8 +484,8 @@ class PTEntry(object):
                 inst.members = PTRelationSet(inst)
             else:
                 inst.groups = PTRelationSet(inst)
-            pts._cache[id] = inst
-        return pts._cache[id]
+            inst = pts._cache.setdefault(id, inst)
+        return inst
 
     def __repr__(self):
         if self.name != '':
@@ -252,8 +496,9 @@ class PTEntry(object):
     def _get_id(self):
         return self._id
     def _set_id(self, val):
-        del self._pts._cache[self._id]
-        self._pts._ChangeEntry(self.id, newid=val)
+        if not self._pts._defer(self, newid=val):
+            self._pts._ChangeEntry(self.id, newname=self._name, newid=val)
+        self._pts._cache.pop(self._id, None)
         self._id = val
         self._pts._cache[val] = self
     id = property(_get_id, _set_id)
@@ -261,7 +506,8 @@ class PTEntry(object):
     def _get_name(self):
         return self._name
     def _set_name(self, val):
-        self._pts._ChangeEntry(self.id, newname=val)
+        if not self._pts._defer(self, newname=val):
+            self._pts._ChangeEntry(self.id, newname=val)
         self._name = val
     name = property(_get_name, _set_name)
 
@@ -280,46 +526,104 @@ class PTEntry(object):
         self._loadEntry()
         return self._flags
     def _set_flags(self, val):
-        self._pts._SetFields(self.id, access=val)
-        self._flags = val
+        if not self._pts._defer(self, access=val):
+            self._pts._SetFields(self.id, access=val)
+        if hasattr(self, '_flags'):
+            self._flags = val
     flags = property(_get_flags, _set_flags)
 
     def _get_ngroups(self):
         self._loadEntry()
         return self._ngroups
     def _set_ngroups(self, val):
-        self._pts._SetFields(self.id, groups=val)
-        self._ngroups = val
+        if not self._pts._defer(self, groups=val):
+            self._pts._SetFields(self.id, groups=val)
+        if hasattr(self, '_flags'):
+            self._ngroups = val
     ngroups = property(_get_ngroups, _set_ngroups)
 
     def _get_nusers(self):
         self._loadEntry()
         return self._nusers
     def _set_nusers(self, val):
-        self._pts._SetFields(self.id, users=val)
-        self._nusers = val
+        if not self._pts._defer(self, users=val):
+            self._pts._SetFields(self.id, users=val)
+        if hasattr(self, '_flags'):
+            self._nusers = val
     nusers = property(_get_nusers, _set_nusers)
 
     def _get_owner(self):
         self._loadEntry()
-        return self._owner
+        return self._pts.getEntry(self._ownerId)
     def _set_owner(self, val):
-        self._pts._ChangeEntry(self.id, newoid=self._pts.getEntry(val).id)
-        self._owner = val
+        owner = self._pts.getEntry(val)
+        if not self._pts._defer(self, newoid=owner.id):
+            self._pts._ChangeEntry(self.id, newname=self._name,
+                                   newoid=owner.id)
+        if hasattr(self, '_flags'):
+            self._ownerId = owner.id
     owner = property(_get_owner, _set_owner)
 
     def _get_creator(self):
         self._loadEntry()
-        return self._creator
+        return self._pts.getEntry(self._creatorId)
     creator = property(_get_creator)
 
+    def _get_owned(self):
+        owned = self._pts.getEntries(self._pts._ListOwned(self._id))
+        return frozenset(e for e in owned if e is not None)
+    owned = property(_get_owned)
+
+    def _forgetCPS(self):
+        if hasattr(self, '_cps'):
+            del self._cps
+
+    def _hasCPS(self):
+        return hasattr(self, '_cps') and not self._pts._stale(self._cpsLoaded)
+
+    def _get_cps(self):
+        if not self._hasCPS():
+            self._cps = frozenset(self._pts._GetCPS(self._id))
+            self._cpsLoaded = time.time()
+        return self._cps
+    cps = property(_get_cps)
+
+    def _get_supergroups(self):
+        if not hasattr(self, '_supergroups') or \
+                self._pts._stale(self._supergroupsLoaded):
+            self._supergroups = frozenset(self._pts._ListSuperGroups(self._id))
+            self._supergroupsLoaded = time.time()
+        return self._supergroups
+    supergroups = property(_get_supergroups)
+
+    def _seed(self, info):
+        """Fill in this entry's attributes from a _pts.PTEntry.
+
+        The owner and creator are stored as PTS IDs, and only turned
+        into PTEntry objects when they're asked for.
+        """
+        for field in self._attrs:
+            setattr(self, '_%s' % field, getattr(info, field))
+        for field in self._entry_attrs:
+            setattr(self, '_%sId' % field, getattr(info, field))
+        self._loaded = time.time()
+
     def _loadEntry(self):
-        if not hasattr(self, '_flags'):
-            info = self._pts._ListEntry(self._id)
-            for field in self._attrs:
-                setattr(self, '_%s' % field, getattr(info, field))
-            for field in self._entry_attrs:
-                setattr(self, '_%s' % field, self._pts.getEntry(getattr(info, field)))
+        if not hasattr(self, '_flags') or self._pts._stale(self._loaded):
+            self._seed(self._pts._ListEntry(self._id))
+
+    def _forget(self):
+        """Drop this entry's loaded attributes and groups/members.
+
+        They're reloaded from the PRDB the next time they're needed.
+        """
+        for attr in ('_flags', '_cps', '_supergroups'):
+            if hasattr(self, attr):
+                delattr(self, attr)
+        if self._id < 0:
+            self.members._forget()
+        else:
+            self.groups._forget()
 
 
 PTS_UNAUTH = 0
@@ -328,46 +632,198 @@ PTS_FORCEAUTH = 2
 PTS_ENCRYPT = 3
 
 
-class PTS(_pts.PTS):
-    """A connection to an AFS protection database.
-
-    This class represents a connection to the AFS protection database
-    for a particular cell.
+class WriteBatch(object):
+    """Changes to PTEntry attributes, held back to be written together.
 
-    Both the umax and gmax attributes can be changed if the connection
-    was authenticated by a principal on system:administrators for the
-    cell.
+    WriteBatch objects are returned by PTS.batch; see there.
 
-    For sufficiently privileged and authenticated connections,
-    iterating over a PTS object will yield all entries in the
-    protection database, in no particular order.
+    Attributes:
+      result: After the batch is written, a BulkResult listing the
+        PTEntries whose changes were written, and (PTEntry, exception)
+        pairs for the ones that couldn't be
+    """
+    # The fields each RPC changes, as _ChangeEntry and _SetFields
+    # arguments
+    _changeFields = ('newname', 'newid', 'newoid')
+    _setFields = ('access', 'groups', 'users')
+
+    def __init__(self, pts, workers):
+        self._pts = pts
+        self._workers = workers
+        # id() of each changed PTEntry to [entry, its PTS ID and name
+        # in the PRDB, dictionary of changes]
+        self._pending = {}
+        self.result = None
+
+    def _record(self, ent, changes):
+        item = self._pending.get(id(ent))
+        if item is None:
+            item = self._pending[id(ent)] = [ent, ent._id, ent._name, {}]
+        item[3].update(changes)
+
+    def _write(self, item):
+        ent, id, name, changes = item
+        args = dict((k, changes[k]) for k in self._changeFields
+                    if k in changes)
+        if args:
+            # Resending the current name saves ChangeEntry looking it up
+            args.setdefault('newname', name)
+            self._pts._ChangeEntry(id, **args)
+            item[1] = args.get('newid', id)
+            item[2] = args['newname']
+        args = dict((k, changes[k]) for k in self._setFields
+                    if k in changes)
+        if args:
+            self._pts._SetFields(item[1], **args)
+
+    def _revert(self, item):
+        """Make a PTEntry match what's in the PRDB again."""
+        ent, id, name, changes = item
+        if ent._id != id:
+            self._pts._cache.pop(ent._id)
+            ent._id = id
+            self._pts._cache[id] = ent
+        ent._name = name
+        ent._forget()
+
+    def flush(self):
+        """Write the pending changes, and return a BulkResult."""
+        result = util.BulkResult()
+        pending = list(self._pending.values())
+        self._pending = {}
+        for item, _, exc in util.imap(self._write, pending, self._workers):
+            if exc is None:
+                result.succeeded.append(item[0])
+            else:
+                self._revert(item)
+                result.failed.append((item[0], exc))
+        return result
+
+    def discard(self):
+        """Drop the pending changes, undoing them locally."""
+        for item in self._pending.values():
+            self._revert(item)
+        self._pending = {}
+
+    def __enter__(self):
+        if getattr(self._pts._batches, 'current', None) is None:
+            self._pts._batches.current = self
+            self._outer = True
+        else:
+            self._outer = False
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._outer:
+            return False
+        self._pts._batches.current = None
+        if exc_type is not None:
+            self.discard()
+            return False
+        self.result = self.flush()
+        if self.result.failed:
+            raise self.result.failed[0][1]
+        return False
+
+
+class PTSMixin(object):
+    """The Python-level behavior of a connection to a PTS database.
+
+    PTSMixin implements caching, bulk lookups and iteration on top of
+    the low-level methods (_NameToId, _ListEntry, _ListMembers, and so
+    on) that _pts.PTS provides. Any class providing those methods can
+    inherit from PTSMixin to offer the same interface as PTS.
 
     Args:
-      cell: The cell to connect to. If None (the default), PTS
-        connects to the workstations home cell.
-      sec: The security level to connect with:
-        - PTS_UNAUTH: unauthenticated connection
-        - PTS_AUTH: try authenticated, then fall back to
-          unauthenticated
-        - PTS_FORCEAUTH: fail if an authenticated connection can't be
-          established
-        - PTS_ENCRYPT: same as PTS_FORCEAUTH, plus encrypt all traffic
-          to the protection server
-
-    Attributes:
-      realm: The Kerberos realm against which this cell authenticates
-      umax: The maximum user ID currently assigned (the next ID
-        assigned will be umax + 1)
-      gmax: The maximum (actually minimum) group ID currently assigned
-        (the next ID assigned will be gmax - 1, since group IDs are
-        negative)
+      cachesize, ttl, negativettl, krbcachesize, diskcache: See PTS.
     """
-    def __init__(self, *args, **kwargs):
-        self._cache = {}
+    def __init__(self, cell=None, sec=PTS_AUTH, cachesize=None, ttl=None,
+                 negativettl=None, krbcachesize=4096, diskcache=None):
+        self._cache = cache.LRUCache(cachesize)
+        self._toKrb5 = cache.LRUCache(krbcachesize)
+        self._fromKrb5 = cache.LRUCache(krbcachesize)
+        self._ttl = ttl
+        if negativettl is None:
+            self._negative = None
+        else:
+            self._negative = cache.LRUCache(cachesize, negativettl)
+        self._batches = threading.local()
+        self._subscribers = []
+        # The maximum user and group IDs as of the last refresh
+        self._lastMax = None
+        if isinstance(diskcache, basestring):
+            diskcache = DiskCache(diskcache)
+        self._disk = diskcache
+
+    def _stale(self, stamp):
+        """Return True if something loaded at stamp has outlived the TTL."""
+        return self._ttl is not None and time.time() - stamp > self._ttl
+
+    def _missing(self, key):
+        """Return True if key is known not to exist."""
+        return self._negative is not None and self._negative.get(key, False)
+
+    def _setMissing(self, key):
+        """Remember that key doesn't exist, if negative caching is on."""
+        if self._negative is not None:
+            self._negative[key] = True
 
     def __iter__(self):
-        for pte in self._ListEntries():
-            yield self.getEntry(pte.id)
+        return self.iterEntries()
+
+    def iterPages(self, users=None, groups=None, startindex=0):
+        """Iterate over the PRDB one page of entries at a time.
+
+        Each page is fetched with a single RPC, and nothing is fetched
+        before it's needed, so an interrupted sweep can be picked up
+        where it left off by passing the last cursor as startindex.
+
+        Args:
+          users: If true, include users. Defaults to True unless
+            groups is given.
+          groups: If true, include groups.
+          startindex: The cursor to start from; 0 for the start of
+            the database.
+
+        Returns:
+          An iterator of (entries, cursor) tuples, where entries is a
+          list of PTEntry objects and cursor is the startindex of the
+          following page, or -1 after the last page.
+        """
+        while startindex != -1:
+            page, startindex = self._ListEntriesPage(users, groups, startindex)
+            yield (self._entriesFromPage(page), startindex)
+
+    def _entriesFromPage(self, page):
+        """Turn a page of _pts.PTEntry records into loaded PTEntries.
+
+        Each record already carries everything ListEntry would return,
+        so the resulting entries are fully loaded without any further
+        RPCs. Owners and creators that aren't cached yet are resolved
+        together in a single batch.
+        """
+        if self._disk is not None:
+            self._disk.store(self.cell, page)
+        entries = []
+        for info in page:
+            ent = PTEntry(self, id=info.id, name=info.name)
+            ent._seed(info)
+            entries.append(ent)
+
+        self.getEntries(set(getattr(info, field)
+                            for info in page
+                            for field in PTEntry._entry_attrs))
+        return entries
+
+    def iterEntries(self, users=None, groups=None, startindex=0):
+        """Iterate over entries in the PRDB.
+
+        This takes the same arguments as iterPages, but yields PTEntry
+        objects one at a time.
+        """
+        for entries, _ in self.iterPages(users, groups, startindex):
+            for ent in entries:
+                yield ent
 
     def getEntry(self, ident):
         """Retrieve a particular PTEntry from this cell.
@@ -378,13 +834,87 @@ class PTS(_pts.PTS):
         if isinstance(ident, PTEntry):
             if ident._pts is not self:
                 raise TypeError("Entry '%s' is from a different cell." %
-                                elt)
+                                ident)
             return ident
 
-        elif isinstance(ident, basestring):
-            return PTEntry(self, name=ident)
+        if isinstance(ident, basestring):
+            key = ident.lower()
         else:
-            return PTEntry(self, id=ident)
+            key = int(ident)
+
+        if self._missing(key):
+            raise AFSException(_pts.PRNOENT)
+        try:
+            if isinstance(ident, basestring):
+                return PTEntry(self, name=ident)
+            else:
+                return PTEntry(self, id=ident)
+        except AFSException as e:
+            if e.errno == _pts.PRNOENT:
+                self._setMissing(key)
+            raise
+
+    def getEntries(self, idents):
+        """Retrieve several PTEntry objects from this cell at once.
+
+        getEntries accepts an iterable of names, PTS IDs, or PTEntry
+        objects. Names and IDs that aren't already cached are
+        resolved with a handful of batched lookups, instead of one
+        lookup apiece.
+
+        Returns:
+            A list with one element for each element of idents, in the
+            same order. Each element is either the matching PTEntry,
+            or None if no such entry exists.
+        """
+        idents = list(idents)
+
+        # The results are collected here, rather than looked up in the
+        # cache afterwards, since a small cache may already have
+        # evicted some of them by then
+        byName = {}
+        byId = {}
+        names = set()
+        ids = set()
+        for ident in idents:
+            if isinstance(ident, PTEntry):
+                self.getEntry(ident)
+            elif isinstance(ident, basestring):
+                if not self._missing(ident.lower()):
+                    names.add(ident.lower())
+            else:
+                id = int(ident)
+                if id in byId or id in ids:
+                    continue
+                ent = self._cache.get(id)
+                if ent is not None:
+                    byId[id] = ent
+                elif not self._missing(id):
+                    ids.add(id)
+
+        names = list(names)
+        for name, id in zip(names, self._NamesToIds(names)):
+            if id is None:
+                self._setMissing(name)
+            else:
+                byName[name] = PTEntry(self, id=id, name=name)
+
+        ids = list(ids)
+        for id, name in zip(ids, self._IdsToNames(ids)):
+            if name is None:
+                self._setMissing(id)
+            else:
+                byId[id] = PTEntry(self, id=id, name=name)
+
+        entries = []
+        for ident in idents:
+            if isinstance(ident, PTEntry):
+                entries.append(ident)
+            elif isinstance(ident, basestring):
+                entries.append(byName.get(ident.lower()))
+            else:
+                entries.append(byId.get(int(ident)))
+        return entries
 
     def getEntryFromKrbname(self, ident):
         """Retrieve a PTEntry matching a given Kerberos v5 principal.
@@ -394,15 +924,504 @@ class PTS(_pts.PTS):
         principal."""
         return self.getEntry(self._Krb5ToAfs(ident))
 
+    def getEntriesFromKrbnames(self, idents):
+        """Retrieve PTEntries matching several Kerberos v5 principals.
+
+        This is the bulk counterpart of getEntryFromKrbname, and
+        returns a list in the same form as getEntries.
+        """
+        return self.getEntries(self._Krb5ToAfsMany(idents))
+
+    def _reserveIds(self, n, group):
+        """Reserve a block of n unused user or group IDs.
+
+        The maximum ID is moved past the block right away, so entries
+        created without an explicit ID, by this or any other client,
+        are given IDs after it.
+
+        Returns:
+          A list of the n IDs
+        """
+        umax, gmax = self._ListMax()
+        if group:
+            self._SetMaxGroupId(gmax - n)
+            return list(range(gmax - 1, gmax - n - 1, -1))
+        else:
+            self._SetMaxUserId(umax + n)
+            return list(range(umax + 1, umax + n + 1))
+
+    def _createMany(self, names, group, owners, related, workers):
+        """Create users or groups in bulk; see createUsers and createGroups.
+
+        Args:
+          names: The names of the entries to create
+          group: True to create groups, False to create users
+          owners: A dictionary mapping names to owners
+          related: A dictionary mapping names to the groups to add
+            each user to, or the members to add to each group
+
+        Returns:
+          A BulkResult
+        """
+        result = util.BulkResult()
+        names = [n.lower() for n in names]
+        if not names:
+            return result
+        owners = dict((n.lower(), o) for (n, o) in (owners or {}).items())
+        related = dict((n.lower(), list(r)) for (n, r) in (related or {}).items())
+        ids = dict(zip(names, self._reserveIds(len(names), group)))
+
+        # Look up everything else that's referred to in one batch
+        refs = set()
+        for batch in [list(owners.values())] + list(related.values()):
+            for ref in batch:
+                if isinstance(ref, basestring) and ref.lower() not in ids:
+                    refs.add(ref.lower())
+        refs = list(refs)
+        known = dict(zip(refs, self._NamesToIds(refs)))
+
+        def lookup(ref):
+            if not isinstance(ref, basestring):
+                return int(ref)
+            ref = ref.lower()
+            id = ids.get(ref, known.get(ref))
+            if id is None:
+                raise KeyError(ref)
+            return id
+
+        failed = {}
+
+        def create(name):
+            # An owner that's in this batch may not exist yet, so it's
+            # set afterwards
+            owner = owners.get(name)
+            if owner is None or (isinstance(owner, basestring) and
+                                 owner.lower() in ids):
+                oid = 0
+            else:
+                oid = lookup(owner)
+
+            try:
+                if group:
+                    return self._CreateGroup(name, oid, ids[name])
+                else:
+                    return self._CreateUser(name, ids[name])
+            except AFSException as e:
+                if e.errno != _pts.PRIDEXIST:
+                    raise
+            # Another client took the ID, so let the server pick one
+            if group:
+                return self._CreateGroup(name, oid)
+            else:
+                return self._CreateUser(name)
+
+        for name, id, exc in util.imap(create, names, workers):
+            if exc is not None:
+                failed[name] = exc
+                ids.pop(name, None)
+            else:
+                ids[name] = id
+
+        def attach(op):
+            name, ref, chown = op
+            if chown:
+                self._ChangeEntry(ids[name], newname=name, newoid=lookup(ref))
+            elif group:
+                self._AddToGroup(lookup(ref), ids[name])
+            else:
+                self._AddToGroup(ids[name], lookup(ref))
+
+        ops = []
+        for name in names:
+            if name in failed:
+                continue
+            owner = owners.get(name)
+            if isinstance(owner, basestring) and owner.lower() in ids:
+                ops.append((name, owner, True))
+            ops.extend((name, ref, False) for ref in related.get(name, ()))
+
+        for (name, ref, chown), _, exc in util.imap(attach, ops, workers):
+            if exc is not None:
+                failed.setdefault(name, exc)
+
+        for name in names:
+            if name in failed:
+                result.failed.append((name, failed.pop(name)))
+            elif name in ids:
+                if self._negative is not None:
+                    self._negative.pop(name)
+                    self._negative.pop(ids[name])
+                result.succeeded.append(PTEntry(self, id=ids[name], name=name))
+        return result
+
+    def createUsers(self, names, groups=None, workers=util.WORKERS):
+        """Create many users at once.
+
+        A block of user IDs is reserved up front (with one ListMax and
+        one SetMax RPC), and the users are created with explicit IDs
+        from it, with up to workers RPCs in flight at once. A user
+        whose ID was taken by another client in the meantime is
+        created with an ID picked by the server instead. Then each
+        user is added to its groups, again in parallel.
+
+        A failure only affects the user it happened to; the rest of
+        the batch goes ahead. A user that was created but couldn't be
+        added to one of its groups is reported as failed, even though
+        it exists. The IDs of users that couldn't be created are left
+        unused.
+
+        Args:
+          names: An iterable of the names of the users to create
+          groups: An optional dictionary mapping user names to
+            iterables of the names or PTS IDs of the groups to add
+            them to
+          workers: The maximum number of RPCs to have in flight
+
+        Returns:
+          A BulkResult listing the PTEntries of the users that were
+          created, and (name, exception) pairs for the ones that
+          failed.
+        """
+        return self._createMany(names, False, None, groups, workers)
+
+    def createGroups(self, names, owners=None, members=None,
+                     workers=util.WORKERS):
+        """Create many groups at once.
+
+        This works like createUsers, but with a block of group IDs.
+        Each group is created with its owner. If the owner is one of
+        the groups being created, ownership is handed over once both
+        exist. Then the members are added.
+
+        Args:
+          names: An iterable of the names of the groups to create
+          owners: An optional dictionary mapping group names to the
+            names or PTS IDs of their owners. Groups not in owners
+            are owned by whoever creates them.
+          members: An optional dictionary mapping group names to
+            iterables of the names or PTS IDs of their members
+          workers: The maximum number of RPCs to have in flight
+
+        Returns:
+          A BulkResult, as for createUsers
+        """
+        return self._createMany(names, True, owners, members, workers)
+
+    def batch(self, workers=util.WORKERS):
+        """Hold back changes to PTEntry attributes and write them together.
+
+        Inside a with block on the returned WriteBatch, setting the
+        name, id, owner, flags, ngroups or nusers of any PTEntry from
+        this PTS object takes effect locally right away, but nothing
+        is written to the PRDB. When the block ends, each changed
+        entry is written with at most one ChangeEntry RPC (for the
+        name, ID and owner) and one SetFieldsEntry RPC (for the rest),
+        with up to workers entries written at once:
+
+            with pts.batch():
+                for ent in entries:
+                    ent.owner = 'system:administrators'
+                    ent.flags = 0
+                    ent.ngroups = 30
+
+        Only changes made from the thread that started the batch are
+        held back, and a batch started inside another one is merged
+        into it. If the block raises an exception, the pending changes
+        are dropped. If some entries couldn't be written, the others
+        still are; the failed ones are reloaded from the PRDB, and the
+        first exception is raised once everything's been tried. The
+        batch's result attribute has the full outcome.
+
+        Returns:
+          A WriteBatch to use in a with statement
+        """
+        return WriteBatch(self, workers)
+
+    def _defer(self, ent, **changes):
+        """Record changes to ent if a batch is in progress.
+
+        Returns:
+          True if the changes were recorded, or False if they should
+          be written now.
+        """
+        batch = getattr(self._batches, 'current', None)
+        if batch is None:
+            return False
+        batch._record(ent, changes)
+        return True
+
+    def _NameToId(self, name):
+        if self._disk is None:
+            return super(PTSMixin, self)._NameToId(name)
+        id = self._disk.ids(self.cell, [name]).get(name.lower())
+        if id is None:
+            id = super(PTSMixin, self)._NameToId(name)
+            self._disk.storeNames(self.cell, [(name, id)])
+        return id
+
+    def _IdToName(self, id):
+        if self._disk is None:
+            return super(PTSMixin, self)._IdToName(id)
+        name = self._disk.names(self.cell, [id]).get(int(id))
+        if name is None:
+            name = super(PTSMixin, self)._IdToName(id)
+            self._disk.storeNames(self.cell, [(name, int(id))])
+        return name
+
+    def _NamesToIds(self, names):
+        """Convert names to PTS IDs, trying the disk cache first."""
+        if self._disk is None:
+            return super(PTSMixin, self)._NamesToIds(names)
+        names = [n.lower() for n in names]
+        found = self._disk.ids(self.cell, names)
+        missing = list(set(n for n in names if n not in found))
+        if missing:
+            pairs = [(n, id) for (n, id) in
+                     zip(missing, super(PTSMixin, self)._NamesToIds(missing))
+                     if id is not None]
+            self._disk.storeNames(self.cell, pairs)
+            found.update(pairs)
+        return [found.get(n) for n in names]
+
+    def _IdsToNames(self, ids):
+        """Convert PTS IDs to names, trying the disk cache first."""
+        if self._disk is None:
+            return super(PTSMixin, self)._IdsToNames(ids)
+        ids = [int(id) for id in ids]
+        found = self._disk.names(self.cell, ids)
+        missing = list(set(id for id in ids if id not in found))
+        if missing:
+            pairs = [(name, id) for (id, name) in
+                     zip(missing, super(PTSMixin, self)._IdsToNames(missing))
+                     if name is not None]
+            self._disk.storeNames(self.cell, pairs)
+            found.update((id, name) for (name, id) in pairs)
+        return [found.get(id) for id in ids]
+
+    def _ListEntry(self, ident):
+        """Fetch an entry's fields, trying the disk cache first."""
+        if self._disk is None:
+            return super(PTSMixin, self)._ListEntry(ident)
+        rec = self._disk.entry(self.cell, self._NameOrId(ident))
+        if rec is None:
+            rec = super(PTSMixin, self)._ListEntry(ident)
+            self._disk.store(self.cell, [rec])
+        return rec
+
+    def _forgetOnDisk(self, *idents):
+        """Drop what the disk cache knows about some entries."""
+        if self._disk is not None:
+            self._disk.forget(
+                self.cell,
+                ids=[i for i in idents if not isinstance(i, basestring)],
+                names=[i for i in idents if isinstance(i, basestring)])
+
+    def _ChangeEntry(self, ident, newname=None, newid=None, newoid=None):
+        super(PTSMixin, self)._ChangeEntry(ident, newname=newname,
+                                           newid=newid, newoid=newoid)
+        self._forgetOnDisk(ident, *[i for i in (newname, newid) if i])
+
+    def _SetFields(self, ident, access=None, groups=None, users=None):
+        super(PTSMixin, self)._SetFields(ident, access=access, groups=groups,
+                                         users=users)
+        self._forgetOnDisk(ident)
+
+    def _Delete(self, ident):
+        super(PTSMixin, self)._Delete(ident)
+        self._forgetOnDisk(ident)
+
+    def _AddToGroup(self, user, group):
+        super(PTSMixin, self)._AddToGroup(user, group)
+        self._forgetOnDisk(user, group)
+
+    def _RemoveFromGroup(self, user, group):
+        super(PTSMixin, self)._RemoveFromGroup(user, group)
+        self._forgetOnDisk(user, group)
+
+    def _AfsToKrb5(self, afs_name):
+        """Convert an AFS principal to a Kerberos v5 one.
+
+        Conversions are remembered, since they're relatively costly
+        and don't change.
+        """
+        krb5_name = self._toKrb5.get(afs_name)
+        if krb5_name is None:
+            krb5_name = super(PTSMixin, self)._AfsToKrb5(afs_name)
+            self._toKrb5[afs_name] = krb5_name
+        return krb5_name
+
+    def _Krb5ToAfs(self, krb5_name):
+        """Convert a Kerberos v5 principal to an AFS one.
+
+        Conversions are remembered, since they're relatively costly
+        and don't change.
+        """
+        afs_name = self._fromKrb5.get(krb5_name)
+        if afs_name is None:
+            afs_name = super(PTSMixin, self)._Krb5ToAfs(krb5_name)
+            self._fromKrb5[krb5_name] = afs_name
+        return afs_name
+
     def expire(self):
         """Flush the cache of PTEntry objects.
 
         This method will disconnect all PTEntry objects from this PTS
-        object and flush the cache.
+        object and flush the cache. Use refresh instead to only reload
+        what's changed.
         """
         for elt in self._cache.keys():
             del self._cache[elt]._pts
             del self._cache[elt]
+        if self._negative is not None:
+            self._negative.clear()
+
+    def invalidate(self, ident):
+        """Drop everything cached about a single entry.
+
+        invalidate accepts a name, PTS ID, or PTEntry. The entry is
+        removed from the cache and its loaded attributes and
+        groups/members are dropped, so they're fetched again the next
+        time they're needed. Any record of the name or ID not existing
+        is forgotten as well.
+        """
+        if isinstance(ident, PTEntry):
+            ent = ident
+            keys = [ent.id, ent.name.lower()]
+        elif isinstance(ident, basestring):
+            keys = [ident.lower()]
+            ent = None
+            for e in self._cache.values():
+                if e.name.lower() == keys[0]:
+                    ent = e
+                    break
+        else:
+            keys = [int(ident)]
+            ent = self._cache.pop(keys[0])
+
+        if self._negative is not None:
+            for key in keys:
+                self._negative.pop(key)
+        if ent is not None:
+            self._cache.pop(ent.id)
+            ent._forget()
+
+    def subscribe(self, callback):
+        """Call callback with each change that refresh finds.
+
+        callback is called as callback(kind, entry) for each change,
+        where kind and entry are as in the list refresh returns.
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def refresh(self):
+        """Bring the cached entries up to date with the PRDB.
+
+        Rather than throwing away everything that's cached, like
+        expire does, refresh compares the cache against one paged
+        ListEntries sweep of the PRDB (one RPC per page), plus one
+        ListMax:
+
+          - A cached entry whose name, owner, flags, quotas or count
+            differ is updated in place. If its count changed, its
+            members or groups and its CPS are dropped, to be reloaded
+            when they're next needed.
+          - A cached entry that's no longer in the PRDB is dropped.
+          - An entry with an ID between the highest user or group ID
+            as of the previous refresh and the highest now is new.
+            Entries created during the sweep are reported by the
+            next refresh. Entries created with explicit IDs outside
+            that range aren't noticed, and neither is a membership
+            change that leaves a count as it was.
+
+        The first refresh only records the highest IDs, so it never
+        reports anything as added.
+
+        Returns:
+          A list of (kind, entry) tuples, one for each change found,
+          where kind is 'added', 'removed', or 'modified', and entry
+          is the PTEntry. The same changes are passed to every
+          function registered with subscribe.
+        """
+        umax, gmax = self._ListMax()
+        last = self._lastMax
+        cached = dict((ent._id, ent) for ent in self._cache.values())
+        changes = []
+
+        for rec in self._ListEntries(users=True, groups=True):
+            ent = cached.pop(rec.id, None)
+            if ent is None:
+                if last is not None and (last[0] < rec.id <= umax or
+                                         gmax <= rec.id < last[1]):
+                    ent = PTEntry(self, id=rec.id, name=rec.name)
+                    ent._seed(rec)
+                    changes.append(('added', ent))
+                continue
+
+            if hasattr(ent, '_flags'):
+                fields = [getattr(ent, '_%s' % f) for f in PTEntry._attrs]
+                fields += [getattr(ent, '_%sId' % f)
+                           for f in PTEntry._entry_attrs]
+                new = [getattr(rec, f)
+                       for f in PTEntry._attrs + PTEntry._entry_attrs]
+                modified = fields != new
+                recount = rec.count != ent._count
+            else:
+                # Without the old count, the size of the loaded
+                # members or groups will do
+                related = ent.members if ent._id < 0 else ent.groups
+                modified = rec.name != ent._name
+                recount = hasattr(related, '_ids') and \
+                    len(related._ids) != rec.count
+            if recount:
+                ent._forget()
+            if modified or recount:
+                self._forgetOnDisk(rec.id)
+                changes.append(('modified', ent))
+            ent._seed(rec)
+
+        for id, ent in cached.items():
+            self._cache.pop(id)
+            self._setMissing(id)
+            self._forgetOnDisk(id)
+            ent._forget()
+            changes.append(('removed', ent))
+
+        self._lastMax = (umax, gmax)
+        for kind, ent in changes:
+            for callback in list(self._subscribers):
+                callback(kind, ent)
+        return changes
+
+    def cacheStats(self):
+        """Return counters for sizing the entry cache.
+
+        Returns:
+          A dictionary with an 'entries' key for the PTEntry cache,
+          and a 'negative' key for the cache of nonexistent names and
+          IDs (which is None if negative caching is off). Each is a
+          dictionary of the size, maxsize, hits, misses, evictions,
+          and expirations of that cache.
+        """
+        if self._negative is None:
+            negative = None
+        else:
+            negative = self._negative.stats()
+        return {'entries': self._cache.stats(),
+                'negative': negative}
+
+    def stats(self):
+        """Return statistics for the RPCs made through this connection.
+
+        Only RPCs made while instrumentation is enabled (see
+        afs.stats.enable) are counted.
+
+        Returns:
+          A dictionary mapping RPC names to afs.stats.OpStats
+        """
+        return stats.registry.stats(self)
 
     def _get_umax(self):
         return self._ListMax()[0]
@@ -415,3 +1434,66 @@ class PTS(_pts.PTS):
     def _set_gmax(self, val):
         self._SetMaxGroupId(val)
     gmax = property(_get_gmax, _set_gmax)
+
+
+class PTS(PTSMixin, _pts.PTS):
+    """A connection to an AFS protection database.
+
+    This class represents a connection to the AFS protection database
+    for a particular cell.
+
+    Both the umax and gmax attributes can be changed if the connection
+    was authenticated by a principal on system:administrators for the
+    cell.
+
+    For sufficiently privileged and authenticated connections,
+    iterating over a PTS object will yield all users in the
+    protection database, in no particular order. Use iterEntries or
+    iterPages to choose between users and groups, or to resume an
+    interrupted sweep.
+
+    PTS objects, and the PTEntry objects they hand out, may be shared
+    between threads. RPCs and pioctls are made without holding the
+    GIL, and each thread makes its RPCs on a connection of its own,
+    so threads make RPCs in parallel whether or not they share a PTS
+    object. The bulk operations that take a workers argument rely on
+    this to have several RPCs in flight at once. Two threads loading
+    the same attributes or membership at once may both make the RPC,
+    but the entry is left consistent either way.
+
+    Args:
+      cell: The cell to connect to. If None (the default), PTS
+        connects to the workstations home cell.
+      sec: The security level to connect with:
+        - PTS_UNAUTH: unauthenticated connection
+        - PTS_AUTH: try authenticated, then fall back to
+          unauthenticated
+        - PTS_FORCEAUTH: fail if an authenticated connection can't be
+          established
+        - PTS_ENCRYPT: same as PTS_FORCEAUTH, plus encrypt all traffic
+          to the protection server
+      cachesize: The maximum number of PTEntry objects to cache. The
+        least recently used entries are evicted beyond that. If None
+        (the default), the cache is unbounded.
+      ttl: The number of seconds an entry's attributes and
+        groups/members stay valid once loaded. If None (the default),
+        they never go stale.
+      negativettl: The number of seconds to remember that a name or
+        ID doesn't exist. If None (the default), nonexistent entries
+        aren't remembered.
+      krbcachesize: The maximum number of conversions between AFS
+        and Kerberos v5 principals to remember in each direction.
+      diskcache: An afs.diskcache.DiskCache, or the path of one, to
+        share names, IDs and entry fields with other processes on
+        this host. Lookups that it can answer don't make any RPCs,
+        and the ones it can't are added to it. If None (the
+        default), nothing is kept on disk.
+
+    Attributes:
+      realm: The Kerberos realm against which this cell authenticates
+      umax: The maximum user ID currently assigned (the next ID
+        assigned will be umax + 1)
+      gmax: The maximum (actually minimum) group ID currently assigned
+        (the next ID assigned will be gmax - 1, since group IDs are
+        negative)
+    """
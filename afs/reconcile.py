@@ -0,0 +1,373 @@
+"""
+Reconcile group membership in a PRDB with a desired state
+
+A Reconciler takes the membership each group should have (for
+instance, from a nightly export of an upstream directory), loads the
+current state of the PRDB in bulk, and works out the smallest set of
+changes that makes the two match:
+
+  create  a group that doesn't exist yet
+  chown   change the owner of a group
+  add     add a member to a group
+  remove  remove a member from a group
+
+Only the groups named in the desired state are touched, and only the
+memberships that actually differ are changed, so nothing is probed
+with IsAMemberOf and a group that's already right costs nothing but
+its share of the bulk load.
+
+The changes (the "plan") can be written out instead of being made,
+for review, and a plan file can be applied later. While the plan is
+applied, the RPCs are rate-limited and spread over a bounded number of
+threads, and each change that's made can be recorded in a checkpoint
+file, so that an interrupted run picks up where it left off.
+
+Desired-state and plan files are plain text; see readDesired and
+readPlan.
+"""
+
+import threading
+import time
+
+from afs import _pts
+from afs import util
+from afs._util import AFSException
+
+# The kinds of change, in the order they're made: groups have to exist
+# before they can own other groups or have members
+ACTIONS = ('create', 'chown', 'add', 'remove')
+
+DEFAULT_OWNER = 'system:administrators'
+
+
+def readDesired(f):
+    """Read the desired membership of groups from a file.
+
+    Each line names a group, followed by its members, separated by
+    whitespace:
+
+        system:staff  alice bob carol
+
+    A group on a line by itself should have no members. A group may
+    be listed on several lines, in which case its members are all of
+    the ones listed. Blank lines and lines starting with # are
+    ignored.
+
+    Args:
+      f: A file, or any other iterable of lines
+
+    Returns:
+      An iterator of (group, members) pairs, suitable for passing to
+      Reconciler
+    """
+    for line in f:
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        yield fields[0], fields[1:]
+
+
+def writePlan(plan, f):
+    """Write a plan to a file, one change per line."""
+    for op in plan:
+        f.write('\t'.join(op) + '\n')
+
+
+def readPlan(f):
+    """Read a plan written by writePlan.
+
+    Returns:
+      A list of (action, group, target) tuples
+    """
+    plan = []
+    for line in f:
+        line = line.rstrip('\r\n')
+        if not line or line.startswith('#'):
+            continue
+        op = tuple(line.split('\t'))
+        if len(op) != 3 or op[0] not in ACTIONS:
+            raise ValueError('Invalid plan line: %r' % line)
+        plan.append(op)
+    return plan
+
+
+class _Throttle(object):
+    """Space calls out to at most rate a second, across threads."""
+    def __init__(self, rate):
+        self._interval = 1.0 / rate
+        self._next = time.time()
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            now = time.time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _noThrottle():
+    pass
+
+
+class Reconciler(object):
+    """Make the membership of many groups match a desired state.
+
+    Loading the current state takes one ListEntries sweep over the
+    PRDB (one RPC per page of entries), plus one ListElements RPC for
+    each of the desired groups that already exists, with up to
+    workers of those in flight at once. Applying the plan takes one
+    RPC per change.
+
+    Iterating over a Reconciler applies the plan, and yields each
+    change as it's made (or, in dry-run mode, each change that would
+    be made). run() does the whole thing without yielding anything.
+    Changes that fail are recorded and skipped; a member added to a
+    group it's already in, or removed from a group it isn't in, counts
+    as a success, so a plan can safely be applied twice.
+
+    For example:
+
+        r = Reconciler(PTS(), readDesired(open('groups.txt')),
+                       rate=50, checkpoint='groups.done')
+        for action, group, target in r:
+            print(action, group, target)
+        print(r)
+
+    Args:
+      pts: The afs.pts.PTS object to reconcile
+      desired: A dictionary mapping group names to iterables of
+        member names, or an iterable of (group, members) pairs, such
+        as returned by readDesired. Groups not mentioned are left
+        alone.
+      owners: An optional dictionary mapping group names to the name
+        of the entry that should own them
+      defaultOwner: The owner of new groups that aren't in owners
+      plan: A plan to apply, such as returned by readPlan, instead of
+        computing one from desired
+      dryrun: If true, compute the plan but don't make any changes
+      workers: The maximum number of RPCs to have in flight at once
+      rate: The maximum number of changes to make per second, or None
+        for no limit
+      checkpoint: The name of a file to record each change in as it's
+        made. If the file already exists, the changes it lists are
+        skipped.
+
+    Attributes:
+      done: A list of the changes that were (or would be) made
+      skipped: The number of changes skipped because the checkpoint
+        file said they had already been made
+      failed: A list of ((action, group, target), exception) pairs for
+        the changes that couldn't be made
+      missing: A sorted list of the members and owners in the desired
+        state that don't exist, and so were left out of the plan
+    """
+    def __init__(self, pts, desired=None, owners=None,
+                 defaultOwner=DEFAULT_OWNER, plan=None, dryrun=False,
+                 workers=util.WORKERS, rate=None, checkpoint=None):
+        self._pts = pts
+        self._desired = desired
+        self._owners = dict((g.lower(), o.lower())
+                            for (g, o) in (owners or {}).items())
+        self._defaultOwner = defaultOwner
+        self._plan = None if plan is None else list(plan)
+        self.dryrun = dryrun
+        self.workers = workers
+        self._throttle = _noThrottle if rate is None else _Throttle(rate)
+        self.checkpoint = checkpoint
+        self._byName = {}
+        self.done = []
+        self.skipped = 0
+        self.failed = []
+        self.missing = []
+
+    def _load(self):
+        """Return the desired and current membership, by group name.
+
+        Returns:
+          A (desired, current, owner) tuple. desired maps group names
+          to sets of member names. current maps the name of each of
+          those groups that exists to the set of its members' names,
+          and owner maps it to the name of its owner.
+        """
+        desired = {}
+        items = self._desired
+        if hasattr(items, 'items'):
+            items = items.items()
+        for group, members in items:
+            desired.setdefault(group.lower(), set()).update(
+                m.lower() for m in members)
+
+        byId = {}
+        owners = {}
+        for rec in self._pts._ListEntries(users=True, groups=True):
+            self._byName[rec.name] = rec.id
+            byId[rec.id] = rec.name
+            owners[rec.id] = rec.owner
+
+        def name(id):
+            return byId.get(id, str(id))
+
+        current = {}
+        owner = {}
+        gids = [self._byName[g] for g in desired if g in self._byName]
+        for gid, members, exc in util.imap(self._pts._ListMembers, gids,
+                                           self.workers):
+            if exc is not None:
+                raise exc
+            current[byId[gid]] = set(name(m) for m in members)
+            owner[byId[gid]] = name(owners[gid])
+
+        return desired, current, owner
+
+    def plan(self):
+        """Return the list of changes needed to reach the desired state.
+
+        The current state is loaded the first time this is called.
+
+        Returns:
+          A list of (action, group, target) tuples, in the order
+          they'll be made, where action is one of ACTIONS, and target
+          is the new owner for create and chown and the member for add
+          and remove.
+        """
+        if self._plan is not None:
+            return self._plan
+
+        desired, current, owner = self._load()
+        created = set(g for g in desired if g not in current)
+        missing = set()
+
+        def exists(name):
+            if name in self._byName or name in created:
+                return True
+            missing.add(name)
+            return False
+
+        creates, chowns, adds, removes = [], [], [], []
+        for group in sorted(desired):
+            want = self._owners.get(group)
+            if group in created:
+                if want is None or want in self._byName:
+                    creates.append(('create', group,
+                                    want or self._defaultOwner))
+                else:
+                    creates.append(('create', group, self._defaultOwner))
+                    if exists(want):
+                        chowns.append(('chown', group, want))
+            elif want is not None and want != owner[group] and exists(want):
+                chowns.append(('chown', group, want))
+
+            have = current.get(group, set())
+            for member in sorted(desired[group] - have):
+                if exists(member):
+                    adds.append(('add', group, member))
+            for member in sorted(have - desired[group]):
+                removes.append(('remove', group, member))
+
+        self.missing = sorted(missing)
+        self._plan = creates + chowns + adds + removes
+        return self._plan
+
+    def _resolve(self, names):
+        """Look up the PTS IDs of any names not already known."""
+        names = [n for n in set(names) if n not in self._byName and
+                 not n.lstrip('-').isdigit()]
+        if not names:
+            return
+        for name, id in zip(names, self._pts._NamesToIds(names)):
+            if id is not None:
+                self._byName[name] = id
+
+    def _id(self, name):
+        id = self._byName.get(name)
+        if id is None:
+            if name.lstrip('-').isdigit():
+                return int(name)
+            id = self._byName[name] = self._pts._NameOrId(name)
+        return id
+
+    def _apply(self, op):
+        action, group, target = op
+        self._throttle()
+        pts = self._pts
+        try:
+            if action == 'create':
+                self._byName[group] = pts._CreateGroup(group, self._id(target))
+            elif action == 'chown':
+                pts._ChangeEntry(self._id(group), newname=group,
+                                 newoid=self._id(target))
+            elif action == 'add':
+                pts._AddToGroup(self._id(target), self._id(group))
+            else:
+                pts._RemoveFromGroup(self._id(target), self._id(group))
+        except AFSException as e:
+            # Already done, by an earlier run or someone else
+            if action == 'create' and e.errno == _pts.PREXIST:
+                self._byName[group] = pts._NameToId(group)
+            elif not ((action == 'add' and e.errno == _pts.PRIDEXIST) or
+                      (action == 'remove' and e.errno == _pts.PRNOENT)):
+                raise
+
+        if hasattr(pts, 'invalidate'):
+            pts.invalidate(self._id(group))
+            if action in ('add', 'remove'):
+                pts.invalidate(self._id(target))
+
+    def _readCheckpoint(self):
+        try:
+            f = open(self.checkpoint)
+        except IOError:
+            return set()
+        try:
+            return set(readPlan(f))
+        finally:
+            f.close()
+
+    def __iter__(self):
+        plan = self.plan()
+        if self.dryrun:
+            for op in plan:
+                self.done.append(op)
+                yield op
+            return
+
+        if self.checkpoint is not None:
+            done = self._readCheckpoint()
+            todo = [op for op in plan if op not in done]
+            self.skipped = len(plan) - len(todo)
+            plan = todo
+            journal = open(self.checkpoint, 'a')
+        else:
+            journal = None
+
+        self._resolve([op[1] for op in plan if op[0] != 'create'] +
+                      [op[2] for op in plan])
+        try:
+            # Each phase has to finish before the next one starts
+            for actions in (('create',), ('chown',), ('add', 'remove')):
+                phase = [op for op in plan if op[0] in actions]
+                for op, _, exc in util.imap(self._apply, phase, self.workers):
+                    if exc is not None:
+                        self.failed.append((op, exc))
+                        continue
+                    if journal is not None:
+                        writePlan([op], journal)
+                        journal.flush()
+                    self.done.append(op)
+                    yield op
+        finally:
+            if journal is not None:
+                journal.close()
+
+    def run(self):
+        """Make all of the changes, and return self"""
+        for op in self:
+            pass
+        return self
+
+    def __repr__(self):
+        return '<Reconciler: %d done, %d skipped, %d failed%s>' % (
+            len(self.done), self.skipped, len(self.failed),
+            ' (dry run)' if self.dryrun else '')
@@ -0,0 +1,406 @@
+"""
+Offline snapshots of an AFS protection database
+
+dump() walks a live PRDB and writes every entry, with all of its
+ListEntry fields, plus the membership and ownership edges between
+entries, to a single file. SnapshotPTS serves the same getEntry,
+members/groups and iteration interface as afs.pts.PTS from that file,
+read-only and without any RPCs.
+
+The file is a header followed by flat arrays of little-endian 32-bit
+integers and fixed-width names, so it's memory-mapped rather than
+parsed; opening even a very large snapshot is instantaneous, and only
+the pages that are touched are read from disk. The arrays are:
+
+  ids         the PTS ID of each entry, sorted
+  flags, owner, creator, ngroups, nusers, count
+              the remaining ListEntry fields, parallel to ids
+  names       the name of each entry, NUL-padded to NAMELEN bytes
+  nameorder   indices into ids, sorted by name
+  memberstart, members
+              for each group, the IDs of its members: those of the
+              entry at index i are members[memberstart[i]:memberstart[i+1]]
+  groupstart, groups
+              the same for the groups each user is a member of
+  ownedstart, owned
+              the same for the IDs of the groups each entry owns
+"""
+
+import bisect
+import errno
+import mmap
+import os
+import struct
+import time
+
+from afs import _pts
+from afs._util import AFSException
+from afs.pts import PTSMixin
+
+MAGIC = b'PYAFSPR2'
+NAMELEN = 64
+PAGESIZE = 500
+
+# magic, cell, number of entries, number of membership edges, number
+# of ownership edges, umax, gmax, time the snapshot was taken
+_header = struct.Struct('<8s64sIIIiid')
+
+_fields = ('flags', 'owner', 'creator', 'ngroups', 'nusers', 'count')
+
+# Well-known PTS IDs, from ptserver.h
+_ANYUSERID = -101
+_AUTHUSERID = -102
+_ANONYMOUSID = 32766
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+class _Int32Array(object):
+    """A read-only sequence of int32s at an offset in a buffer."""
+    def __init__(self, buf, offset, length):
+        self._buf = buf
+        self._offset = offset
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(i)
+        return struct.unpack_from('<i', self._buf, self._offset + 4 * i)[0]
+
+    def range(self, start, stop):
+        """Return elements start through stop - 1 as a list."""
+        return list(struct.unpack_from('<%di' % (stop - start), self._buf,
+                                       self._offset + 4 * start))
+
+
+class _Names(object):
+    """A read-only sequence of fixed-width names in a buffer."""
+    def __init__(self, buf, offset, length):
+        self._buf = buf
+        self._offset = offset
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        start = self._offset + NAMELEN * i
+        name = self._buf[start:start + NAMELEN].rstrip(b'\0')
+        if str is bytes:
+            return name
+        return name.decode('utf-8')
+
+
+class _SortedNames(object):
+    """The names of a snapshot, viewed in sorted order, for bisect."""
+    def __init__(self, names, order):
+        self._names = names
+        self._order = order
+
+    def __len__(self):
+        return len(self._order)
+
+    def __getitem__(self, i):
+        return self._names[self._order[i]]
+
+
+def _packInts(f, values):
+    values = list(values)
+    f.write(struct.pack('<%di' % len(values), *values))
+
+
+def _csr(n, index, edges):
+    """Turn (from, to) pairs into compressed sparse row arrays.
+
+    Args:
+      n: The number of entries
+      index: A dictionary mapping PTS IDs to entry indices
+      edges: An iterable of (from ID, to ID) pairs
+
+    Returns:
+      A (starts, targets) tuple
+    """
+    buckets = [[] for i in range(n)]
+    for src, dst in edges:
+        if src in index:
+            buckets[index[src]].append(dst)
+    starts = [0]
+    targets = []
+    for b in buckets:
+        b.sort()
+        targets.extend(b)
+        starts.append(len(targets))
+    return starts, targets
+
+
+def dump(pts, path):
+    """Write a snapshot of a protection database to a file.
+
+    This lists every user and group (one RPC per page), plus the
+    membership of every group (one RPC per group). The file is
+    written under a temporary name and renamed into place, so an
+    existing snapshot at path is replaced atomically.
+
+    Args:
+      pts: An afs.pts.PTS object for the cell to dump
+      path: The file to write the snapshot to
+    """
+    entries = sorted(pts._ListEntries(users=True, groups=True),
+                     key=lambda e: e.id)
+    n = len(entries)
+    index = dict((e.id, i) for (i, e) in enumerate(entries))
+    umax, gmax = pts._ListMax()
+
+    membership = []
+    for e in entries:
+        if e.id < 0:
+            membership.extend((e.id, m) for m in pts._ListMembers(e.id))
+
+    memberstart, members = _csr(n, index, membership)
+    groupstart, groups = _csr(n, index, ((m, g) for (g, m) in membership))
+    # Like PR_ListOwned, only groups count as owned
+    ownedstart, owned = _csr(n, index,
+                             ((e.owner, e.id) for e in entries if e.id < 0))
+    nameorder = sorted(range(n), key=lambda i: entries[i].name)
+
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tmp, 'wb')
+    try:
+        cell = pts.cell
+        if not isinstance(cell, bytes):
+            cell = cell.encode('utf-8')
+        f.write(_header.pack(MAGIC, cell, n, len(members), len(owned),
+                             umax, gmax, time.time()))
+        _packInts(f, (e.id for e in entries))
+        for field in _fields:
+            _packInts(f, (getattr(e, field) for e in entries))
+        for e in entries:
+            name = e.name
+            if not isinstance(name, bytes):
+                name = name.encode('utf-8')
+            f.write(struct.pack('%ds' % NAMELEN, name))
+        _packInts(f, nameorder)
+        for array in (memberstart, members, groupstart, groups,
+                      ownedstart, owned):
+            _packInts(f, array)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+
+def _readOnly(*args, **kwargs):
+    raise OSError(errno.EROFS, 'PRDB snapshots are read-only')
+
+
+class SnapshotPTS(PTSMixin):
+    """A read-only protection database served from a snapshot file.
+
+    SnapshotPTS offers the same interface as afs.pts.PTS (getEntry,
+    getEntries, PTEntry attributes, members and groups, iteration),
+    but every lookup is answered from a file written by dump(),
+    without contacting any server. Any attempt to change the database
+    raises OSError with errno EROFS.
+
+    The file stays mapped into memory until close() is called, or the
+    with block the SnapshotPTS was opened in ends.
+
+    Args:
+      path: The snapshot file to read
+      cachesize, ttl, negativettl: See afs.pts.PTS.
+
+    Attributes:
+      cell: The cell the snapshot was taken from
+      realm: Always None; snapshots can't convert Kerberos principals
+      timestamp: The time the snapshot was taken, in seconds since
+        the epoch
+    """
+    realm = None
+
+    def __init__(self, path, cachesize=None, ttl=None, negativettl=None):
+        super(SnapshotPTS, self).__init__(cachesize=cachesize, ttl=ttl,
+                                          negativettl=negativettl)
+        f = open(path, 'rb')
+        try:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        magic = self._buf[:len(MAGIC)]
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("'%s' is not a PRDB snapshot." % path)
+        cell, n, m, o, self._umax, self._gmax, self.timestamp = \
+            _header.unpack_from(self._buf, 0)[1:]
+        self.cell = cell.rstrip(b'\0')
+        if str is not bytes:
+            self.cell = self.cell.decode('utf-8')
+
+        offset = _header.size
+
+        def ints(length):
+            array = _Int32Array(self._buf, offset, length)
+            return array, offset + 4 * length
+
+        self._ids, offset = ints(n)
+        self._fields = {}
+        for field in _fields:
+            self._fields[field], offset = ints(n)
+        self._names = _Names(self._buf, offset, n)
+        offset += NAMELEN * n
+        nameorder, offset = ints(n)
+        self._sortedNames = _SortedNames(self._names, nameorder)
+        self._nameorder = nameorder
+        self._memberstart, offset = ints(n + 1)
+        self._members, offset = ints(m)
+        self._groupstart, offset = ints(n + 1)
+        self._groups, offset = ints(m)
+        self._ownedstart, offset = ints(n + 1)
+        self._owned, offset = ints(o)
+        if offset != len(self._buf):
+            self.close()
+            raise ValueError("'%s' is truncated or corrupt." % path)
+
+    def close(self):
+        """Unmap the snapshot file.
+
+        Entries that were already retrieved keep the attributes they
+        have loaded, but any further lookup fails.
+        """
+        self._buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _indexOfId(self, id):
+        i = bisect.bisect_left(self._ids, id)
+        if i < len(self._ids) and self._ids[i] == id:
+            return i
+        return None
+
+    def _indexOfName(self, name):
+        name = name.lower()
+        i = bisect.bisect_left(self._sortedNames, name)
+        if i < len(self._sortedNames) and self._sortedNames[i] == name:
+            return self._nameorder[i]
+        return None
+
+    def _index(self, ident):
+        """Return the index of the entry ident names, or raise PRNOENT."""
+        if isinstance(ident, basestring):
+            i = self._indexOfName(ident)
+        else:
+            i = self._indexOfId(int(ident))
+        if i is None:
+            raise AFSException(_pts.PRNOENT)
+        return i
+
+    def _record(self, i):
+        """Return the entry at index i as a _pts.PTEntry."""
+        rec = _pts.PTEntry()
+        rec.id = self._ids[i]
+        rec.name = self._names[i]
+        for field in _fields:
+            setattr(rec, field, self._fields[field][i])
+        return rec
+
+    def _NameOrId(self, ident):
+        return self._ids[self._index(ident)]
+
+    def _NameToId(self, name):
+        return self._ids[self._index(name)]
+
+    def _IdToName(self, id):
+        return self._names[self._index(id)]
+
+    def _NamesToIds(self, names):
+        indices = [self._indexOfName(n) for n in names]
+        return [None if i is None else self._ids[i] for i in indices]
+
+    def _IdsToNames(self, ids):
+        indices = [self._indexOfId(int(id)) for id in ids]
+        return [None if i is None else self._names[i] for i in indices]
+
+    def _ListEntry(self, ident):
+        return self._record(self._index(ident))
+
+    def _ListMembers(self, ident):
+        i = self._index(ident)
+        if self._ids[i] < 0:
+            return self._members.range(self._memberstart[i],
+                                       self._memberstart[i + 1])
+        else:
+            return self._groups.range(self._groupstart[i],
+                                      self._groupstart[i + 1])
+
+    def _ListOwned(self, owner):
+        i = self._index(owner)
+        return self._owned.range(self._ownedstart[i], self._ownedstart[i + 1])
+
+    def _ListSuperGroups(self, ident):
+        i = self._index(ident)
+        return self._groups.range(self._groupstart[i], self._groupstart[i + 1])
+
+    def _GetCPS(self, ident):
+        i = self._index(ident)
+        id = self._ids[i]
+        cps = set([id, _ANYUSERID])
+        if id != _ANONYMOUSID:
+            cps.add(_AUTHUSERID)
+        todo = [i]
+        while todo:
+            j = todo.pop()
+            for g in self._groups.range(self._groupstart[j],
+                                        self._groupstart[j + 1]):
+                if g not in cps:
+                    cps.add(g)
+                    k = self._indexOfId(g)
+                    if k is not None:
+                        todo.append(k)
+        return sorted(cps)
+
+    def _GetCPS2(self, ident, host=None):
+        # Snapshots don't record host entries
+        return self._GetCPS(ident)
+
+    def _IsAMemberOf(self, user, group):
+        # Like the ptserver, count membership through supergroups, and
+        # in system:anyuser and system:authuser
+        return self._NameOrId(group) in self._GetCPS(user)
+
+    def _ListMax(self):
+        return (self._umax, self._gmax)
+
+    def _ListEntriesPage(self, users=None, groups=None, startindex=0):
+        wantUsers = groups is None or users is True
+        wantGroups = bool(groups)
+        entries = []
+        i = startindex
+        while i < len(self._ids) and len(entries) < PAGESIZE:
+            id = self._ids[i]
+            if (id < 0 and wantGroups) or (id > 0 and wantUsers):
+                entries.append(self._record(i))
+            i += 1
+        if i >= len(self._ids):
+            i = -1
+        return (entries, i)
+
+    def _ListEntries(self, users=None, groups=None, startindex=0):
+        while startindex != -1:
+            entries, startindex = self._ListEntriesPage(users, groups, startindex)
+            for e in entries:
+                yield e
+
+    _CreateUser = _CreateGroup = _Delete = _readOnly
+    _AddToGroup = _RemoveFromGroup = _ChangeEntry = _SetFields = _readOnly
+    _SetMaxUserId = _SetMaxGroupId = _readOnly
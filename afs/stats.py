@@ -0,0 +1,222 @@
+"""
+Instrumentation for RPCs and pioctls
+
+When instrumentation is enabled, every ubik_PR_* RPC made by afs._pts
+and every pioctl made by afs._acl and afs._fs is timed, and its
+result code recorded, in a global registry. Each PTS connection also
+keeps its own statistics, available from PTS.stats().
+
+Instrumentation is off by default; enable() turns it on. When it's
+off, each call pays for one pointer comparison.
+
+Hooks can be added to be called before and after every call, for
+tracing:
+
+    def pre(op, owner):
+        log.debug('starting %s', op)
+    def post(op, owner, code, seconds):
+        log.debug('%s returned %d after %.3fs', op, code, seconds)
+    afs.stats.addHook(pre, post)
+
+op is the name of the RPC ('PR_ListEntry') or pioctl ('VIOCGETAL'),
+owner is the PTS object the RPC was made through, or None for
+pioctls, and code is the value the call returned: 0 for success, an
+AFS error code, or an errno for pioctls that failed in the kernel.
+"""
+
+import threading
+import weakref
+from timeit import default_timer as _timer
+
+from afs import _util
+
+# The upper bounds, in seconds, of the buckets in a latency histogram;
+# there's an extra bucket at the end for anything slower
+BUCKETS = (1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3,
+           1e-2, 2e-2, 5e-2, 1e-1, 2e-1, 5e-1, 1, 2, 5, 10, 30)
+
+
+def errorMessage(code):
+    """Return the message for an AFS error code or errno."""
+    # This makes sure the error tables are loaded
+    _util.pyafs_error(0)
+    return _util.AFSException(code).strerror
+
+
+class OpStats(object):
+    """Statistics for one kind of RPC or pioctl.
+
+    Attributes:
+      count: The number of calls made
+      errors: A dictionary mapping each nonzero result code returned
+        to the number of calls that returned it
+      total: The total time spent in calls, in seconds
+      min, max: The fastest and slowest call, in seconds
+      buckets: A list of call counts, one for each bound in BUCKETS
+        plus one for anything slower
+    """
+    def __init__(self):
+        self.count = 0
+        self.errors = {}
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def record(self, seconds, code):
+        self.count += 1
+        if code:
+            self.errors[code] = self.errors.get(code, 0) + 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+        self.buckets[i] += 1
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, p):
+        """Estimate a latency percentile from the histogram.
+
+        Returns:
+          The upper bound of the bucket that the pth percentile call
+          falls in, or max if it's in the last bucket
+        """
+        if not self.count:
+            return None
+        target = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target and n:
+                if i < len(BUCKETS):
+                    return min(BUCKETS[i], self.max)
+                return self.max
+        return self.max
+
+    def copy(self):
+        other = OpStats()
+        other.__dict__.update(self.__dict__)
+        other.errors = dict(self.errors)
+        other.buckets = list(self.buckets)
+        return other
+
+    def __repr__(self):
+        return '<OpStats: %d calls, %d errors, mean %.6fs>' % (
+            self.count, sum(self.errors.values()), self.mean() or 0)
+
+
+class Registry(object):
+    """Statistics and hooks for every instrumented call.
+
+    There's normally just the one, afs.stats.registry.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
+        self._owners = weakref.WeakKeyDictionary()
+        self._pre = []
+        self._post = []
+
+    def _start(self, owner, op):
+        for hook in self._pre:
+            hook(op, owner)
+        return _timer()
+
+    def _end(self, owner, op, start, code):
+        seconds = _timer() - start
+        with self._lock:
+            if op not in self._ops:
+                self._ops[op] = OpStats()
+            self._ops[op].record(seconds, code)
+            if owner is not None:
+                ops = self._owners.setdefault(owner, {})
+                if op not in ops:
+                    ops[op] = OpStats()
+                ops[op].record(seconds, code)
+        for hook in self._post:
+            hook(op, owner, code, seconds)
+
+    def stats(self, owner=None):
+        """Return a dictionary mapping operation names to OpStats.
+
+        Args:
+          owner: If not None, only return statistics for the calls
+            made through this PTS object
+
+        Returns:
+          Copies of the statistics, which don't change as more calls
+          are made
+        """
+        with self._lock:
+            if owner is None:
+                ops = self._ops
+            else:
+                ops = self._owners.get(owner, {})
+            return dict((op, s.copy()) for (op, s) in ops.items())
+
+    def reset(self):
+        """Throw away all of the statistics collected so far."""
+        with self._lock:
+            self._ops.clear()
+            self._owners.clear()
+
+    def addHook(self, pre=None, post=None):
+        """Add functions to call before and/or after every call."""
+        if pre is not None:
+            self._pre.append(pre)
+        if post is not None:
+            self._post.append(post)
+
+    def removeHook(self, pre=None, post=None):
+        if pre is not None:
+            self._pre.remove(pre)
+        if post is not None:
+            self._post.remove(post)
+
+    def report(self, owner=None):
+        """Return a human-readable summary of the statistics."""
+        lines = ['%-24s %8s %8s %10s %10s %10s %10s' % (
+            'operation', 'calls', 'errors', 'mean', 'p50', 'p99', 'max')]
+        stats = self.stats(owner)
+        for op in sorted(stats, key=str):
+            s = stats[op]
+            lines.append('%-24s %8d %8d %10.6f %10.6f %10.6f %10.6f' % (
+                op, s.count, sum(s.errors.values()), s.mean(),
+                s.percentile(50), s.percentile(99), s.max))
+            for code in sorted(s.errors):
+                lines.append('    %8d x %d: %s' % (
+                    s.errors[code], code, errorMessage(code)))
+        return '\n'.join(lines)
+
+
+registry = Registry()
+
+addHook = registry.addHook
+removeHook = registry.removeHook
+reset = registry.reset
+report = registry.report
+
+
+def enable():
+    """Start recording statistics for RPCs and pioctls."""
+    _util._setStats(registry)
+
+
+def disable():
+    """Stop recording statistics; what's been recorded is kept."""
+    _util._setStats(None)
+
+
+def stats():
+    """Return the global statistics; see Registry.stats."""
+    return registry.stats()
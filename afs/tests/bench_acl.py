@@ -0,0 +1,65 @@
+"""
+Benchmarks for the ACL codec
+
+This measures how many ACLs per second can be parsed and formatted,
+and how many rights conversions per second can be done, over a set of
+synthetic ACLs shaped like the ones a scan of a large project volume
+turns up. It doesn't talk to AFS, so it can be run anywhere the
+extension modules are built:
+
+    python -m afs.tests.bench_acl [number of ACLs]
+"""
+
+import random
+import sys
+import time
+
+import afs.acl as acl
+
+_rights = ['rl', 'rlidwk', 'rlidwka', 'lik', 'l', 'rlidwkaA', 'rlB']
+
+
+def _makeAcls(n, entries=8, seed=0):
+    rng = random.Random(seed)
+    acls = []
+    for i in range(n):
+        npos = rng.randint(1, entries)
+        nneg = rng.randint(0, 2)
+        pos = dict(('user%d' % rng.randint(0, 100000),
+                    acl.readRights(rng.choice(_rights)))
+                   for j in range(npos))
+        pos['system:administrators'] = acl.readRights('all')
+        neg = dict(('user%d' % rng.randint(0, 100000),
+                    acl.readRights(rng.choice(_rights)))
+                   for j in range(nneg))
+        acls.append(acl._unparseAcl(pos, neg))
+    return acls
+
+
+def _bench(name, func, items):
+    start = time.time()
+    for item in items:
+        func(item)
+    elapsed = time.time() - start
+    print('%-12s %10d in %6.3fs  %12.0f/s' % (
+        name, len(items), elapsed, len(items) / max(elapsed, 1e-9)))
+
+
+def main(n=100000):
+    acls = _makeAcls(n)
+    parsed = [acl._parseAcl(a) for a in acls]
+    bitmasks = [m for (pos, neg) in parsed for m in pos.values()]
+    strings = [acl.showRights(m) for m in bitmasks]
+
+    _bench('parse', acl._parseAcl, acls)
+    _bench('format', lambda pn: acl._unparseAcl(*pn), parsed)
+    _bench('ACL', lambda a: acl.ACL(*acl._parseAcl(a)), acls)
+    _bench('showRights', acl.showRights, bitmasks)
+    _bench('readRights', acl.readRights, strings)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,91 @@
+"""
+Benchmarks for the PTS hot paths
+
+This runs the common afs.pts operations against a FakePTS, an
+in-process stand-in for a protection server, and reports the wall
+time and the number of RPCs each one takes. With a nonzero latency,
+each RPC sleeps to simulate a round trip to a real server, so the RPC
+counts dominate; with no latency, the Python overhead does.
+
+    python -m afs.tests.bench_pts [users [groups [latency]]]
+
+The ACL codec benchmarks from afs.tests.bench_acl are run afterwards.
+"""
+
+import sys
+import time
+
+from afs.tests import bench_acl
+from afs.tests.fakepts import FakePTS
+
+
+def _bench(name, pts, func):
+    pts.rpcs.clear()
+    start = time.time()
+    n = func()
+    elapsed = time.time() - start
+    rpcs = sum(pts.rpcs.values())
+    print('%-24s %8d items %8.3fs %10.0f/s %8d RPCs  %s' % (
+        name, n, elapsed, n / max(elapsed, 1e-9), rpcs,
+        ', '.join('%s=%d' % kv for kv in sorted(pts.rpcs.items()))))
+
+
+def main(users=10000, groups=1000, latency=0.0):
+    def fresh():
+        return FakePTS(users=users, groups=groups, members=50,
+                       latency=latency)
+
+    pts = fresh()
+    userIds = list(range(1, users + 1))
+    groupIds = list(range(-205, -205 - groups, -1))
+
+    def getEntry():
+        for id in userIds:
+            pts.getEntry(id)
+        return len(userIds)
+    _bench('getEntry (cold)', pts, getEntry)
+    _bench('getEntry (cached)', pts, getEntry)
+
+    pts = fresh()
+    names = ['user%d' % id for id in userIds]
+    _bench('getEntries', pts, lambda: len(pts.getEntries(names)))
+
+    def attributes():
+        for ent in pts.getEntries(userIds):
+            ent.owner, ent.creator, ent.flags
+        return len(userIds)
+    pts = fresh()
+    _bench('attributes', pts, attributes)
+
+    def members():
+        n = 0
+        for gid in groupIds:
+            n += len(list(pts.getEntry(gid).members))
+        return n
+    pts = fresh()
+    _bench('members', pts, members)
+
+    def cps():
+        n = 0
+        for id in userIds:
+            n += len(pts.getEntry(id).cps)
+        return n
+    pts = fresh()
+    _bench('cps', pts, cps)
+
+    def iterate():
+        n = 0
+        for ent in pts.iterEntries(users=True, groups=True):
+            ent.owner
+            n += 1
+        return n
+    pts = fresh()
+    _bench('iterEntries', pts, iterate)
+
+    print('')
+    bench_acl.main()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*[f(a) for (f, a) in zip((int, int, float), args)])
@@ -0,0 +1,402 @@
+"""
+An in-process stand-in for an AFS protection server
+
+FakePTS offers the same interface as afs.pts.PTS, but its database
+lives in memory, so tests and benchmarks can run without a cell. It
+implements the low-level _pts.PTS methods (_NameToId, _ListEntry,
+_ListMembers, and so on) with the same semantics and errors as a real
+ptserver, and counts how many times each RPC would have been made.
+Each RPC can optionally sleep, to simulate network latency; sleeping
+releases the GIL, just like a real RPC does.
+"""
+
+import collections
+import random
+import threading
+import time
+
+from afs import _pts
+from afs._util import AFSException
+from afs.pts import PTSMixin, PTS_AUTH
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+# From ptint.h and ptserver.h
+PR_MAXLIST = 5000
+PAGESIZE = 500
+SYSADMINID = -204
+ANYUSERID = -101
+AUTHUSERID = -102
+ANONYMOUSID = 32766
+
+
+class FakeServer(object):
+    """The low-level half of FakePTS, standing in for _pts.PTS.
+
+    Args:
+      cell: The name of the cell to pretend to be
+      users: The number of users to create, named user1, user2, ...
+      groups: The number of groups to create, named system:group1,
+        system:group2, ...
+      members: The number of users to put in each group, chosen at
+        random
+      latency: The number of seconds each RPC takes
+      seed: The seed for choosing group members
+
+    Attributes:
+      rpcs: A collections.Counter of the number of times each RPC
+        has been made
+    """
+    def __init__(self, cell='example.com', users=0, groups=0, members=0,
+                 latency=0, seed=0, *args, **kwargs):
+        self.cell = cell
+        self.realm = cell.upper()
+        self.latency = latency
+        self.rpcs = collections.Counter()
+        self._lock = threading.Lock()
+
+        self._entries = {}
+        self._ids = {}
+        self._members = collections.defaultdict(set)
+        self._groups = collections.defaultdict(set)
+        self._umax = 0
+        self._gmax = SYSADMINID
+
+        for id, name in ((SYSADMINID, 'system:administrators'),
+                         (ANYUSERID, 'system:anyuser'),
+                         (AUTHUSERID, 'system:authuser')):
+            self._add(id, name, SYSADMINID)
+        self._add(ANONYMOUSID, 'anonymous', SYSADMINID)
+
+        for i in range(1, users + 1):
+            self._add(i, 'user%d' % i, SYSADMINID)
+        self._umax = users
+        rng = random.Random(seed)
+        for i in range(1, groups + 1):
+            self._gmax -= 1
+            self._add(self._gmax, 'system:group%d' % i, SYSADMINID)
+            for uid in rng.sample(range(1, users + 1), min(members, users)):
+                self._link(uid, self._gmax)
+
+    def _add(self, id, name, owner):
+        e = _pts.PTEntry()
+        e.id = id
+        e.name = name
+        e.owner = owner
+        e.creator = SYSADMINID
+        e.flags = 0
+        e.ngroups = 20 if id > 0 else 0
+        e.nusers = 0
+        e.count = 0
+        self._entries[id] = e
+        self._ids[name] = id
+
+    def _link(self, uid, gid):
+        self._members[gid].add(uid)
+        self._groups[uid].add(gid)
+
+    def _rpc(self, name):
+        """Account for one RPC, and wait for it to "complete"."""
+        self.rpcs[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _entry(self, id):
+        """Return the entry with PTS ID id, or raise PRNOENT."""
+        try:
+            return self._entries[id]
+        except KeyError:
+            raise AFSException(_pts.PRNOENT)
+
+    def _NameOrId(self, ident):
+        if isinstance(ident, basestring):
+            return self._NameToId(ident)
+        else:
+            return int(ident)
+
+    def _NameToId(self, name):
+        self._rpc('PR_NameToID')
+        with self._lock:
+            try:
+                return self._ids[name.lower()]
+            except KeyError:
+                raise AFSException(_pts.PRNOENT)
+
+    def _IdToName(self, id):
+        self._rpc('PR_IDToName')
+        with self._lock:
+            return self._entry(int(id)).name
+
+    def _NamesToIds(self, names, chunk=PR_MAXLIST):
+        names = list(names)
+        for i in range(0, len(names), chunk):
+            self._rpc('PR_NameToID')
+        with self._lock:
+            return [self._ids.get(n.lower()) for n in names]
+
+    def _IdsToNames(self, ids, chunk=PR_MAXLIST):
+        ids = list(ids)
+        for i in range(0, len(ids), chunk):
+            self._rpc('PR_IDToName')
+        with self._lock:
+            return [self._entries[id].name if id in self._entries else None
+                    for id in ids]
+
+    def _create(self, name, owner, id, group):
+        name = name.lower()
+        with self._lock:
+            if name in self._ids:
+                raise AFSException(_pts.PREXIST)
+            if id is None:
+                if group:
+                    self._gmax -= 1
+                    id = self._gmax
+                else:
+                    self._umax += 1
+                    id = self._umax
+            elif id in self._entries:
+                raise AFSException(_pts.PRIDEXIST)
+            else:
+                if group:
+                    self._gmax = min(self._gmax, id)
+                else:
+                    self._umax = max(self._umax, id)
+            self._add(id, name, owner)
+            return id
+
+    def _CreateUser(self, name, id=None):
+        self._rpc('PR_INewEntry' if id is not None else 'PR_NewEntry')
+        return self._create(name, SYSADMINID, id, False)
+
+    def _CreateGroup(self, name, owner, id=None):
+        # Owner 0 means the caller, taken to be system:administrators
+        oid = self._NameOrId(owner) or SYSADMINID
+        self._rpc('PR_INewEntry' if id is not None else 'PR_NewEntry')
+        return self._create(name, oid, id, True)
+
+    def _Delete(self, ident):
+        id = self._NameOrId(ident)
+        self._rpc('PR_Delete')
+        with self._lock:
+            e = self._entry(id)
+            for other in self._members.pop(id, ()):
+                self._groups[other].discard(id)
+            for other in self._groups.pop(id, ()):
+                self._members[other].discard(id)
+            del self._entries[id]
+            del self._ids[e.name]
+
+    def _AddToGroup(self, user, group):
+        uid, gid = self._NameOrId(user), self._NameOrId(group)
+        self._rpc('PR_AddToGroup')
+        with self._lock:
+            self._entry(uid)
+            self._entry(gid)
+            if uid in self._members[gid]:
+                raise AFSException(_pts.PRIDEXIST)
+            self._link(uid, gid)
+
+    def _RemoveFromGroup(self, user, group):
+        uid, gid = self._NameOrId(user), self._NameOrId(group)
+        self._rpc('PR_RemoveFromGroup')
+        with self._lock:
+            if uid not in self._members[gid]:
+                raise AFSException(_pts.PRNOENT)
+            self._members[gid].discard(uid)
+            self._groups[uid].discard(gid)
+
+    def _ListMembers(self, ident):
+        id = self._NameOrId(ident)
+        self._rpc('PR_ListElements')
+        with self._lock:
+            self._entry(id)
+            if id < 0:
+                return sorted(self._members[id])
+            return sorted(self._groups[id])
+
+    def _supergroups(self, id):
+        """Return id and every group it's in, directly or not."""
+        seen = set([id])
+        todo = [id]
+        while todo:
+            for gid in self._groups[todo.pop()]:
+                if gid not in seen:
+                    seen.add(gid)
+                    todo.append(gid)
+        return seen
+
+    def _GetCPS(self, ident):
+        id = self._NameOrId(ident)
+        self._rpc('PR_GetCPS')
+        with self._lock:
+            self._entry(id)
+            cps = self._supergroups(id)
+        cps.add(ANYUSERID)
+        if id != ANONYMOUSID:
+            cps.add(AUTHUSERID)
+        return sorted(cps)
+
+    def _GetCPS2(self, ident, host=None):
+        return self._GetCPS(ident)
+
+    def _ListSuperGroups(self, ident):
+        id = self._NameOrId(ident)
+        self._rpc('PR_ListSuperGroups')
+        with self._lock:
+            self._entry(id)
+            return sorted(self._groups[id])
+
+    def _ListOwned(self, owner):
+        oid = self._NameOrId(owner)
+        self._rpc('PR_ListOwned')
+        with self._lock:
+            self._entry(oid)
+            return sorted(e.id for e in self._entries.values()
+                          if e.id < 0 and e.owner == oid)
+
+    def _copy(self, e):
+        """Return a copy of an entry, with its count filled in."""
+        c = _pts.PTEntry()
+        for field in ('id', 'name', 'owner', 'creator', 'flags',
+                      'ngroups', 'nusers'):
+            setattr(c, field, getattr(e, field))
+        if e.id < 0:
+            c.count = len(self._members[e.id])
+        else:
+            c.count = len(self._groups[e.id])
+        return c
+
+    def _ListEntry(self, ident):
+        id = self._NameOrId(ident)
+        self._rpc('PR_ListEntry')
+        with self._lock:
+            return self._copy(self._entry(id))
+
+    def _ChangeEntry(self, ident, newname=None, newid=None, newoid=None):
+        id = self._NameOrId(ident)
+        if newname is None:
+            newname = self._IdToName(id)
+        self._rpc('PR_ChangeEntry')
+        with self._lock:
+            e = self._entry(id)
+            newname = newname.lower()
+            if newname != e.name and newname in self._ids:
+                raise AFSException(_pts.PREXIST)
+            if newid and newid != id and newid in self._entries:
+                raise AFSException(_pts.PRIDEXIST)
+            if newoid:
+                self._entry(newoid)
+                e.owner = newoid
+            del self._ids[e.name]
+            e.name = newname
+            if newid and newid != id:
+                del self._entries[id]
+                e.id = newid
+                self._members[newid] = self._members.pop(id, set())
+                self._groups[newid] = self._groups.pop(id, set())
+                for other in self._members[newid]:
+                    self._groups[other].discard(id)
+                    self._groups[other].add(newid)
+                for other in self._groups[newid]:
+                    self._members[other].discard(id)
+                    self._members[other].add(newid)
+            self._entries[e.id] = e
+            self._ids[newname] = e.id
+
+    def _IsAMemberOf(self, user, group):
+        uid, gid = self._NameOrId(user), self._NameOrId(group)
+        self._rpc('PR_IsAMemberOf')
+        with self._lock:
+            self._entry(uid)
+            self._entry(gid)
+            if gid in (ANYUSERID, AUTHUSERID):
+                return True
+            return gid in self._supergroups(uid)
+
+    def _ListMax(self):
+        self._rpc('PR_ListMax')
+        with self._lock:
+            return (self._umax, self._gmax)
+
+    def _SetMaxUserId(self, id):
+        self._rpc('PR_SetMax')
+        with self._lock:
+            self._umax = id
+
+    def _SetMaxGroupId(self, id):
+        self._rpc('PR_SetMax')
+        with self._lock:
+            self._gmax = id
+
+    def _ListEntriesPage(self, users=None, groups=None, startindex=0):
+        wantUsers = groups is None or users is True
+        wantGroups = bool(groups)
+        self._rpc('PR_ListEntries')
+        with self._lock:
+            ids = sorted(self._entries)
+            page = []
+            i = startindex
+            while i < len(ids) and len(page) < PAGESIZE:
+                if (ids[i] < 0 and wantGroups) or (ids[i] > 0 and wantUsers):
+                    page.append(self._copy(self._entries[ids[i]]))
+                i += 1
+            if i >= len(ids):
+                i = -1
+            return (page, i)
+
+    def _ListEntries(self, users=None, groups=None, startindex=0):
+        while startindex != -1:
+            entries, startindex = self._ListEntriesPage(users, groups, startindex)
+            for e in entries:
+                yield e
+
+    def _SetFields(self, ident, access=None, groups=None, users=None):
+        id = self._NameOrId(ident)
+        self._rpc('PR_SetFieldsEntry')
+        with self._lock:
+            e = self._entry(id)
+            if access is not None:
+                e.flags = access
+            if groups is not None:
+                e.ngroups = groups
+            if users is not None:
+                e.nusers = users
+
+    def _AfsToKrb5(self, afs_name):
+        if '@' in afs_name:
+            afs_name, realm = afs_name.rsplit('@', 1)
+            realm = realm.upper()
+        else:
+            realm = self.realm
+        return '%s@%s' % (afs_name.replace('.', '/', 1), realm)
+
+    def _Krb5ToAfs(self, krb5_name):
+        name, realm = krb5_name.rsplit('@', 1)
+        name = name.replace('/', '.', 1)
+        if realm == self.realm:
+            return name
+        return '%s@%s' % (name, realm.lower())
+
+    def _AfsToKrb5Many(self, afs_names):
+        return [self._AfsToKrb5(n) for n in afs_names]
+
+    def _Krb5ToAfsMany(self, krb5_names):
+        return [self._Krb5ToAfs(n) for n in krb5_names]
+
+
+class FakePTS(PTSMixin, FakeServer):
+    """An afs.pts.PTS whose protection server is a FakeServer.
+
+    Args:
+      cachesize, ttl, negativettl, diskcache: See afs.pts.PTS
+      cell, users, groups, members, latency, seed: See FakeServer
+    """
+    def __init__(self, cell='example.com', users=0, groups=0, members=0,
+                 latency=0, seed=0, cachesize=None, ttl=None,
+                 negativettl=None, diskcache=None):
+        FakeServer.__init__(self, cell, users, groups, members, latency, seed)
+        PTSMixin.__init__(self, cell, PTS_AUTH, cachesize=cachesize, ttl=ttl,
+                          negativettl=negativettl, diskcache=diskcache)
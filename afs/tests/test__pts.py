@@ -1,4 +1,5 @@
 import os
+import threading
 from afs._pts import PTS
 import nose
 
@@ -34,6 +35,22 @@ def test_group_name_to_id():
     assert id == -204, "PTS can't convert group name to ID."
     assert p._IdToName(id) == name, "PTS can't convert group ID to name."
 
+def test_bulk_name_to_id():
+    p = PTS()
+    names = ['broder', 'system:administrators', 'nonexistent-user-xyzzy']
+    ids = p._NamesToIds(names)
+    assert ids == [41803, -204, None], "PTS can't convert names to IDs in bulk."
+    assert p._IdsToNames(ids[:2]) == names[:2], "PTS can't convert IDs to names in bulk."
+
+def test_bulk_lookups_span_chunks():
+    p = PTS()
+    names = ['broder', 'system:administrators', 'nonexistent-user-xyzzy',
+             'system:anyuser', 'broder']
+    ids = p._NamesToIds(names, chunk=2)
+    assert ids == [41803, -204, None, -101, 41803], "PTS can't convert names to IDs across chunks."
+    assert p._IdsToNames(ids, chunk=2) == [n if i is not None else None
+                                           for n, i in zip(names, ids)], "PTS can't convert IDs to names across chunks."
+
 def test_name_or_id():
     p = PTS()
     name = 'system:administrators'
@@ -41,5 +58,35 @@ def test_name_or_id():
     assert p._NameOrId(name) == id, "PTS._NameOrId can't identify name."
     assert p._NameOrId(id) == id, "PTS._NameOrId can't identify ID."
 
+def test_threaded_lookups():
+    results = []
+    def lookup(p):
+        results.append(p._NameToId('system:administrators'))
+    shared = PTS()
+    threads = [threading.Thread(target=lookup, args=(p,))
+               for p in [shared] * 4 + [PTS() for i in range(4)]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [-204] * 8, "PTS lookups from several threads disagree."
+
+def test_get_cps():
+    p = PTS()
+    id = p._NameToId('broder')
+    cps = p._GetCPS(id)
+    assert id in cps, "PTS CPS doesn't include the user itself."
+    assert -101 in cps, "PTS CPS doesn't include system:anyuser."
+    assert set(p._ListMembers(id)) <= set(cps), "PTS CPS is missing groups."
+
+def test_handle_churn():
+    p = PTS()
+    for i in range(100):
+        q = PTS()
+        assert q.cell == p.cell, "PTS handles for one cell disagree."
+        assert q._NameToId('system:administrators') == -204, "Reused PTS connection doesn't work."
+        del q
+    assert p._NameToId('system:administrators') == -204, "Freeing PTS handles breaks the others."
+
 if __name__ == '__main__':
     nose.main()
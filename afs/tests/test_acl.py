@@ -1,5 +1,10 @@
+import os
+import shutil
+import tempfile
+import threading
 import nose
 import afs.acl as acl
+from afs.tests.fakepts import FakePTS
 
 def test_showRights():
     assert acl.showRights(acl.READ | acl.WRITE) == "rw"
@@ -16,6 +21,200 @@ def test_retrieve():
 def test_getCallerAccess():
     assert acl.getCallerAccess('/afs/athena.mit.edu/contrib/bitbucket2') & acl.WRITE
 
+def test_threaded_retrieve():
+    results = []
+    def retrieve():
+        results.append(acl.ACL.retrieve('/afs/athena.mit.edu/contrib/bitbucket2'))
+    threads = [threading.Thread(target=retrieve) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 8
+    assert all(a.pos['system:anyuser'] & acl.WRITE for a in results)
+
+
+def test_transforms():
+    a = acl.ACL({'system:anyuser': acl.READ, 'olduser': acl.READ}, {})
+    b = a.copy()
+    for transform in (acl.grant('system:anyuser', 'l'),
+                      acl.replace('olduser', 'newuser'),
+                      acl.revoke('nobody')):
+        transform(b)
+    assert a != b
+    assert a.diff(b) == [('newuser', False, 0, acl.READ),
+                         ('olduser', False, acl.READ, 0),
+                         ('system:anyuser', False, acl.READ,
+                          acl.READ | acl.LOOKUP)]
+    acl.revoke('system:anyuser', 'l')(b)
+    acl.replace('newuser', 'olduser')(b)
+    assert a == b
+
+
+def test_evaluate():
+    pts = FakePTS(users=5, groups=1)
+    pts._AddToGroup('user1', 'system:group1')
+    pts._AddToGroup('user2', 'system:administrators')
+    ev = acl.RightsEvaluator(pts)
+    a = acl.ACL({'system:anyuser': acl.LOOKUP,
+                 'system:group1': acl.readRights('write')},
+                {'1': acl.DELETE})
+    b = acl.ACL({'system:authuser': acl.READ}, {'system:group1': acl.READ})
+    assert 'system:group1' in ev.cps('user1')
+    assert ev.rights(a, 'user1') == acl.readRights('write') & ~acl.DELETE
+    assert ev.rights(a, None) == acl.LOOKUP
+    assert ev.evaluate([('/a', a), ('/b', b)], 1) == {'/a': ev.rights(a, 1),
+                                                      '/b': 0}
+    assert ev.rights(b, 'user2') == acl.READ | acl.LOOKUP | acl.ADMINISTER
+
+def test_evaluate_owner():
+    pts = FakePTS(users=5)
+    ev = acl.RightsEvaluator(pts)
+    b = acl.ACL({'system:authuser': acl.READ}, {})
+    assert ev.rights(b, 'user3') == acl.READ
+    assert ev.rights(b, 'user3', owner=3) == acl.READ | acl.ADMINISTER
+    assert ev.rights(b, 'user3', owner='user3', root=True) == \
+        acl.READ | acl.ADMINISTER | acl.LOOKUP
+    assert ev.rights(b, 'user4', owner=3, root=True) == acl.READ
+    assert ev.rights(b, None, owner=3) == 0
+    assert ev.evaluate([('/v', b), ('/v/d', b)], 'user3', 3, '/v') == \
+        {'/v': acl.READ | acl.ADMINISTER | acl.LOOKUP,
+         '/v/d': acl.READ | acl.ADMINISTER}
+
+class _FakeFS(object):
+    """Stand in for the pioctls afs.acl makes, over a real directory tree.
+
+    Directories named mnt* are mount points for another volume, and
+    cell* for another cell. Retrieving the ACL of a directory named
+    bad* fails. ACLs are kept in self.acls, by path.
+    """
+    def __init__(self):
+        self.top = tempfile.mkdtemp()
+        for d in ('a/b/c', 'mnt/x', 'cell/y', 'skip/z', 'bad/w'):
+            os.makedirs(os.path.join(self.top, d))
+        os.symlink(self.top, os.path.join(self.top, 'loop'))
+        self.acls = {}
+        self.sets = []
+        self.fids = []
+
+    def getfid(self, path, follow=1):
+        self.fids.append(path)
+        parts = os.path.relpath(path, self.top).split(os.sep)
+        cell = 2 if any(p.startswith('cell') for p in parts) else 1
+        volume = 2 if any(p.startswith('mnt') for p in parts) else 1
+        return (cell, volume, 1, 1)
+
+    def getAcl(self, path, follow=1):
+        if os.path.basename(path).startswith('bad'):
+            raise OSError(13, 'Permission denied')
+        pos, neg = self.acls.get(path, ({'system:anyuser': acl.READ}, {}))
+        return acl._unparseAcl(pos, neg)
+
+    def setAcl(self, path, text, follow=1):
+        self.sets.append(path)
+        self.acls[path] = acl._parseAcl(text)
+
+    def __enter__(self):
+        self._saved = (acl.getfid, acl._acl.getAcl, acl._acl.setAcl)
+        acl.getfid = self.getfid
+        acl._acl.getAcl = self.getAcl
+        acl._acl.setAcl = self.setAcl
+        return self
+
+    def __exit__(self, *exc):
+        acl.getfid, acl._acl.getAcl, acl._acl.setAcl = self._saved
+        shutil.rmtree(self.top)
+
+def _walked(fs, **kwargs):
+    return sorted(os.path.relpath(path, fs.top)
+                  for path, a in acl.walk(fs.top, **kwargs))
+
+def test_walk():
+    with _FakeFS() as fs:
+        errors = []
+        found = _walked(fs, exclude=['skip'],
+                        onerror=lambda path, e: errors.append(path))
+        assert found == ['.', 'a', 'a/b', 'a/b/c'], found
+        assert [os.path.basename(p) for p in errors] == ['bad']
+        try:
+            list(acl.walk(fs.top))
+        except OSError as e:
+            assert e.errno == 13
+        else:
+            assert False, "walk didn't raise the pioctl's error."
+
+def test_walk_boundary():
+    with _FakeFS() as fs:
+        ignore = lambda path, e: None
+        assert 'mnt/x' not in _walked(fs, onerror=ignore)
+        found = _walked(fs, boundary='cell', onerror=ignore)
+        assert 'mnt/x' in found and 'cell' not in found
+        found = _walked(fs, boundary=None, onerror=ignore)
+        assert 'mnt/x' in found and 'cell/y' in found
+        assert 'loop' not in found
+
+def test_walk_fids():
+    with _FakeFS() as fs:
+        ignore = lambda path, e: None
+        _walked(fs, boundary=None, onerror=ignore)
+        assert fs.fids == []
+        # Once for each directory reached, top included; mnt's and
+        # bad's subdirectories aren't
+        _walked(fs, onerror=ignore)
+        assert sorted(os.path.relpath(p, fs.top) for p in fs.fids) == \
+            ['.', 'a', 'a/b', 'a/b/c', 'bad', 'cell', 'mnt', 'skip',
+             'skip/z'], fs.fids
+
+def test_walk_filters():
+    with _FakeFS() as fs:
+        ignore = lambda path, e: None
+        assert _walked(fs, depth=0) == ['.']
+        assert _walked(fs, depth=1, onerror=ignore) == ['.', 'a', 'skip']
+        # Directories that don't match include are still descended into
+        assert _walked(fs, include=['a/*'], onerror=ignore) == ['a/b', 'a/b/c']
+        assert _walked(fs, exclude=['a/b', 'skip'], onerror=ignore) == ['.', 'a']
+
+def test_apply_skips_unchanged():
+    with _FakeFS() as fs:
+        a = acl.ACL.retrieve(fs.top)
+        assert not a.apply(fs.top)
+        assert fs.sets == []
+        a.set('jdoe', acl.READ)
+        assert a.apply(fs.top)
+        assert not a.apply(fs.top)
+        # Zero entries don't count as changes
+        a.remove('nobody')
+        assert not a.apply(fs.top)
+        other = os.path.join(fs.top, 'a')
+        assert a.apply(other)
+        assert fs.sets == [fs.top, other]
+
+def test_rewrite():
+    with _FakeFS() as fs:
+        b = os.path.join(fs.top, 'a', 'b')
+        fs.acls[b] = ({'system:anyuser': acl.READ, 'olduser': acl.READ}, {})
+        rw = acl.ACLRewrite(fs.top, [acl.replace('olduser', 'newuser')],
+                            dryrun=True, exclude=['bad'])
+        changes = list(rw)
+        assert changes == [(b, [('newuser', False, 0, acl.READ),
+                                ('olduser', False, acl.READ, 0)])]
+        assert acl.showDiff(changes[0][1]) == ['+ newuser r', '- olduser r']
+        assert rw.changed == [b] and rw.unchanged == 5 and not rw.failed
+        assert fs.sets == []
+        assert repr(rw).endswith('1 changed, 5 unchanged, 0 failed (dry run)>')
+
+        rw = acl.ACLRewrite(fs.top, [acl.grant('system:anyuser', 'l')]).run()
+        assert len(rw.changed) == 6 and rw.unchanged == 0
+        assert [os.path.basename(p) for p, e in rw.failed] == ['bad']
+        assert sorted(fs.sets) == sorted(rw.changed)
+        assert fs.acls[b][0] == {'system:anyuser': acl.READ | acl.LOOKUP,
+                                 'olduser': acl.READ}
+
+        # Running it again finds nothing to change
+        del fs.sets[:]
+        rw = acl.ACLRewrite(fs.top, [acl.grant('system:anyuser', 'l')]).run()
+        assert rw.changed == [] and rw.unchanged == 6 and fs.sets == []
+
 if __name__ == '__main__':
     nose.main()
 
@@ -0,0 +1,120 @@
+import sys
+import threading
+import nose
+
+if sys.version_info < (3, 7):
+    raise nose.SkipTest('afs.aio requires Python 3.7 or later')
+
+import asyncio
+import afs.acl as acl
+import afs.aio as aio
+from afs.aio import AsyncACL, AsyncPTS
+from afs.tests.fakepts import FakePTS, PAGESIZE
+
+def _run(*coros):
+    """Run coroutines to completion on a new event loop."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(asyncio.gather(*coros))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+def _peak(p):
+    """Record the largest number of RPCs p ever has in flight at once."""
+    lock = threading.Lock()
+    state = {'active': 0, 'peak': 0}
+    rpc = p._rpc
+    def counted(name):
+        with lock:
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+        try:
+            rpc(name)
+        finally:
+            with lock:
+                state['active'] -= 1
+    p._rpc = counted
+    return state
+
+def test_coalescing():
+    p = FakePTS(users=10, latency=0.05)
+    a = AsyncPTS(p)
+    entries = _run(*[a.getEntry('user5') for i in range(20)])
+    assert set(e.id for e in entries) == set([5])
+    assert p.rpcs == {'PR_NameToID': 1}, p.rpcs
+    a.close()
+
+def test_cell_limit():
+    p = FakePTS(users=40, latency=0.02)
+    state = _peak(p)
+    a = AsyncPTS(p, limit=2)
+    b = AsyncPTS(p, limit=3)
+    _run(*[x.getEntry(i) for x in (a, b) for i in range(1, 21)])
+    assert 2 <= state['peak'] <= 3, state
+
+    # The same objects from another event loop
+    p.expire()
+    state['peak'] = 0
+    _run(*[x.getEntry(i) for x in (a, b) for i in range(1, 21)])
+    assert 2 <= state['peak'] <= 3, state
+
+    # A later AsyncPTS for the cell, with a lower limit
+    p.expire()
+    state['peak'] = 0
+    c = AsyncPTS(p, limit=1)
+    _run(*[c.getEntry(i) for i in range(1, 21)])
+    assert state['peak'] == 1, state
+    for x in (a, b, c):
+        x.close()
+
+def test_connect_off_loop():
+    threads = []
+    def connect(cell, sec):
+        threads.append(threading.current_thread())
+        return FakePTS(users=10, latency=0.05)
+    real, aio.PTS = aio.PTS, connect
+    try:
+        a = AsyncPTS()
+        assert a.pts is None
+        entries = _run(*[a.getEntry('user5') for i in range(5)])
+    finally:
+        aio.PTS = real
+    assert len(threads) == 1 and threads[0] is not threading.current_thread()
+    assert set(e.id for e in entries) == set([5])
+    a.close()
+
+def test_iteration():
+    p = FakePTS(users=2 * PAGESIZE)
+    a = AsyncPTS(p)
+    loop = asyncio.new_event_loop()
+    entries = []
+    pages = a.iterEntries()
+    try:
+        while True:
+            entries.append(loop.run_until_complete(pages.__anext__()))
+    except StopAsyncIteration:
+        pass
+    finally:
+        loop.close()
+    assert len(entries) == 2 * PAGESIZE + 1
+    assert p.rpcs['PR_ListEntries'] == 3, p.rpcs
+    a.close()
+
+def test_pts_wrappers():
+    a = AsyncPTS()
+    ent, = _run(a.getEntry('system:administrators'))
+    assert ent.id == -204 and ent.name == 'system:administrators'
+    a.close()
+
+def test_acl_wrappers():
+    path = '/afs/athena.mit.edu/contrib/bitbucket2'
+    a = AsyncACL()
+    retrieved, access = _run(a.retrieve(path), a.getCallerAccess(path))
+    assert retrieved.pos['system:anyuser'] & acl.WRITE
+    assert access & acl.WRITE
+    a.close()
+
+if __name__ == '__main__':
+    nose.main()
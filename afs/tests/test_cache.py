@@ -0,0 +1,37 @@
+import time
+import nose
+from afs.cache import LRUCache
+
+def test_lru_eviction():
+    c = LRUCache(maxsize=2)
+    c['a'] = 1
+    c['b'] = 2
+    assert c.get('a') == 1
+    c['c'] = 3
+    assert 'b' not in c, "LRUCache didn't evict the least recently used item."
+    assert 'a' in c and 'c' in c
+    assert c.evictions == 1
+
+def test_ttl():
+    c = LRUCache(ttl=0.01)
+    c['a'] = 1
+    assert c.get('a') == 1
+    time.sleep(0.02)
+    assert c.get('a') is None, "LRUCache returned an expired item."
+    assert c.expirations == 1
+
+def test_counters():
+    c = LRUCache()
+    c['a'] = 1
+    c.get('a')
+    c.get('b')
+    stats = c.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 1)
+
+def test_setdefault():
+    c = LRUCache()
+    assert c.setdefault('a', 1) == 1
+    assert c.setdefault('a', 2) == 1
+
+if __name__ == '__main__':
+    nose.main()
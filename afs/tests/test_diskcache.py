@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import threading
+import nose
+from afs.diskcache import DiskCache
+from afs.tests.fakepts import FakePTS
+
+def _tmpdir(test):
+    def wrapper():
+        d = tempfile.mkdtemp()
+        try:
+            test(os.path.join(d, 'pts.db'))
+        finally:
+            shutil.rmtree(d)
+    wrapper.__name__ = test.__name__
+    return wrapper
+
+@_tmpdir
+def test_warm_start(path):
+    p = FakePTS(users=20, diskcache=path)
+    e = p.getEntry('user5')
+    flags, owner = e.flags, e.owner.id
+
+    # Another process, with an empty in-memory cache
+    q = FakePTS(users=20, diskcache=path)
+    e = q.getEntry('user5')
+    assert (e.id, e.flags, e.owner.id) == (5, flags, owner)
+    assert sum(q.rpcs.values()) == 0, q.rpcs
+
+@_tmpdir
+def test_bulk_lookups(path):
+    names = ['user%d' % i for i in range(1, 11)]
+    FakePTS(users=20, diskcache=path).getEntries(names[:5])
+    q = FakePTS(users=20, diskcache=path)
+    assert [e.id for e in q.getEntries(names)] == list(range(1, 11))
+    assert q.rpcs == {'PR_NameToID': 1}, q.rpcs
+    assert q.getEntries(['nobody']) == [None]
+
+@_tmpdir
+def test_expiry(path):
+    FakePTS(users=20, diskcache=DiskCache(path, ttl=0)).getEntry('user5')
+    q = FakePTS(users=20, diskcache=path)
+    q.getEntry('user5')
+    assert q.rpcs == {'PR_NameToID': 1}, q.rpcs
+
+@_tmpdir
+def test_changes_invalidate(path):
+    p = FakePTS(users=20, diskcache=path)
+    e = p.getEntry('user5')
+    e.flags
+    e.name = 'renamed'
+    e.ngroups = 3
+    q = FakePTS(users=20, diskcache=path)
+    q._entries, q._ids = p._entries, p._ids
+    assert q.getEntry(5).name == 'renamed'
+    assert q.getEntry(5).ngroups == 3
+
+@_tmpdir
+def test_concurrent_writers(path):
+    caches = [DiskCache(path) for i in range(4)]
+    def store(i):
+        caches[i].storeNames('example.com', [('user%d' % j, j)
+                                             for j in range(i, 400, 4)])
+    threads = [threading.Thread(target=store, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    found = caches[0].ids('example.com', ['user%d' % j for j in range(400)])
+    assert len(found) == 400 and found['user7'] == 7
+
+@_tmpdir
+def test_unusable(path):
+    # A directory where the database should be
+    os.mkdir(path)
+    p = FakePTS(users=20, diskcache=path)
+    assert p.getEntry('user5').id == 5
+    assert p.rpcs == {'PR_NameToID': 1}, p.rpcs
+
+@_tmpdir
+def test_counts(path):
+    cache = DiskCache(path)
+    cache.storeNames('example.com', [('user1', 1)])
+    def lookup():
+        for i in range(200):
+            cache.ids('example.com', ['user1', 'user2'])
+    threads = [threading.Thread(target=lookup) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert (cache.hits, cache.misses) == (800, 800), cache
+
+if __name__ == '__main__':
+    nose.main()
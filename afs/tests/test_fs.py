@@ -0,0 +1,102 @@
+import errno
+import os
+import shutil
+import tempfile
+import nose
+import afs.fs as fs
+
+def test_whichcell():
+    path = '/afs/athena.mit.edu/contrib/bitbucket2'
+    assert fs.whichcell(path) == 'athena.mit.edu'
+    assert fs.whichcell_many([path, '/']) == ['athena.mit.edu', None]
+
+def test_inafs():
+    assert fs.inafs('/afs/athena.mit.edu')
+    assert not fs.inafs('/')
+
+
+class _FakeFS(object):
+    """Stand in for the pioctls afs.fs makes, over a real directory tree.
+
+    Everything under top is in example.com, except that directories
+    named cell* are in other.example.com; nothing outside top is in
+    AFS. Each pioctl is recorded in self.calls as (name, path).
+    """
+    def __init__(self):
+        self.top = tempfile.mkdtemp()
+        for d in ('a/b', 'ab', 'cell/y'):
+            os.makedirs(os.path.join(self.top, d))
+        for f in ('a/1', 'a/2', 'a/b/3', 'cell/y/4'):
+            open(os.path.join(self.top, f), 'w').close()
+        self.calls = []
+
+    def _check(self, name, path):
+        self.calls.append((name, path))
+        if not path.startswith(self.top):
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+
+    def whichcell(self, path):
+        self._check('whichcell', path)
+        if 'cell' in os.path.relpath(path, self.top):
+            return 'other.example.com'
+        return 'example.com'
+
+    def getfid(self, path, follow=1):
+        self._check('getfid', path)
+        return (1, 1, 1, 1)
+
+    def path(self, *parts):
+        return os.path.join(self.top, *parts)
+
+    def __enter__(self):
+        fs.invalidate()
+        self._saved = (fs._fs.whichcell, fs.getfid)
+        fs._fs.whichcell = self.whichcell
+        fs.getfid = self.getfid
+        return self
+
+    def __exit__(self, *exc):
+        fs._fs.whichcell, fs.getfid = self._saved
+        fs.invalidate()
+        shutil.rmtree(self.top)
+
+def test_siblings():
+    with _FakeFS() as f:
+        a = f.path('a')
+        assert fs.whichcell(a) == 'example.com'
+        for name in ('1', '2'):
+            assert fs.whichcell(f.path('a', name)) == 'example.com'
+            assert fs.volumeid(f.path('a', name)) == 1
+        assert f.calls == [('whichcell', a), ('getfid', a)], f.calls
+
+def test_invalidate():
+    with _FakeFS() as f:
+        dirs = [f.path('a'), f.path('a', 'b'), f.path('ab'), f.path('cell', 'y')]
+        for d in dirs:
+            fs.whichcell(d)
+        del f.calls[:]
+        fs.invalidate(f.path('a'))
+        for d in dirs:
+            fs.whichcell(d)
+        assert f.calls == [('whichcell', d) for d in dirs[:2]], f.calls
+
+        del f.calls[:]
+        fs.invalidate()
+        fs.whichcell(f.path('ab'))
+        assert f.calls == [('whichcell', f.path('ab'))], f.calls
+
+def test_whichcell_many():
+    with _FakeFS() as f:
+        paths = [f.path('a', '1'), f.path('a', '2'), f.path('a'),
+                 f.path('a', 'b', '3'), f.path('cell', 'y', '4'), '/']
+        assert fs.whichcell_many(paths, workers=2) == \
+            ['example.com'] * 4 + ['other.example.com', None]
+        assert sorted(f.calls) == sorted(
+            ('whichcell', d) for d in (f.path('a'), f.path('a', 'b'),
+                                       f.path('cell', 'y'), '/')), f.calls
+        del f.calls[:]
+        fs.whichcell_many(paths)
+        assert f.calls == []
+
+if __name__ == '__main__':
+    nose.main()
@@ -0,0 +1,86 @@
+import nose
+from afs.graph import PTGraph
+from afs.tests.fakepts import FakePTS
+
+def _pts():
+    p = FakePTS(users=20, groups=3, members=8)
+    p._CreateGroup('user1:a', 'user1')
+    p._CreateGroup('user1:b', 'user1:a')
+    p._CreateGroup('user2:x', 'user2')
+    p._Delete('user2')
+    return p
+
+def test_members():
+    p = _pts()
+    g = PTGraph(p)
+    assert len(g) == len(list(p._ListEntries(True, True)))
+    for gid in (-205, -206, -207):
+        assert g.members(gid) == frozenset(p._ListMembers(gid))
+        for uid in g.members(gid):
+            assert gid in g.groups(uid)
+    assert g.members('system:group1') == g.members(-205)
+    assert g.name(-205) == 'system:group1'
+    assert 'user2' not in g and 1 in g
+
+def test_owned():
+    p = _pts()
+    g = PTGraph(p)
+    a, b = p._NameToId('user1:a'), p._NameToId('user1:b')
+    assert g.owned('user1') == frozenset([a])
+    assert g.owned('user1', transitive=True) == frozenset([a, b])
+    assert g.ownerChain(b) == [a, 1, -204]
+    assert g.orphans() == frozenset([p._NameToId('user2:x')])
+
+def test_intersection():
+    p = _pts()
+    g = PTGraph(p)
+    both = set(p._ListMembers(-205)) & set(p._ListMembers(-206))
+    assert g.intersection(-205, 'system:group2') == both
+    assert g.intersection() == frozenset()
+
+def test_refresh():
+    p = _pts()
+    g = PTGraph(p)
+    a = p._NameToId('user1:a')
+    gone = p._ListMembers(-205)[0]
+    new = [u for u in range(3, 21) if u not in p._ListMembers(-205)][0]
+    p._RemoveFromGroup(gone, -205)
+    p._AddToGroup(new, -205)
+    p._ChangeEntry(a, newoid=3)
+    p._CreateGroup('user3:c', 'user3')
+    p._Delete('user1:b')
+    p.rpcs.clear()
+
+    g.refresh([-205, a, 'user3:c', 'user1:b'])
+    assert g.members(-205) == frozenset(p._ListMembers(-205))
+    assert -205 in g.groups(new) and -205 not in g.groups(gone)
+    assert g.owner(a) == 3
+    assert g.owned(3) == frozenset([a, p._NameToId('user3:c')])
+    assert g.owned('user1', transitive=True) == frozenset()
+    assert 'user1:b' not in g
+    assert p.rpcs['PR_ListEntries'] == 0, p.rpcs
+
+def test_refresh_new_group():
+    p = _pts()
+    g = PTGraph(p)
+    gid = p._CreateGroup('user1:new', 'user1')
+    p._AddToGroup(1, gid)
+    g.refresh([1])
+    assert gid in g.groups(1)
+    assert g.members(gid) == frozenset([1])
+    assert g.owner(gid) == 1
+
+def test_refresh_readd():
+    p = _pts()
+    g = PTGraph(p)
+    p._Delete('user5')
+    g.refresh(['user5'])
+    assert 5 not in g
+    p._create('user5', -204, 5, False)
+    p._AddToGroup(5, -205)
+    g.refresh([5])
+    assert list(g._ids).count(5) == 1 and len(g) == len(g._index)
+    assert g.groups(5) == frozenset([-205]) and 5 in g.members(-205)
+
+if __name__ == '__main__':
+    nose.main()
@@ -0,0 +1,183 @@
+import nose
+from afs._pts import PREXIST
+from afs._util import AFSException
+from afs.tests.fakepts import FakePTS, PAGESIZE
+
+def _pts(**kwargs):
+    kwargs.setdefault('users', 100)
+    kwargs.setdefault('groups', 10)
+    kwargs.setdefault('members', 20)
+    return FakePTS(**kwargs)
+
+def test_get_entry_by_id_is_cached():
+    p = _pts()
+    e = p.getEntry(1)
+    assert e.name == 'user1'
+    p.rpcs.clear()
+    assert p.getEntry(1) is e
+    assert sum(p.rpcs.values()) == 0, p.rpcs
+
+def test_get_entries_is_batched():
+    p = _pts()
+    names = ['user%d' % i for i in range(1, 101)] + ['nobody']
+    entries = p.getEntries(names)
+    assert entries[-1] is None
+    assert [e.name for e in entries[:-1]] == names[:-1]
+    assert p.rpcs == {'PR_NameToID': 1}, p.rpcs
+
+def test_small_cache():
+    p = _pts(users=50, members=50, cachesize=10)
+    entries = p.getEntries(range(1, 51))
+    assert [e.id for e in entries] == list(range(1, 51))
+    g = p.getEntry(-205)
+    assert len(g.members) == 50
+    assert len(list(g.members)) == 50
+    e = p.getEntries(range(1, 51))[0]
+    e.id = 1000
+    assert p.getEntry(1000) is e
+
+def test_evicted_member():
+    p = _pts(users=20, groups=1, members=20, cachesize=3)
+    g = p.getEntry(-205)
+    u = list(g.members)[0]
+    p.getEntries(range(1, 21))
+    assert p._cache.get(u.id) is not u
+    g.members.discard(p.getEntry(u.id))
+    assert len(g.members) == 19
+    assert u.id not in [e.id for e in g.members]
+    assert not p._IsAMemberOf(u.id, -205)
+
+def test_replace_unresolvable_member():
+    p = _pts()
+    ids = p._ListMembers(-205)
+    keep, gone = ids[:5], ids[-1]
+    # The server still lists gone as a member, but can't name it
+    with p._lock:
+        del p._ids[p._entries.pop(gone).name]
+    g = p.getEntry(-205)
+    result = g.members.replace(keep)
+    assert gone in result.succeeded and not result.failed, result
+    assert g.members.ids() == frozenset(keep)
+    assert p._ListMembers(-205) == keep
+
+def test_members_load_in_two_rpcs():
+    p = _pts()
+    g = p.getEntry(-205)
+    p.rpcs.clear()
+    assert len(list(g.members)) == 20
+    assert p.rpcs == {'PR_ListElements': 1, 'PR_IDToName': 1}, p.rpcs
+
+def test_iteration_is_paged():
+    p = _pts(users=3 * PAGESIZE)
+    entries = list(p.iterEntries())
+    assert len(entries) == 3 * PAGESIZE + 1
+    assert p.rpcs['PR_ListEntries'] == 4, p.rpcs
+    p.rpcs.clear()
+    for e in entries:
+        e.owner, e.creator, e.flags
+    assert sum(p.rpcs.values()) == 0, p.rpcs
+
+def test_cps_is_cached():
+    p = _pts()
+    u = p.getEntry(list(p.getEntry(-205).members.ids())[0])
+    p.rpcs.clear()
+    assert -205 in u.cps
+    assert -101 in u.cps
+    assert u in p.getEntry(-205).members
+    assert p.rpcs == {'PR_GetCPS': 1}, p.rpcs
+
+def test_membership_changes():
+    p = _pts()
+    g = p.getEntry(-205)
+    u = p.getEntry('user1')
+    g.members.discard(u)
+    assert u not in g.members
+    g.members.add(u)
+    assert u in g.members
+    assert -205 in u.cps
+    assert p._IsAMemberOf(1, -205)
+
+def test_create_users_in_bulk():
+    p = _pts()
+    names = ['new%d' % i for i in range(50)]
+    p.rpcs.clear()
+    r = p.createUsers(names + ['user1'], groups={'new1': ['system:group1']})
+    assert p.rpcs['PR_INewEntry'] == 51, p.rpcs
+    assert p.rpcs['PR_SetMax'] == 1, p.rpcs
+    assert p.rpcs['PR_NameToID'] == 1, p.rpcs
+    assert [e.name for e in r.succeeded] == names
+    assert [e.id for e in r.succeeded] == list(range(101, 151))
+    assert r.failed[0][0] == 'user1'
+    assert r.failed[0][1].errno == PREXIST
+    assert p.umax == 151
+    assert 102 in p._ListMembers('system:group1')
+
+def test_create_groups_in_bulk():
+    p = _pts()
+    r = p.createGroups(['system:a', 'system:b'],
+                       owners={'system:b': 'system:a'},
+                       members={'system:a': ['user1', 'user2'],
+                                'system:b': ['nobody']})
+    assert [e.name for e in r.succeeded] == ['system:a']
+    assert r.failed[0][0] == 'system:b'
+    assert p.getEntry('system:b').owner.name == 'system:a'
+    assert set(p._ListMembers('system:a')) == set([1, 2])
+
+def test_batched_writes():
+    p = _pts()
+    ents = p.getEntries(['user1', 'user2', 'user3'])
+    owner = p.getEntry('system:group1')
+    p.rpcs.clear()
+    with p.batch():
+        for e in ents:
+            e.name = e.name + 'x'
+            e.owner = owner
+            e.flags = 1
+            e.ngroups = 5
+            e.nusers = 2
+        assert sum(p.rpcs.values()) == 0, p.rpcs
+    assert p.rpcs == {'PR_ChangeEntry': 3, 'PR_SetFieldsEntry': 3}, p.rpcs
+    rec = p._ListEntry('user2x')
+    assert (rec.owner, rec.flags, rec.ngroups, rec.nusers) == (owner.id, 1, 5, 2)
+
+def test_failed_batch_write():
+    p = _pts()
+    u1, u3 = p.getEntries(['user1', 'user3'])
+    try:
+        with p.batch() as b:
+            u1.name = 'user2'
+            u3.ngroups = 7
+    except AFSException as e:
+        assert e.errno == PREXIST
+    else:
+        assert False, 'Renaming onto an existing name succeeded.'
+    assert b.result.succeeded == [u3]
+    assert u1.name == 'user1'
+    assert p._ListEntry('user3').ngroups == 7
+
+def test_refresh():
+    p = _pts()
+    g = p.getEntry(-205)
+    u1, u2, u3 = p.getEntries(['user1', 'user2', 'user3'])
+    len(g.members)
+    u1.flags
+    assert p.refresh() == []
+
+    seen = []
+    p.subscribe(lambda kind, ent: seen.append((kind, ent.name)))
+    p._ChangeEntry(2, newname='renamed')
+    p._Delete(3)
+    p._AddToGroup(1 if 1 not in p._members[-205] else 4, -205)
+    p._CreateUser('newuser')
+    p.rpcs.clear()
+    changes = p.refresh()
+    assert p.rpcs == {'PR_ListMax': 1, 'PR_ListEntries': 1}, p.rpcs
+    assert ('modified', u2) in changes and u2.name == 'renamed'
+    assert ('removed', u3) in changes and 3 not in p._cache
+    assert ('modified', g) in changes
+    assert not hasattr(g.members, '_ids')
+    assert [e.name for (kind, e) in changes if kind == 'added'] == ['newuser']
+    assert seen == [(kind, e.name) for (kind, e) in changes]
+
+if __name__ == '__main__':
+    nose.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import nose
+from afs.reconcile import Reconciler, readDesired, readPlan, writePlan
+from afs.tests.fakepts import FakePTS
+
+def _pts():
+    return FakePTS(users=20, groups=3, members=5)
+
+def _desired():
+    return {'system:group1': ['user1', 'user2', 'user3', 'nobody'],
+            'system:new': ['user4', 'system:group2']}
+
+def _members(p, group):
+    return set(p._IdsToNames(p._ListMembers(group)))
+
+def test_plan():
+    p = _pts()
+    old = _members(p, 'system:group1')
+    p.rpcs.clear()
+    r = Reconciler(p, _desired(), owners={'system:new': 'system:group2'})
+    plan = r.plan()
+    assert plan[0] == ('create', 'system:new', 'system:group2')
+    assert ('add', 'system:new', 'user4') in plan
+    adds = set(t for (a, g, t) in plan if a == 'add' and g == 'system:group1')
+    removes = set(t for (a, g, t) in plan if a == 'remove')
+    assert adds == set(['user1', 'user2', 'user3']) - old
+    assert removes == old - set(['user1', 'user2', 'user3'])
+    assert r.missing == ['nobody']
+    assert 'PR_IsAMemberOf' not in p.rpcs, p.rpcs
+    assert p.rpcs['PR_ListElements'] == 1, p.rpcs
+
+def test_dryrun():
+    p = _pts()
+    r = Reconciler(p, _desired(), dryrun=True)
+    assert list(r) == r.plan()
+    p.rpcs.clear()
+    r.run()
+    assert sum(p.rpcs.values()) == 0, p.rpcs
+    assert 'system:new' not in p._ids
+
+def test_apply_and_resume():
+    d = tempfile.mkdtemp()
+    try:
+        checkpoint = os.path.join(d, 'done')
+        p = _pts()
+        plan = Reconciler(p, _desired()).plan()
+        # An interrupted run
+        Reconciler(p, plan=plan[:2], checkpoint=checkpoint).run()
+
+        r = Reconciler(p, plan=plan, checkpoint=checkpoint,
+                       rate=1000, workers=4).run()
+        assert r.skipped == 2 and not r.failed, r
+        assert _members(p, 'system:group1') == set(['user1', 'user2', 'user3'])
+        assert _members(p, 'system:new') == set(['user4', 'system:group2'])
+        assert set(readPlan(open(checkpoint))) == set(plan)
+        assert Reconciler(p, _desired()).plan() == []
+    finally:
+        shutil.rmtree(d)
+
+def test_plan_file():
+    d = tempfile.mkdtemp()
+    try:
+        path = os.path.join(d, 'plan')
+        plan = Reconciler(_pts(), _desired(), dryrun=True).plan()
+        f = open(path, 'w')
+        writePlan(plan, f)
+        f.close()
+        assert readPlan(open(path)) == plan
+    finally:
+        shutil.rmtree(d)
+
+def test_read_desired():
+    lines = ['# comment\n', 'system:a  x y\n', '\n', 'system:a z\n',
+             'system:b\n']
+    assert list(readDesired(lines)) == [('system:a', ['x', 'y']),
+                                        ('system:a', ['z']),
+                                        ('system:b', [])]
+
+if __name__ == '__main__':
+    nose.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import nose
+from afs.snapshot import SnapshotPTS, dump
+from afs.tests.fakepts import FakePTS, PAGESIZE
+
+def _snapshot(test):
+    def wrapper():
+        d = tempfile.mkdtemp()
+        try:
+            test(os.path.join(d, 'prdb'))
+        finally:
+            shutil.rmtree(d)
+    wrapper.__name__ = test.__name__
+    return wrapper
+
+def _pts():
+    p = FakePTS(users=PAGESIZE + 10, groups=5, members=10)
+    # A nested group, and a group whose owner has been deleted
+    p._AddToGroup(-206, -205)
+    p._CreateGroup('user3:orphans', 'user3')
+    p._Delete('user3')
+    return p
+
+@_snapshot
+def test_round_trip(path):
+    p = _pts()
+    dump(p, path)
+    s = SnapshotPTS(path)
+    assert s.cell == p.cell
+    assert s._ListMax() == p._ListMax()
+    fields = lambda e: (e.id, e.name, e.owner, e.flags, e.count)
+    assert list(map(fields, s._ListEntries(True, True))) == \
+        list(map(fields, p._ListEntries(True, True)))
+    for g in range(-210, -204):
+        assert sorted(s._ListMembers(g)) == sorted(p._ListMembers(g))
+    assert s._ListEntry('user3:orphans').owner == 3
+    assert s._ListOwned(-204) == sorted(p._ListOwned(-204))
+    assert s._ListOwned(-204) and all(g < 0 for g in s._ListOwned(-204))
+
+@_snapshot
+def test_queries(path):
+    p = _pts()
+    dump(p, path)
+    s = SnapshotPTS(path)
+    u = p._ListMembers(-206)[0]
+    assert s.getEntry(u).name == 'user%d' % u
+    assert s.getEntry('system:group1').id == -205
+    assert s.getEntry(-206) in s.getEntry('system:group1').members
+    assert s._GetCPS(u) == p._GetCPS(u)
+    # Through system:group2, which is a member of system:group1
+    assert s._IsAMemberOf(u, -205) and p._IsAMemberOf(u, -205)
+    assert s._IsAMemberOf(u, 'system:anyuser')
+    for g in range(-210, -204):
+        assert s._IsAMemberOf(u, g) == p._IsAMemberOf(u, g)
+    assert s.getEntries(['user1', 'user3', 'nobody'])[1:] == [None, None]
+
+@_snapshot
+def test_close(path):
+    dump(_pts(), path)
+    with SnapshotPTS(path) as s:
+        e = s.getEntry('user1')
+        assert e.id == 1
+    assert e.name == 'user1'
+    try:
+        s._ListEntry('user2')
+    except ValueError:
+        pass
+    else:
+        assert False, "SnapshotPTS still readable after close."
+
+if __name__ == '__main__':
+    nose.main()
@@ -0,0 +1,35 @@
+import nose
+from afs import stats
+
+class _Owner(object):
+    pass
+
+def test_registry():
+    r = stats.Registry()
+    calls = []
+    r.addHook(lambda op, owner: calls.append(('pre', op)),
+              lambda op, owner, code, seconds: calls.append(('post', op, code)))
+    owner = _Owner()
+    r._end(owner, 'PR_ListEntry', r._start(owner, 'PR_ListEntry'), 0)
+    r._end(None, 'VIOCGETAL', r._start(None, 'VIOCGETAL'), 13)
+    assert calls == [('pre', 'PR_ListEntry'), ('post', 'PR_ListEntry', 0),
+                     ('pre', 'VIOCGETAL'), ('post', 'VIOCGETAL', 13)]
+    assert sorted(r.stats()) == ['PR_ListEntry', 'VIOCGETAL']
+    assert list(r.stats(owner)) == ['PR_ListEntry']
+    assert r.stats()['VIOCGETAL'].errors == {13: 1}
+    r.reset()
+    assert r.stats() == {}
+
+def test_histogram():
+    s = stats.OpStats()
+    for seconds in [0.001] * 98 + [0.5, 100]:
+        s.record(seconds, 0)
+    assert s.count == 100
+    assert sum(s.buckets) == 100
+    assert s.buckets[-1] == 1
+    assert s.percentile(50) == 0.001
+    assert s.percentile(99) == 0.5
+    assert s.percentile(100) == 100
+
+if __name__ == '__main__':
+    nose.main()
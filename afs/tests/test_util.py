@@ -0,0 +1,50 @@
+import threading
+import time
+import nose
+from afs import util
+
+def test_imap_serial():
+    results = sorted(r for _, r, _ in util.imap(lambda x: x * 2, range(5), 1))
+    assert results == [0, 2, 4, 6, 8]
+
+def test_imap_errors():
+    def f(x):
+        if x == 3:
+            raise ValueError(x)
+        return x
+    failed = [(i, e) for i, _, e in util.imap(f, range(5), 3) if e is not None]
+    assert len(failed) == 1 and failed[0][0] == 3
+    assert isinstance(failed[0][1], ValueError)
+
+def test_imap_bounded():
+    lock = threading.Lock()
+    state = {'now': 0, 'peak': 0}
+    def f(x):
+        with lock:
+            state['now'] += 1
+            state['peak'] = max(state['peak'], state['now'])
+        time.sleep(0.01)
+        with lock:
+            state['now'] -= 1
+        return x
+    results = sorted(r for _, r, _ in util.imap(f, range(20), 4))
+    assert results == list(range(20))
+    assert 1 < state['peak'] <= 4
+
+class _Fatal(BaseException):
+    pass
+
+def test_imap_fatal():
+    def f(x):
+        if x == 3:
+            raise _Fatal(x)
+        return x
+    try:
+        list(util.imap(f, range(10), 3))
+    except _Fatal:
+        pass
+    else:
+        assert False, "imap didn't raise the worker's exception."
+
+if __name__ == '__main__':
+    nose.main()
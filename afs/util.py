@@ -0,0 +1,112 @@
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# The default number of RPCs or pioctls to have in flight at once for
+# bulk operations
+WORKERS = 8
+
+_STOP = object()
+
+
+class BulkResult(object):
+    """The outcome of an operation applied to many items at once.
+
+    A BulkResult is true if the operation succeeded for every item.
+
+    Attributes:
+      succeeded: A list of the items the operation succeeded for
+      failed: A list of (item, exception) pairs for the items the
+        operation failed for
+    """
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+
+    def __nonzero__(self):
+        return not self.failed
+    __bool__ = __nonzero__
+
+    def __repr__(self):
+        return '<BulkResult: %d succeeded, %d failed>' % (
+            len(self.succeeded), len(self.failed))
+
+
+def imap(func, items, workers=WORKERS):
+    """Apply func to each of items using a bounded pool of threads.
+
+    At most workers calls to func are in flight at any time, and items
+    is consumed no faster than results are, so items may be an
+    arbitrarily long iterator.
+
+    Args:
+      func: The function to call on each item
+      items: An iterable of arguments to func
+      workers: The maximum number of concurrent calls to func. If 1 or
+        less, func is called serially in the calling thread.
+
+    Returns:
+      An iterator of (item, result, exception) tuples, in the order
+      the calls complete. Exactly one of result and exception is
+      meaningful; exception is None if the call succeeded. Exceptions
+      that don't derive from Exception, such as KeyboardInterrupt,
+      are raised instead.
+    """
+    if workers <= 1:
+        for item in items:
+            try:
+                result = func(item)
+            except Exception as e:
+                yield item, None, e
+            else:
+                yield item, result, None
+        return
+
+    tasks = queue.Queue()
+    results = queue.Queue()
+
+    def work():
+        while True:
+            item = tasks.get()
+            if item is _STOP:
+                return
+            try:
+                results.put((item, func(item), None))
+            except Exception as e:
+                results.put((item, None, e))
+            except BaseException as e:
+                # Hand it to the caller, rather than leaving it waiting
+                # for a result that will never come
+                results.put((_STOP, None, e))
+                return
+
+    def result():
+        r = results.get()
+        if r[0] is _STOP:
+            raise r[2]
+        return r
+
+    threads = []
+    pending = 0
+    try:
+        for item in items:
+            if len(threads) < workers:
+                t = threading.Thread(target=work)
+                t.daemon = True
+                t.start()
+                threads.append(t)
+            tasks.put(item)
+            pending += 1
+            if pending >= workers:
+                yield result()
+                pending -= 1
+        while pending:
+            yield result()
+            pending -= 1
+    finally:
+        for t in threads:
+            tasks.put(_STOP)
+        for t in threads:
+            t.join()